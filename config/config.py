@@ -11,7 +11,33 @@ Config = {
     'logging_dir': './logs/',              # usually './logs'
     'webapi_host': '127.0.0.1',
     'webapi_port': 8080,
+    'webapi_workers': 1,                   # default for `python -m webapi --workers N`, >1 pre-forks N processes
     'keras_model_name': 'twitter_to_lang',
+    'predict_batch_size': 256,             # max number of sentences scored by the model in a single call
+    'micro_batch_max_size': 64,            # pending sentences across concurrent requests which trigger a model call
+    'micro_batch_max_wait_ms': 3,          # max time a sentence waits for other requests to join its batch
+    'model_warmup_batch_sizes': [1, 8, 64, 256], # batch sizes run through the model at startup, before it reports ready
+    'inference_threads': 2,                # size of the thread pool running model calls off the event loop
+    'prediction_cache_size': 100000,       # max cached sentence predictions per process, 0 disables the cache
+    'prediction_cache_ttl_seconds': 3600,  # age after which a cached prediction is scored again
+    'prediction_cache_warmup_limit': 10000, # most recent stored predictions cached at startup, 0 disables warm-up
+    'event_store_format': 'json',          # 'json' (database/store.events) or 'binary' (database/store.events.bin)
+    'event_store_segment_max_mb': 0,       # >0 rolls the store over into database/store.segments/ at this size
+    'event_store_segment_max_age_hours': 24, # with segments, also seal the active segment once it is this old
+    'event_store_segment_compression': 'gzip', # 'gzip', 'lzma' or None: codec for sealed segments, applied in the background
+    'event_store_fsync': 'always',         # 'always', 'interval' or 'never': when stored predictions are forced to disk
+    'event_store_fsync_interval_ms': 50,   # with 'interval', the minimum time between two syncs of the event store
+    'event_store_snapshot_every': 100,     # snapshot a prediction every this many events (database/store.snapshots), 0 disables
+    'event_store_checkpoint_every': 1000,  # projections in database/projections/ save a checkpoint every this many events, in the background
+    'event_store_history_checkpoint_every': 50000, # the prediction history and phrase index, whose checkpoints hold every prediction, save one every this many events
+    'prediction_history_max_rows': None, # most recent predictions each worker keeps in memory and phrase index for GET /predictions, None keeps all
+    'predictions_page_max_size': 10000,    # largest limit accepted by GET /predictions
+    'stream_chunk_bytes': 65536,           # bulk responses are streamed in chunks of about this size
+    'compression_min_bytes': 1024,         # smaller responses are sent uncompressed, None disables gzip/deflate
+    'compression_executor_min_bytes': 65536, # larger bodies are compressed off the event loop
+    'compression_level': 6,                # zlib level, 1 (fastest) to 9 (smallest), see scripts.benchmark_compression
+    'stats_minute_buckets': 1440,          # per-minute prediction counts kept for GET /stats, a day
+    'stats_hour_buckets': 720,             # per-hour prediction counts kept for GET /stats, 30 days
     'keras_api_key_secret': 'secret'
 }
 
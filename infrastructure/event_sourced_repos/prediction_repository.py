@@ -1,4 +1,5 @@
 from contexts.prediction.domain.model import prediction
+from infrastructure.read_models.phrase_index import PhraseIndex
 from library.infrastructure_architecture.event_sourced_architecture.event_tracking_repository import \
     EventTrackingRepository
 
@@ -84,6 +85,14 @@ class PredictionRepository(prediction.Repository, EventTrackingRepository):
         Returns:
             An iterable series of Predictions.
         """
+        phrase_index = self.persistent_event_store.projection(PhraseIndex)
+        if phrase_index is not None:
+            # Only the indexed candidates, and the unsaved predictions, are loaded
+            candidate_ids = set(phrase_index.ids_with_phrase(phrase)).intersection(self._extant_aggregate_ids())
+            candidate_ids.update(self._instantiated_ids())
+            if prediction_ids is not None:
+                candidate_ids.intersection_update(prediction_ids)
+            prediction_ids = candidate_ids
         return filter(lambda prediction: prediction.phrase == phrase,
                       self.predictions_with_ids(prediction_ids))
 
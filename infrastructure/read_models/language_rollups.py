@@ -0,0 +1,157 @@
+import numpy as np
+
+from contexts.prediction.domain.model.prediction import Prediction
+from library.infrastructure_architecture.event_sourced_architecture.projections import Projection
+
+OTHER_LANGUAGE = 'other'  # the column counting predictions of languages which are not labels of the model
+
+DEFAULT_RESOLUTIONS = {'minute': (60, 1440), 'hour': (3600, 720)}  # {name: (bucket seconds, buckets kept)}
+
+
+class LanguageRollups(Projection):
+    """Counts of stored predictions per language, in total and per time bucket.
+
+    Columns are the labels of the model, in the order of its output units, followed
+    by OTHER_LANGUAGE. For each resolution the counts of the most recent buckets are
+    kept in a ring of NumPy counters, so both recording a prediction and reading a
+    window of buckets cost the same however long the history is. Buckets older than
+    the ring are overwritten and predictions falling in them are only counted in the
+    totals. Discarded predictions stay counted, as they were made.
+
+    Example:
+
+        rollups = LanguageRollups(es, app['model'].labels.tolist())
+        start, counts = rollups.window('minute', 60)
+        per_language_last_hour = dict(zip(rollups.languages, counts.sum(axis=0).tolist()))
+    """
+
+    def __init__(self, event_store, labels, resolutions=None, **kwargs):
+        """Create the rollups. See Projection for the keyword arguments.
+
+        Args:
+            event_store: An EventStore.
+            labels: The sequence of language labels of the model.
+            resolutions: An optional mapping of resolution names to pairs of the length
+                of a bucket in seconds and the number of buckets kept. Defaults to
+                DEFAULT_RESOLUTIONS.
+        """
+        self._labels = list(labels)
+        self._columns = {label: column for column, label in enumerate(self._labels)}
+        self._other_column = len(self._labels)
+        self._totals = np.zeros(len(self._labels) + 1, dtype=np.int64)
+        resolutions = DEFAULT_RESOLUTIONS if resolutions is None else resolutions
+        self._rollups = {name: _Rollup(seconds, count, len(self._labels) + 1)
+                         for name, (seconds, count) in resolutions.items()}
+        super().__init__(event_store, **kwargs)
+
+    @property
+    def languages(self):
+        """The languages of the columns of the counts."""
+        return self._labels + [OTHER_LANGUAGE]
+
+    @property
+    def resolutions(self):
+        """A dictionary of resolution names to pairs of bucket seconds and buckets kept."""
+        return {name: (rollup.seconds, rollup.count) for name, rollup in self._rollups.items()}
+
+    def totals(self):
+        """An array of the number of predictions of each language."""
+        self.catch_up()
+        with self._lock:
+            return self._totals.copy()
+
+    def window(self, resolution, count=None, now=None):
+        """The counts of the most recent buckets of a resolution.
+
+        Args:
+            resolution: The name of a resolution, e.g. 'minute'.
+            count: The number of buckets, at most the number kept, or None for all kept.
+            now: The UTC timestamp in the last bucket. Defaults to the timestamp of the
+                latest prediction counted.
+
+        Returns:
+            A pair of the UTC timestamp at which the first bucket starts and an array of
+            shape (count, len(languages)) with the counts of each bucket, oldest first.
+
+        Raises:
+            ValueError: If the resolution is unknown or count is out of range.
+        """
+        try:
+            rollup = self._rollups[resolution]
+        except KeyError:
+            raise ValueError("Unknown resolution {!r}".format(resolution))
+        count = rollup.count if count is None else count
+        if not 1 <= count <= rollup.count:
+            raise ValueError("The number of buckets must be between 1 and {}".format(rollup.count))
+        self.catch_up()
+        with self._lock:
+            return rollup.window(count, now)
+
+    def _apply(self, event):
+        if isinstance(event, Prediction.Created):
+            column = self._columns.get(event.language, self._other_column)
+            self._totals[column] += 1
+            for rollup in self._rollups.values():
+                rollup.add(event.timestamp, column)
+
+    def _state_to_jsonable(self):
+        return {'labels': list(self._labels), 'totals': self._totals.tolist(),
+                'rollups': {name: rollup.to_jsonable() for name, rollup in self._rollups.items()}}
+
+    def _state_from_jsonable(self, state):
+        if state['labels'] != self._labels or set(state['rollups']) != set(self._rollups):
+            raise ValueError("The labels or resolutions have changed")
+        totals = np.asarray(state['totals'], dtype=np.int64)
+        if totals.shape != self._totals.shape:
+            raise ValueError("Expected {} totals".format(len(self._totals)))
+        rollups = {name: self._rollups[name].from_jsonable(rollup_state)
+                   for name, rollup_state in state['rollups'].items()}
+        self._totals = totals
+        self._rollups = rollups
+
+
+class _Rollup:
+    """A ring of the counts per column of the most recent buckets of a given length."""
+
+    def __init__(self, seconds, count, columns):
+        self.seconds = seconds
+        self.count = count
+        self.bucket_ids = np.full(count, -1, dtype=np.int64)  # the bucket held by each slot, -1 if none
+        self.counts = np.zeros((count, columns), dtype=np.uint32)
+        self.latest_bucket_id = -1
+
+    def add(self, timestamp, column):
+        bucket_id = int(timestamp // self.seconds)
+        slot = bucket_id % self.count
+        if self.bucket_ids[slot] != bucket_id:
+            if self.bucket_ids[slot] > bucket_id:
+                return  # older than the buckets kept
+            self.bucket_ids[slot] = bucket_id
+            self.counts[slot] = 0
+        self.counts[slot, column] += 1
+        self.latest_bucket_id = max(self.latest_bucket_id, bucket_id)
+
+    def window(self, count, now=None):
+        last_bucket_id = self.latest_bucket_id if now is None else int(now // self.seconds)
+        bucket_ids = np.arange(last_bucket_id - count + 1, last_bucket_id + 1, dtype=np.int64)
+        slots = bucket_ids % self.count
+        kept = self.bucket_ids[slots] == bucket_ids
+        counts = np.where(kept[:, np.newaxis], self.counts[slots], 0).astype(np.uint32)
+        return float(bucket_ids[0] * self.seconds), counts
+
+    def to_jsonable(self):
+        slots = np.flatnonzero(self.bucket_ids >= 0)
+        return {'seconds': self.seconds, 'count': self.count,
+                'buckets': [[int(self.bucket_ids[slot]), self.counts[slot].tolist()] for slot in slots]}
+
+    def from_jsonable(self, state):
+        """A rollup of the same buckets holding the counts saved by to_jsonable()."""
+        if state['seconds'] != self.seconds or state['count'] != self.count:
+            raise ValueError("The resolutions have changed")
+        rollup = _Rollup(self.seconds, self.count, self.counts.shape[1])
+        for bucket_id, counts in state['buckets']:
+            slot = bucket_id % self.count
+            rollup.bucket_ids[slot] = bucket_id
+            rollup.counts[slot] = counts
+        rollup.latest_bucket_id = int(rollup.bucket_ids.max())
+        return rollup
@@ -0,0 +1,77 @@
+from collections import Counter, defaultdict, deque
+
+from contexts.prediction.domain.model.prediction import Prediction
+from library.infrastructure_architecture.event_sourced_architecture.projections import Projection
+from utilities.text import normalize_sentence
+
+
+class PhraseIndex(Projection):
+    """A hash index from normalized phrase to the ids of the predictions of that phrase.
+
+    Phrases are normalized as the prediction cache does, folding case and whitespace,
+    so the ids with a phrase are a superset of those with exactly that phrase, which
+    callers filter. Discarded predictions are filtered out by callers too, e.g. by the
+    extant prediction ids. The index is held in memory, at roughly the size of an id
+    per prediction plus each distinct phrase. With max_ids only the ids of the most
+    recent predictions are kept, dropping older ones as PredictionHistory drops its
+    rows with the same max_rows.
+
+    Example:
+
+        index = PhraseIndex(es)
+        es.add_projection(index)
+        prediction_ids = index.ids_with_phrase("Foo bar baz")
+    """
+
+    def __init__(self, event_store, max_ids=None, **kwargs):
+        """Create the index. See Projection for the other keyword arguments.
+
+        Args:
+            event_store: An EventStore.
+            max_ids: The number of ids of the most recent predictions kept, or None to keep them all.
+        """
+        self._max_ids = max_ids
+        self._ids = defaultdict(list)  # {normalized phrase: [prediction id, ...]}
+        self._phrases = deque()  # the normalized phrase of each id kept, oldest first
+        super().__init__(event_store, **kwargs)
+
+    def ids_with_phrase(self, phrase):
+        """A list of the ids of the predictions of phrases which normalize as phrase does, oldest first."""
+        self.catch_up()
+        with self._lock:
+            return list(self._ids.get(normalize_sentence(phrase), ()))
+
+    def _apply(self, event):
+        if isinstance(event, Prediction.Created):
+            phrase = normalize_sentence(event.phrase)
+            self._ids[phrase].append(event.aggregate_id)
+            self._phrases.append(phrase)
+            if self._max_ids is not None and len(self._phrases) >= self._max_ids + max(self._max_ids // 16, 1):
+                self._drop_oldest_ids()
+
+    def _drop_oldest_ids(self):
+        """Drop the oldest ids beyond max_ids, each being the first of those with its phrase."""
+        for _ in range(len(self._phrases) - self._max_ids):
+            phrase = self._phrases.popleft()
+            ids = self._ids[phrase]
+            del ids[0]
+            if not ids:
+                del self._ids[phrase]
+
+    def _state_to_jsonable(self):
+        # Pairs rather than a dictionary, so that no phrase can be decoded as a type tag
+        numbers = {phrase: number for number, phrase in enumerate(self._ids)}
+        return {'phrases': [[phrase, list(ids)] for phrase, ids in self._ids.items()],
+                'order': [numbers[phrase] for phrase in self._phrases]}
+
+    def _state_from_jsonable(self, state):
+        if not isinstance(state, dict):
+            raise ValueError("Expected phrases and ids with their order")
+        pairs = [(phrase, list(ids)) for phrase, ids in state['phrases']]
+        if Counter(state['order']) != {number: len(ids) for number, (_, ids) in enumerate(pairs) if ids}:
+            raise ValueError("The order does not match the ids")
+        phrases = deque(pairs[number][0] for number in state['order'])
+        self._ids = defaultdict(list, pairs)
+        self._phrases = phrases
+        if self._max_ids is not None:
+            self._drop_oldest_ids()
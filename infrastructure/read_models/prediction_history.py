@@ -0,0 +1,177 @@
+import sys
+from array import array
+from bisect import bisect_left
+
+from contexts.prediction.domain.model.prediction import Prediction
+from library.infrastructure_architecture.event_sourced_architecture.projections import Projection
+
+
+class PredictionHistory(Projection):
+    """A flat read model of the stored predictions, in the order they were stored.
+
+    Each row holds the id, phrase, language and timestamp of a Prediction.Created
+    event, so the history is served without reconstituting Prediction aggregates.
+    Rows of discarded predictions are kept but skipped. Pages are addressed by a
+    cursor - the number of the row to continue from - so reading a page costs time
+    proportional to its size rather than to the whole history.
+
+    The rows are held in memory by every process serving them, at roughly 300
+    bytes plus the length of the phrase each. With max_rows only the most recent
+    rows are kept: older ones are dropped, a sixteenth of max_rows at a time, and
+    no longer returned, which dropped_count tells. Row numbers, and so cursors, are
+    not affected by dropping.
+
+    Example:
+
+        history = PredictionHistory(es, checkpoint_path='database/projections/prediction_history.json')
+        rows, cursor = history.page(limit=100)
+        more_rows, cursor = history.page(limit=100, cursor=cursor)
+    """
+
+    def __init__(self, event_store, max_rows=None, **kwargs):
+        """Create the read model. See Projection for the other keyword arguments.
+
+        Args:
+            event_store: An EventStore.
+            max_rows: The number of most recent rows kept, or None to keep them all.
+        """
+        self._max_rows = max_rows
+        self._first_row = 0  # the number of the oldest row kept
+        self._ids = []
+        self._phrases = []
+        self._languages = []
+        self._timestamps = array('d')
+        self._max_timestamps = array('d')  # running maximum of the timestamps, for bisecting on since
+        self._rows_by_id = {}  # {prediction id string: row number}
+        self._discarded = bytearray()  # 1 for the rows of discarded predictions
+        self._discarded_count = 0
+        super().__init__(event_store, **kwargs)
+
+    def __len__(self):
+        """The number of kept predictions which have not been discarded."""
+        self.catch_up()
+        return len(self._ids) - self._discarded_count
+
+    @property
+    def dropped_count(self):
+        """The number of the oldest rows which have been dropped to keep max_rows."""
+        self.catch_up()
+        with self._lock:
+            return self._first_row
+
+    def page(self, limit=None, cursor=None, since=None):
+        """A page of the kept rows of predictions which have not been discarded.
+
+        Args:
+            limit: The maximum number of rows, or None for all remaining rows.
+            cursor: The cursor returned with the previous page, or None to start from the oldest row.
+            since: An optional timestamp; only rows at or after it are included.
+
+        Returns:
+            A pair of a list of (id, phrase, language, timestamp) tuples and the cursor of
+            the next page, which is None once the last row has been returned.
+
+        Raises:
+            ValueError: If the cursor is not one returned by page().
+        """
+        self.catch_up()
+        with self._lock:
+            first_row = self._first_row
+            row_count = first_row + len(self._ids)
+            row = max(0 if cursor is None else _parse_cursor(cursor, row_count), first_row)
+            if since is not None:
+                row = max(row, first_row + bisect_left(self._max_timestamps, since))
+            rows = []
+            while row < row_count and (limit is None or len(rows) < limit):
+                index = row - first_row
+                if not self._discarded[index] and (since is None or self._timestamps[index] >= since):
+                    rows.append(self._row(index))
+                row += 1
+            return rows, (str(row) if row < row_count else None)
+
+    def rows_with_ids(self, prediction_ids):
+        """The kept rows of those of the given predictions which have not been discarded, oldest first.
+
+        Args:
+            prediction_ids: An iterable series of prediction ids, as UniqueIds or strings.
+        """
+        self.catch_up()
+        with self._lock:
+            indices = sorted(row - self._first_row
+                             for row in (self._rows_by_id.get(str(prediction_id)) for prediction_id in prediction_ids)
+                             if row is not None)
+            return [self._row(index) for index in indices if not self._discarded[index]]
+
+    def _row(self, index):
+        return self._ids[index], self._phrases[index], self._languages[index], self._timestamps[index]
+
+    def _apply(self, event):
+        if isinstance(event, Prediction.Created):
+            prediction_id = str(event.aggregate_id)
+            self._rows_by_id[prediction_id] = self._first_row + len(self._ids)
+            self._ids.append(prediction_id)
+            self._phrases.append(event.phrase)
+            self._languages.append(sys.intern(event.language))
+            self._append_timestamp(event.timestamp)
+            self._discarded.append(0)
+            if self._max_rows is not None and len(self._ids) >= self._max_rows + max(self._max_rows // 16, 1):
+                self._drop_oldest_rows()
+        elif isinstance(event, Prediction.Discarded):
+            row = self._rows_by_id.get(str(event.aggregate_id))
+            if row is not None and not self._discarded[row - self._first_row]:
+                self._discarded[row - self._first_row] = 1
+                self._discarded_count += 1
+
+    def _drop_oldest_rows(self):
+        """Drop the oldest rows beyond max_rows."""
+        count = len(self._ids) - self._max_rows
+        if count <= 0:
+            return
+        for prediction_id in self._ids[:count]:
+            del self._rows_by_id[prediction_id]
+        self._discarded_count -= sum(self._discarded[:count])
+        # The running maxima kept may exceed those of the rows kept, which bisecting on since tolerates
+        for column in (self._ids, self._phrases, self._languages, self._timestamps, self._max_timestamps,
+                       self._discarded):
+            del column[:count]
+        self._first_row += count
+
+    def _append_timestamp(self, timestamp):
+        self._timestamps.append(timestamp)
+        self._max_timestamps.append(max(timestamp, self._max_timestamps[-1]) if self._max_timestamps else timestamp)
+
+    def _state_to_jsonable(self):
+        return {'first_row': self._first_row, 'ids': list(self._ids), 'phrases': list(self._phrases), 'languages': list(self._languages),
+                'timestamps': self._timestamps.tolist(),
+                'discarded': [row for row, discarded in enumerate(self._discarded) if discarded]}
+
+    def _state_from_jsonable(self, state):
+        first_row = int(state['first_row'])
+        ids, phrases = list(state['ids']), list(state['phrases'])
+        languages = [sys.intern(language) for language in state['languages']]
+        timestamps = array('d', state['timestamps'])
+        if not len(ids) == len(phrases) == len(languages) == len(timestamps):
+            raise ValueError("The columns have different lengths")
+        discarded = bytearray(len(ids))
+        for row in state['discarded']:
+            discarded[row] = 1
+        self._first_row = first_row
+        self._ids, self._phrases, self._languages = ids, phrases, languages
+        self._timestamps = array('d')
+        self._max_timestamps = array('d')
+        for timestamp in timestamps:
+            self._append_timestamp(timestamp)
+        self._rows_by_id = {prediction_id: row for row, prediction_id in enumerate(ids, first_row)}
+        self._discarded = discarded
+        self._discarded_count = sum(discarded)
+        if self._max_rows is not None:
+            self._drop_oldest_rows()
+
+def _parse_cursor(cursor, row_count):
+    try:
+        row = int(cursor)
+    except (TypeError, ValueError):
+        row = -1
+    if not 0 <= row <= row_count:
+        raise ValueError("Invalid cursor {!r}".format(cursor))
+    return row
@@ -36,6 +36,17 @@ class Entity(metaclass=ABCMeta):
         self._discarded = False
         self._instance_id = next(Entity._instance_id_generator)
 
+    def __getstate__(self):
+        """The state of the entity, without its instance id, e.g. for snapshots and copies."""
+        state = self.__dict__.copy()
+        del state['_instance_id']
+        return state
+
+    def __setstate__(self, state):
+        """Restore the state of an entity, which becomes a new instance."""
+        self.__dict__.update(state)
+        self._instance_id = next(Entity._instance_id_generator)
+
     def _increment_version(self):
         self._version += 1
 
@@ -1,5 +1,7 @@
 from abc import ABCMeta, abstractmethod
 
+from library.infrastructure_architecture.event_sourced_architecture.projections import \
+    extant_persisted_aggregate_ids
 from utilities.containers import universal_container
 from utilities.itertools import last
 from utilities.time import _MAX_TIMESTAMP
@@ -18,13 +20,73 @@ class AbstractEventStore(metaclass=ABCMeta):
             for_aggregate_ids = universal_container()
         if upto_timestamp is None:
             upto_timestamp = _MAX_TIMESTAMP
-        for event in self:
+        for event in self._events_before(upto_timestamp):
             if (event.aggregate_id in for_aggregate_ids) and (event.timestamp < upto_timestamp):
                 yield event
 
+    def _events_before(self, upto_timestamp):
+        """Iterate, in order, over a superset of the events before upto_timestamp.
+
+        Stores which can tell where later events are, such as segmented ones, override
+        this to avoid reading them.
+        """
+        return iter(self)
+
     @abstractmethod
     def __iter__(self):
         raise NotImplementedError
 
     def latest(self, for_aggregate_ids=None, upto_timestamp=None):
-        return last(self.events(for_aggregate_ids, upto_timestamp))
\ No newline at end of file
+        return last(self.events(for_aggregate_ids, upto_timestamp))
+
+    def extant_aggregate_ids(self, entity_class, upto_timestamp=None):
+        """A set of the ids of the aggregates of entity_class which have been created and not discarded.
+
+        Only the events before upto_timestamp, if given, are taken into account. This
+        scans every event, stores which maintain a projection override it.
+        """
+        return extant_persisted_aggregate_ids(self.events(upto_timestamp=upto_timestamp), entity_class)
+
+    def projection(self, projection_class):
+        """The projection of the given class maintained over this store, or None.
+
+        Repositories use projections, such as indexes, when the store has them.
+        """
+        return None
+
+    def latest_snapshot(self, aggregate_id, upto_timestamp=None):
+        """The most recent Snapshot of an aggregate taken before upto_timestamp, or None.
+
+        Stores without snapshots always return None.
+        """
+        return None
+
+    def latest_snapshots(self, aggregate_ids, upto_timestamp=None):
+        """The most recent Snapshots of some aggregates taken before upto_timestamp.
+
+        Returns:
+            A dictionary mapping those of the aggregate_ids which have a snapshot to
+            their latest one.
+        """
+        snapshots = {}
+        for aggregate_id in aggregate_ids:
+            snapshot = self.latest_snapshot(aggregate_id, upto_timestamp)
+            if snapshot is not None:
+                snapshots[aggregate_id] = snapshot
+        return snapshots
+
+    def latest_timestamps(self, aggregate_ids):
+        """The timestamps of the most recent events of the given aggregates.
+
+        Returns:
+            A dictionary mapping those of the aggregate_ids which have events to the
+            timestamp of their most recent event.
+        """
+        aggregate_ids = set(aggregate_ids)
+        timestamps = {}
+        if not aggregate_ids:
+            return timestamps
+        for event in self:
+            if event.aggregate_id in aggregate_ids:
+                timestamps[event.aggregate_id] = max(timestamps.get(event.aggregate_id, 0.0), event.timestamp)
+        return timestamps
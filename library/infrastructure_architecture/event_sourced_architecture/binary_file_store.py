@@ -0,0 +1,332 @@
+import json
+import mmap
+import os
+import struct
+import uuid
+import zlib
+from array import array
+from collections import defaultdict
+
+from library.infrastructure_architecture.event_sourced_architecture.event_store import _exclusive_lock
+from utilities.unique_id import UniqueId
+
+
+_FILE_MAGIC = b'EVSTBIN1'
+_RECORD_PREFIX = struct.Struct('<II')  # length of the body, CRC-32 of the body
+_RECORD_HEADER = struct.Struct('<H16sd')  # type id, aggregate id, timestamp
+_TYPE_DEFINITION = 0
+_NO_AGGREGATE = bytes(16)
+
+
+def read_binary_records(stream, json_decoder_class=None):
+    """Iterate over the records of a BinaryFileStore read from a binary stream, such as a decompressing one.
+
+    Raises:
+        ValueError: If the stream is not a binary event store or a record is corrupt.
+    """
+    if stream.read(len(_FILE_MAGIC)) != _FILE_MAGIC:
+        raise ValueError("{!r} is not a binary event store".format(stream))
+    decoder = (json_decoder_class or json.JSONDecoder)()
+    types = []
+    while True:
+        prefix = stream.read(_RECORD_PREFIX.size)
+        if len(prefix) < _RECORD_PREFIX.size:
+            break
+        length, crc = _RECORD_PREFIX.unpack(prefix)
+        body = stream.read(length)
+        if len(body) < length:
+            # A record still being appended by another process
+            break
+        if zlib.crc32(body) != crc:
+            raise ValueError("Corrupt record in {!r}".format(stream))
+        if _RECORD_HEADER.unpack_from(body)[0] == _TYPE_DEFINITION:
+            types.append(tuple(json.loads(body[_RECORD_HEADER.size:].decode('utf-8'))))
+        else:
+            yield _decode_body(body, types, decoder)
+
+
+def read_binary_records_reversed(contents, json_decoder_class=None):
+    """Iterate over the records of a BinaryFileStore held in bytes, such as a decompressed segment, newest first.
+
+    The record prefixes are scanned for the offsets of the records and the type
+    definitions, then only the records consumed are decoded, from the end.
+
+    Raises:
+        ValueError: If the contents are not a binary event store or a record is corrupt.
+    """
+    if not contents.startswith(_FILE_MAGIC):
+        raise ValueError("The contents are not a binary event store")
+    decoder = (json_decoder_class or json.JSONDecoder)()
+    types = []
+    offsets = array('Q')
+    offset = len(_FILE_MAGIC)
+    while offset + _RECORD_PREFIX.size + _RECORD_HEADER.size <= len(contents):
+        length, _ = _RECORD_PREFIX.unpack_from(contents, offset)
+        end = offset + _RECORD_PREFIX.size + length
+        if end > len(contents):
+            # A record still being appended by another process
+            break
+        if _RECORD_HEADER.unpack_from(contents, offset + _RECORD_PREFIX.size)[0] == _TYPE_DEFINITION:
+            body = _checked_body(contents, offset)
+            types.append(tuple(json.loads(body[_RECORD_HEADER.size:].decode('utf-8'))))
+        else:
+            offsets.append(offset)
+        offset = end
+    for offset in reversed(offsets):
+        yield _decode_body(_checked_body(contents, offset), types, decoder)
+
+
+def _checked_body(contents, offset):
+    length, crc = _RECORD_PREFIX.unpack_from(contents, offset)
+    start = offset + _RECORD_PREFIX.size
+    body = contents[start:start + length]
+    if zlib.crc32(body) != crc:
+        raise ValueError("Corrupt record at offset {}".format(offset))
+    return body
+
+
+def _decode_body(body, types, decoder):
+    type_id, aggregate_id, timestamp = _RECORD_HEADER.unpack_from(body)
+    event_type, topic = types[type_id - 1]
+    attributes = decoder.decode(body[_RECORD_HEADER.size:].decode('utf-8'))
+    attributes['aggregate_id'] = UniqueId(uuid.UUID(bytes=aggregate_id))
+    attributes['timestamp'] = timestamp
+    return {'__event_type': event_type, 'topic': topic, 'attributes': attributes}
+
+
+class BinaryFileStore:
+    """An append-only store of event records in a compact binary format.
+
+    A drop-in alternative to JsonFileStore for EventStore. Each record is
+
+        <length: uint32> <crc32: uint32> <type id: uint16> <aggregate id: 16 bytes>
+        <timestamp: float64> <remaining attributes: compact JSON>
+
+    in little-endian order, where length and the CRC cover everything after them.
+    Topics are not repeated on every record: the first record of each event type is
+    preceded by a type definition record (type id 0) holding its topic, and type
+    ids are numbered in the order of their definitions.
+
+    The file is read through mmap. On opening only the record headers are scanned,
+    to build an in-memory index of record offsets by aggregate id together with the
+    timestamp of the latest event of each aggregate, so the store is always indexed
+    and stamped like a JsonFileStore opened with aggregate_id_key and
+    event_timestamp_stamp. Records appended by other processes are scanned when the
+    file has grown. Aggregate ids must be UniqueIds.
+
+    Example:
+
+        es = EventStore(BinaryFileStore('database/store.events.bin',
+                                        json_encoder_class=ObjectJSONEncoder,
+                                        json_decoder_class=ObjectJSONDecoder))
+    """
+
+    def __init__(self, store_path, json_encoder_class=None, json_decoder_class=None, read_only=False):
+        """Open an event store.
+
+        Args:
+            store_path: The path to a new or existing binary event store.
+            json_encoder_class: An optional custom JSONEncoder subclass for attributes.
+            json_decoder_class: An optional custom JSONDecoder subclass for attributes.
+            read_only: If True, the store must exist already and is only read: extend()
+                raises RuntimeError.
+
+        Raises:
+            ValueError: If the file exists but is not a binary event store.
+            FileNotFoundError: If read_only is True and the store does not exist.
+        """
+        self._store_path = store_path
+        # Encoders and decoders are stateless, so one of each is reused for every record
+        self._encoder = (json_encoder_class or json.JSONEncoder)(separators=(',', ':'))
+        self._decoder = (json_decoder_class or json.JSONDecoder)()
+        self._types = []  # [(event_type, topic), ...] for type ids from 1
+        self._type_ids = {}  # {topic: type id}
+        self._offsets = array('Q')  # offsets of the event records, in store order
+        self._index = defaultdict(list)  # {aggregate id hex: [offset, ...]}
+        self._stamps = {}  # {aggregate id hex: timestamp of the latest event}
+        self._latest = None  # (offset, record)
+        self._map = None
+        self._read_only = read_only
+        self._store_file = open(self._store_path, 'rb' if read_only else 'ab')
+        if not read_only:
+            with _exclusive_lock(self._store_file) as store_file:
+                if store_file.seek(0, os.SEEK_END) == 0:
+                    store_file.write(_FILE_MAGIC)
+        self._read_file = open(self._store_path, 'rb')
+        if self._read_file.read(len(_FILE_MAGIC)) != _FILE_MAGIC:
+            self.close()
+            raise ValueError("{!r} is not a binary event store".format(self._store_path))
+        self._end_offset = len(_FILE_MAGIC)
+        self._synchronize()
+
+    @property
+    def indexed(self):
+        return True
+
+    @property
+    def stamped(self):
+        return True
+
+    def append(self, obj):
+        self.extend((obj,))
+
+    def extend(self, objs):
+        if self._read_only:
+            raise RuntimeError("Cannot extend {!r}, it is opened read-only".format(self._store_path))
+        with _exclusive_lock(self._store_file) as store_file:
+            self._synchronize()
+            offset = store_file.seek(0, os.SEEK_END)
+            # The whole batch is encoded before any of it is written, so that an object which
+            # cannot be encoded leaves the file, the type table and the index as they were
+            records = []
+            new_types = {}  # {topic: (type id, event type)} of the types first stored in this batch
+            observed = []
+            for obj in objs:
+                type_id = self._type_ids.get(obj['topic'])
+                if type_id is None and obj['topic'] not in new_types:
+                    definition = self._encode_type_definition(obj)
+                    records.append(definition)
+                    new_types[obj['topic']] = (len(self._types) + len(new_types) + 1, obj['__event_type'])
+                    offset += len(definition)
+                if type_id is None:
+                    type_id = new_types[obj['topic']][0]
+                record, aggregate_id, timestamp = self._encode(obj, type_id)
+                records.append(record)
+                observed.append((offset, aggregate_id, timestamp))
+                offset += len(record)
+            store_file.write(b''.join(records))
+            self._end_offset = offset
+            for topic, (_, event_type) in new_types.items():
+                self._define_type(event_type, topic)
+            for record_offset, aggregate_id, timestamp in observed:
+                self._observe(record_offset, aggregate_id, timestamp)
+
+    def __iter__(self):
+        self._synchronize()
+        store_map, count = self._map, len(self._offsets)
+        for i in range(count):
+            yield self._decode(store_map, self._offsets[i])
+
+    def __reversed__(self):
+        """Iterate over the records from the newest to the oldest."""
+        self._synchronize()
+        store_map, count = self._map, len(self._offsets)
+        for i in range(count - 1, -1, -1):
+            yield self._decode(store_map, self._offsets[i])
+
+    def records_from(self, position):
+        """Iterate, in store order, over the records from the one numbered position, counting from 0."""
+        self._synchronize()
+        store_map, count = self._map, len(self._offsets)
+        for i in range(position, count):
+            yield self._decode(store_map, self._offsets[i])
+
+    def records_with_keys(self, keys):
+        """Iterate, in store order, over the records of the aggregates with the given id strings."""
+        self._synchronize()
+        store_map = self._map
+        offsets = sorted(offset for key in set(keys) for offset in self._index.get(key, ()))
+        for offset in offsets:
+            yield self._decode(store_map, offset)
+
+    def latest_stamps_with_keys(self, keys):
+        """The timestamps of the latest events of the aggregates with the given id strings."""
+        self._synchronize()
+        return {key: self._stamps[key] for key in keys if key in self._stamps}
+
+    def latest(self):
+        """The most recently appended record.
+
+        Raises:
+            ValueError: If the store is empty.
+        """
+        self._synchronize()
+        if not self._offsets:
+            raise ValueError("Cannot return latest record from empty store {!r}".format(self._store_path))
+        offset = self._offsets[-1]
+        if self._latest is None or self._latest[0] != offset:
+            self._latest = (offset, self._decode(self._map, offset))
+        return self._latest[1]
+
+    def sync(self):
+        """Force the records appended so far onto disk."""
+        os.fsync(self._store_file.fileno())
+
+    def close(self):
+        """Close the files held open. The store cannot be used afterwards."""
+        self._map = None
+        self._read_file.close()
+        self._store_file.close()
+
+    @property
+    def closed(self):
+        return self._store_file.closed
+
+    def __len__(self):
+        self._synchronize()
+        return len(self._offsets)
+
+    def _encode(self, obj, type_id):
+        attributes = dict(obj['attributes'])
+        aggregate_id = attributes.pop('aggregate_id')
+        timestamp = attributes.pop('timestamp')
+        if not isinstance(aggregate_id, UniqueId):
+            raise TypeError("{!r} stores only UniqueId aggregate ids, not {!r}".format(self._store_path, aggregate_id))
+        aggregate_id = bytes.fromhex(repr(aggregate_id))
+        payload = self._encoder.encode(attributes).encode('utf-8')
+        return self._record(type_id, aggregate_id, timestamp, payload), aggregate_id, timestamp
+
+    def _encode_type_definition(self, obj):
+        payload = json.dumps([obj['__event_type'], obj['topic']], separators=(',', ':')).encode('utf-8')
+        return self._record(_TYPE_DEFINITION, _NO_AGGREGATE, 0.0, payload)
+
+    @staticmethod
+    def _record(type_id, aggregate_id, timestamp, payload):
+        body = _RECORD_HEADER.pack(type_id, aggregate_id, timestamp) + payload
+        return _RECORD_PREFIX.pack(len(body), zlib.crc32(body)) + body
+
+    def _decode(self, store_map, offset):
+        return _decode_body(self._body(store_map, offset), self._types, self._decoder)
+
+    def _body(self, store_map, offset):
+        length, crc = _RECORD_PREFIX.unpack_from(store_map, offset)
+        start = offset + _RECORD_PREFIX.size
+        body = store_map[start:start + length]
+        if zlib.crc32(body) != crc:
+            raise ValueError("Corrupt record at offset {} of {!r}".format(offset, self._store_path))
+        return body
+
+    def _define_type(self, event_type, topic):
+        self._types.append((event_type, topic))
+        self._type_ids[topic] = len(self._types)
+        return len(self._types)
+
+    def _observe(self, offset, aggregate_id, timestamp):
+        key = aggregate_id.hex()
+        self._offsets.append(offset)
+        self._index[key].append(offset)
+        self._stamps[key] = timestamp
+
+    def _synchronize(self):
+        """Scan the headers of the records appended by other processes since the last scan."""
+        size = os.fstat(self._read_file.fileno()).st_size
+        if self._map is None or len(self._map) < size:
+            # Map the whole file again to see what has been appended meanwhile
+            self._map = mmap.mmap(self._read_file.fileno(), 0, access=mmap.ACCESS_READ)
+        store_map = self._map
+        size = len(store_map)
+        offset = self._end_offset
+        while offset + _RECORD_PREFIX.size + _RECORD_HEADER.size <= size:
+            length, _ = _RECORD_PREFIX.unpack_from(store_map, offset)
+            end = offset + _RECORD_PREFIX.size + length
+            if end > size:
+                # A record still being appended by another process
+                break
+            type_id, aggregate_id, timestamp = _RECORD_HEADER.unpack_from(store_map, offset + _RECORD_PREFIX.size)
+            if type_id == _TYPE_DEFINITION:
+                event_type, topic = json.loads(self._body(store_map, offset)[_RECORD_HEADER.size:].decode('utf-8'))
+                self._define_type(event_type, topic)
+            else:
+                self._observe(offset, aggregate_id, timestamp)
+            offset = end
+        self._end_offset = offset
@@ -1,50 +1,480 @@
+import fcntl
 import json
+import os
+from array import array
+from collections import defaultdict
+from collections.abc import Iterable
+from contextlib import contextmanager
+from itertools import islice
 
 from library.infrastructure_architecture.event_sourced_architecture.abstract_event_store import AbstractEventStore
+from library.infrastructure_architecture.event_sourced_architecture.projections import ExtantAggregateIds
 from utilities.identifiers import class_to_qualname, qualname_to_class
-from utilities.itertools import last
+from utilities.time import _MAX_TIMESTAMP
+
+
+_REVERSE_READ_BLOCK_SIZE = 64 * 1024
+
+
+@contextmanager
+def _exclusive_lock(store_file):
+    """Hold an exclusive advisory lock on an open file.
+
+    Appends from several processes sharing a store are serialized by this lock, and
+    buffered data is flushed before the lock is released, so records never interleave.
+    """
+    fcntl.flock(store_file.fileno(), fcntl.LOCK_EX)
+    try:
+        yield store_file
+    finally:
+        store_file.flush()
+        fcntl.flock(store_file.fileno(), fcntl.LOCK_UN)
+
+
+def aggregate_id_key(obj):
+    """The index key of a record written by EventStore: its aggregate id as a string."""
+    return str(obj['attributes']['aggregate_id'])
+
+
+def event_timestamp_stamp(obj):
+    """The index stamp of a record written by EventStore: its event timestamp."""
+    return obj['attributes']['timestamp']
+
+
+def records_from(store, position):
+    """Iterate, in store order, over the records of a store from the one numbered position, counting from 0.
+
+    Stores which can, such as an indexed JsonFileStore, go directly to the record.
+    """
+    if hasattr(store, 'records_from'):
+        return store.records_from(position)
+    return islice(store, position, None)
+
+
+def read_json_records(stream, json_decoder_class=None):
+    """Iterate over the records of a JsonFileStore read from a binary stream, such as a decompressing one."""
+    for line in stream:
+        if not line.endswith(b'\n'):
+            # A record still being appended by another process
+            break
+        yield json.loads(line.decode('utf-8'), cls=json_decoder_class)
+
+
+def read_json_records_reversed(contents, json_decoder_class=None):
+    """Iterate over the records of a JsonFileStore held in bytes, such as a decompressed segment, newest first.
+
+    Lines are split off from the end, so only the records consumed are decoded.
+    """
+    # A record still being appended by another process is left out
+    end = contents.rfind(b'\n') + 1
+    while end > 0:
+        start = contents.rfind(b'\n', 0, end - 1) + 1
+        yield json.loads(contents[start:end].decode('utf-8'), cls=json_decoder_class)
+        end = start
 
 
 class JsonFileStore:
 
-    def __init__(self, store_path, json_encoder_class=None, json_decoder_class=None):
+    def __init__(self, store_path, json_encoder_class=None, json_decoder_class=None, index_key=None,
+                 index_stamp=None, read_only=False):
         """Open an event store.
 
+        Only the tail of an existing store is read on opening, to recover the
+        latest record. Afterwards the store keeps a high-water mark - the byte
+        offset up to which it has observed records - and the latest record in
+        memory, updated on every append and extend. Records appended by other
+        processes are observed by reading from the high-water mark to the end
+        of the file when the file has grown.
+
+        If index_key is given, the store also maintains an index from key to the
+        byte offsets of the records with that key, so records_with_keys() can seek
+        directly to them. The index is persisted next to the store, in a file with
+        the '.index' suffix holding one "<offset> <length> <key>" line per record,
+        which is appended to by whichever process appends the records. On opening,
+        records beyond the end of the persisted index are indexed, and an index
+        which does not match the store is rebuilt.
+
+        If index_stamp is also given, the index keeps the stamp - such as the
+        timestamp - of the latest record of every key, persisted as a fourth field
+        of each index line, which latest_stamps_with_keys() answers from memory.
+
+        The store and index files are kept open for appending until close() is
+        called. Appended records are handed to the operating system before extend()
+        returns, but are only guaranteed to be on disk after sync(), which a
+        GroupCommitter calls on behalf of many appends at once.
+
         Args:
             store_path: The path to a new or existing event store.
-            json_decoder_class: An optional custom JSONEncoder subclass.
+            json_encoder_class: An optional custom JSONEncoder subclass.
+            json_decoder_class: An optional custom JSONDecoder subclass.
+            index_key: An optional function of a record returning its index key as a
+                string without whitespace, e.g. aggregate_id_key.
+            index_stamp: An optional function of a record returning a float, e.g.
+                event_timestamp_stamp. Requires index_key.
+            read_only: If True, the store must exist already and is only read: extend()
+                raises RuntimeError, and the index is kept in memory without being persisted.
+
+        Raises:
+            FileNotFoundError: If read_only is True and the store does not exist.
         """
         self._store_path = store_path
         self._json_encoder_class = json_encoder_class
         self._json_decoder_class = json_decoder_class
-        open(self._store_path, 'a').close()
+        self._index_key = index_key
+        self._index_stamp = index_stamp
+        self._index_path = store_path + '.index'
+        self._read_only = read_only
+        self._index = defaultdict(list)  # {key: [offset, ...]}
+        self._stamps = {}  # {key: stamp of the latest record}
+        self._offsets = array('Q')  # offsets of all the records, in store order, if indexed
+        self._store_file = open(self._store_path, 'rb' if read_only else 'ab')
+        self._index_file = None if index_key is None or read_only else open(self._index_path, 'ab')
+        self._end_offset = 0
+        self._latest = None
+        if self._index_key is None:
+            self._recover_tail()
+        else:
+            self._open_index()
+
+    @property
+    def indexed(self):
+        """True if the store maintains an index of record offsets by key."""
+        return self._index_key is not None
+
+    @property
+    def stamped(self):
+        """True if the index also keeps the stamp of the latest record of every key."""
+        return self._index_stamp is not None
 
     def append(self, obj):
-        with open(self._store_path, 'a+t') as store_file:
-            json.dump(obj, store_file, separators=(',',':'), sort_keys=True, cls=self._json_encoder_class)
-            store_file.write('\n')
+        self.extend((obj,))
 
     def extend(self, objs):
-        with open(self._store_path, 'a+t') as store_file:
+        if self._read_only:
+            raise RuntimeError("Cannot extend {!r}, it is opened read-only".format(self._store_path))
+        with _exclusive_lock(self._store_file) as store_file:
+            self._synchronize()
+            if store_file.seek(0, os.SEEK_END) > self._end_offset:
+                # Cut off a record torn by a crash, which would otherwise run into the first one appended
+                store_file.truncate(self._end_offset)
+            offset = store_file.seek(0, os.SEEK_END)
+            # The whole batch is encoded before any of it is written or observed, so that an
+            # object which cannot be encoded leaves both the file and the index as they were
+            lines = []
+            index_lines = []
+            observed = []
             for obj in objs:
-                json.dump(obj, store_file, separators=(',',':'), sort_keys=True, cls=self._json_encoder_class)
-                store_file.write('\n')
+                line = self._encode(obj)
+                lines.append(line)
+                observed.append((offset, obj))
+                if self._index_key is not None:
+                    index_lines.append(self._index_line(offset, len(line), obj))
+                offset += len(line)
+            store_file.write(b''.join(lines))
+            self._end_offset = offset
+            for record_offset, obj in observed:
+                self._observe(record_offset, obj)
+            if index_lines:
+                store_file.flush()
+                self._write_index_lines(index_lines)
+
+    def sync(self):
+        """Force the records appended so far onto disk.
+
+        Only the store itself is synced: an index which is behind the store after a
+        crash is caught up on opening, and one which is ahead of it is rebuilt.
+        """
+        os.fsync(self._store_file.fileno())
+
+    def close(self):
+        """Close the files held open for appending. The store cannot be extended afterwards."""
+        self._store_file.close()
+        if self._index_file is not None:
+            self._index_file.close()
+
+    @property
+    def closed(self):
+        return self._store_file.closed
 
     def __iter__(self):
-        with open(self._store_path, 'rt') as store_file:
-            for line in store_file:
-                obj = json.loads(line, cls=self._json_decoder_class)
-                yield obj
+        with open(self._store_path, 'rb') as store_file:
+            yield from read_json_records(store_file, self._json_decoder_class)
+
+    def __reversed__(self):
+        """Iterate over the records from the newest to the oldest.
+
+        The file is read backwards in blocks, so consuming only the most recent
+        records costs time proportional to their size rather than to the whole store.
+        """
+        for _, line in self._reversed_lines():
+            yield self._decode(line)
+
+    def records_from(self, position):
+        """Iterate, in store order, over the records from the one numbered position, counting from 0.
+
+        An indexed store seeks directly to the record, otherwise the earlier lines are
+        skipped without being decoded.
+        """
+        if self._index_key is None:
+            lines = islice(self._lines_from(0), position, None)
+        else:
+            self._synchronize()
+            if position >= len(self._offsets):
+                return
+            lines = self._lines_from(self._offsets[position])
+        for _, line in lines:
+            yield self._decode(line)
+
+    def records_with_keys(self, keys):
+        """Iterate, in store order, over the records with any of the given index keys.
+
+        Only the matching records are read and decoded.
+
+        Raises:
+            RuntimeError: If the store was opened without an index_key.
+        """
+        if self._index_key is None:
+            raise RuntimeError("{!r} is not indexed".format(self._store_path))
+        self._synchronize()
+        offsets = sorted(offset for key in set(keys) for offset in self._index.get(key, ()))
+        with open(self._store_path, 'rb') as store_file:
+            for offset in offsets:
+                store_file.seek(offset)
+                yield self._decode(store_file.readline())
+
+    def latest_stamps_with_keys(self, keys):
+        """The stamps of the latest records with the given keys.
+
+        Returns:
+            A dictionary mapping those of the keys which have records to the stamp of
+            their latest record.
+
+        Raises:
+            RuntimeError: If the store was opened without an index_stamp.
+        """
+        if self._index_stamp is None:
+            raise RuntimeError("{!r} does not index stamps".format(self._store_path))
+        self._synchronize()
+        return {key: self._stamps[key] for key in keys if key in self._stamps}
+
+    def rebuild_index(self):
+        """Discard the persisted index and index every record of the store again."""
+        if self._index_key is None:
+            raise RuntimeError("{!r} is not indexed".format(self._store_path))
+        if self._read_only:
+            raise RuntimeError("Cannot rebuild the index of {!r}, it is opened read-only".format(self._store_path))
+        with _exclusive_lock(self._store_file):
+            self._index_file.truncate(0)
+            self._load_index()
 
     def latest(self):
-        return last(self)
+        """The most recently appended record.
+
+        Raises:
+            ValueError: If the store is empty.
+        """
+        self._synchronize()
+        if self._latest is None:
+            raise ValueError("Cannot return latest record from empty store {!r}".format(self._store_path))
+        return self._latest
+
+    def _encode(self, obj):
+        return (json.dumps(obj, separators=(',',':'), sort_keys=True, cls=self._json_encoder_class) + '\n').encode('utf-8')
+
+    def _decode(self, line):
+        return json.loads(line.decode('utf-8'), cls=self._json_decoder_class)
+
+    def _observe(self, offset, obj):
+        """Called with each record, in order, as it becomes known to this store."""
+        self._latest = obj
+        if self._index_key is not None:
+            key = self._index_key(obj)
+            self._offsets.append(offset)
+            self._index[key].append(offset)
+            if self._index_stamp is not None:
+                self._stamps[key] = self._index_stamp(obj)
+
+    def _index_line(self, offset, length, obj):
+        fields = [offset, length, self._index_key(obj)]
+        if self._index_stamp is not None:
+            fields.append(repr(float(self._index_stamp(obj))))
+        return (' '.join(map(str, fields)) + '\n').encode('utf-8')
+
+    def _write_index_lines(self, index_lines):
+        if self._index_file is None:
+            return  # read-only
+        self._index_file.write(b''.join(index_lines))
+        self._index_file.flush()
+
+    def _open_index(self):
+        with _exclusive_lock(self._store_file):
+            self._load_index()
+
+    def _load_index(self):
+        """Load the persisted index and index the records beyond its end.
+
+        Must be called with the store locked, so that no other process appends
+        records or index lines meanwhile.
+        """
+        self._index.clear()
+        self._stamps.clear()
+        del self._offsets[:]
+        indexed_end = self._read_index_file()
+        if indexed_end is None or indexed_end > os.path.getsize(self._store_path):
+            # The index does not belong to this store, start over
+            self._index.clear()
+            self._stamps.clear()
+            del self._offsets[:]
+            indexed_end = 0
+            if self._index_file is not None:
+                self._index_file.truncate(0)
+
+        self._latest = None
+        self._recover_tail()
+        self._end_offset = indexed_end
+        index_lines = []
+        for offset, line, obj in self._decoded_lines_from(indexed_end):
+            self._observe(offset, obj)
+            index_lines.append(self._index_line(offset, len(line), obj))
+            self._end_offset = offset + len(line)
+        if index_lines:
+            self._write_index_lines(index_lines)
+
+    def _read_index_file(self):
+        """Read the persisted index into memory.
+
+        Returns:
+            The store offset up to which records are indexed, or None if the index is corrupt.
+        """
+        indexed_end = 0
+        valid_size = 0
+        try:
+            with open(self._index_path, 'rb' if self._read_only else 'r+b') as index_file:
+                for index_line in index_file:
+                    if not index_line.endswith(b'\n'):
+                        # Cut off a line left incomplete by a crashed process
+                        if not self._read_only:
+                            index_file.truncate(valid_size)
+                        break
+                    fields = index_line.decode('utf-8').split()
+                    if len(fields) != (3 if self._index_stamp is None else 4):
+                        return None
+                    offset, length, key = fields[:3]
+                    self._offsets.append(int(offset))
+                    self._index[key].append(int(offset))
+                    if self._index_stamp is not None:
+                        self._stamps[key] = float(fields[3])
+                    indexed_end = int(offset) + int(length)
+                    valid_size += len(index_line)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            return None
+        return indexed_end
+
+    def _recover_tail(self):
+        for offset, line in self._reversed_lines():
+            try:
+                self._latest = self._decode(line)
+            except ValueError:
+                continue  # a record torn by a crash, which extend() cuts off
+            self._end_offset = offset + len(line) + 1
+            break
+
+    def _synchronize(self):
+        """Observe the records appended by other processes since the high-water mark."""
+        if os.path.getsize(self._store_path) == self._end_offset:
+            return
+        for offset, line, obj in self._decoded_lines_from(self._end_offset):
+            self._observe(offset, obj)
+            self._end_offset = offset + len(line)
+
+    def _decoded_lines_from(self, offset):
+        """Yield (offset, line, record) for every complete line from a byte offset to the end of the file.
+
+        Trailing lines which cannot be decoded, left by an append torn by a crash, are
+        skipped, and cut off by the next extend().
+
+        Raises:
+            ValueError: If a line which cannot be decoded is followed by one which can.
+        """
+        error = None
+        for line_offset, line in self._lines_from(offset):
+            try:
+                obj = self._decode(line)
+            except ValueError as exc:
+                error = error or exc
+                continue
+            if error is not None:
+                raise error
+            yield line_offset, line, obj
+
+    def _lines_from(self, offset):
+        """Yield (offset, line) for every complete line from a byte offset to the end of the file."""
+        with open(self._store_path, 'rb') as store_file:
+            store_file.seek(offset)
+            for line in store_file:
+                if not line.endswith(b'\n'):
+                    # A record still being appended by another process
+                    break
+                yield offset, line
+                offset += len(line)
+
+    def _reversed_lines(self):
+        """Yield (offset, line) for every complete line, without its newline, from the end of the file."""
+        with open(self._store_path, 'rb') as store_file:
+            position = store_file.seek(0, os.SEEK_END)
+            buffer = b''
+            at_record_boundary = False
+            while position > 0:
+                size = min(_REVERSE_READ_BLOCK_SIZE, position)
+                position -= size
+                store_file.seek(position)
+                buffer = store_file.read(size) + buffer
+                if not at_record_boundary:
+                    # Skip a trailing record still being appended by another process
+                    newline = buffer.rfind(b'\n')
+                    if newline == -1:
+                        continue
+                    buffer = buffer[:newline + 1]
+                    at_record_boundary = True
+                cursor = position + len(buffer)
+                lines = buffer.split(b'\n')
+                buffer = lines[0]
+                for line in reversed(lines[1:]):
+                    cursor -= len(line)
+                    if line:
+                        yield cursor, line
+                    cursor -= 1
+            if at_record_boundary and buffer:
+                yield 0, buffer
 
 
 class EventStore(AbstractEventStore):
 
-    def __init__(self, store, publisher=None):
+    def __init__(self, store, publisher=None, snapshot_store=None):
+        """Create an EventStore.
+
+        Args:
+            store: The underlying record store, such as a JsonFileStore or a list.
+            publisher: An optional single-argument callable to which each event is passed
+                once it has been stored. Further ones can be added with subscribe().
+            snapshot_store: An optional SnapshotStore from which latest_snapshot() is answered.
+        """
         self._store = store
-        self._publisher = publisher if publisher is not None else lambda e: None
+        self._subscribers = [] if publisher is None else [publisher]
+        self._snapshot_store = snapshot_store
+        self._extant_aggregates = {}  # {entity class: ExtantAggregateIds}
+        self._projections = {}  # {projection class: projection}
+        self._latest_record = None
+        self._latest_event = None
+
+    def subscribe(self, subscriber):
+        """Pass every event stored from now on to a single-argument callable."""
+        self._subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.remove(subscriber)
 
     def extend(self, events):
         """Store a series of events.
@@ -54,13 +484,118 @@ class EventStore(AbstractEventStore):
         """
         self._store.extend(self._event_to_dict(event) for event in events)
         for event in events:
-            self._publisher(event)
+            for subscriber in self._subscribers:
+                subscriber(event)
+
+    def track_extant_aggregates(self, entity_class, **kwargs):
+        """Answer extant_aggregate_ids() for an entity class from an ExtantAggregateIds projection.
+
+        Args:
+            entity_class: An aggregate root entity class.
+            **kwargs: Arguments for the projection, such as its checkpoint_path.
+
+        Returns:
+            The projection, which should be closed when the store is no longer used.
+        """
+        projection = ExtantAggregateIds(self, entity_class, **kwargs)
+        self._extant_aggregates[entity_class] = projection
+        return projection
+
+    def add_projection(self, projection):
+        """Make a projection over this store available to repositories through projection()."""
+        self._projections[type(projection)] = projection
+
+    def projection(self, projection_class):
+        return self._projections.get(projection_class)
+
+    def extant_aggregate_ids(self, entity_class, upto_timestamp=None):
+        """The ids of the extant aggregates of entity_class, as of upto_timestamp if given.
+
+        With a projection only the most recent events, from before the earliest one at
+        or after upto_timestamp, are read to undo their changes.
+        """
+        projection = self._extant_aggregates.get(entity_class)
+        if projection is None:
+            return super().extant_aggregate_ids(entity_class, upto_timestamp)
+        return projection.ids(upto_timestamp)
+
+    def latest_snapshot(self, aggregate_id, upto_timestamp=None):
+        if self._snapshot_store is None:
+            return None
+        return self._snapshot_store.latest(aggregate_id, upto_timestamp)
+
+    def latest_snapshots(self, aggregate_ids, upto_timestamp=None):
+        if self._snapshot_store is None:
+            return {}
+        return self._snapshot_store.latest_with_ids(aggregate_ids, upto_timestamp)
 
     def __iter__(self):
         for obj in self._store:
             event = self._dict_to_event(obj)
             yield event
 
+    def __reversed__(self):
+        for obj in reversed(self._store):
+            event = self._dict_to_event(obj)
+            yield event
+
+    def events(self, for_aggregate_ids=None, upto_timestamp=None):
+        """Iterate over events, optionally restricted to some aggregates and up to a time.
+
+        If the underlying store is indexed by aggregate_id_key and for_aggregate_ids is
+        an iterable collection of ids, only the events of those aggregates are read.
+        """
+        if isinstance(for_aggregate_ids, Iterable) and getattr(self._store, 'indexed', False):
+            return self._indexed_events(for_aggregate_ids, upto_timestamp)
+        return super().events(for_aggregate_ids, upto_timestamp)
+
+    def events_from(self, position):
+        """Iterate, in store order, over the events from the one numbered position, counting from 0."""
+        return map(self._dict_to_event, records_from(self._store, position))
+
+    def _events_before(self, upto_timestamp):
+        if upto_timestamp >= _MAX_TIMESTAMP or not hasattr(self._store, 'records_before'):
+            return iter(self)
+        return map(self._dict_to_event, self._store.records_before(upto_timestamp))
+
+    def latest_timestamps(self, aggregate_ids):
+        """The timestamps of the most recent events of the given aggregates.
+
+        If the underlying store indexes event_timestamp_stamp by aggregate_id_key this
+        costs O(len(aggregate_ids)), otherwise the whole store is scanned.
+        """
+        if not getattr(self._store, 'stamped', False):
+            return super().latest_timestamps(aggregate_ids)
+        keys = {str(aggregate_id): aggregate_id for aggregate_id in aggregate_ids}
+        return {keys[key]: stamp for key, stamp in self._store.latest_stamps_with_keys(keys).items()}
+
+    def _indexed_events(self, aggregate_ids, upto_timestamp):
+        if upto_timestamp is None:
+            upto_timestamp = _MAX_TIMESTAMP
+        for obj in self._store.records_with_keys(str(aggregate_id) for aggregate_id in aggregate_ids):
+            event = self._dict_to_event(obj)
+            if event.timestamp < upto_timestamp:
+                yield event
+
+    def latest(self, for_aggregate_ids=None, upto_timestamp=None):
+        """The most recent event, optionally restricted to some aggregates or a time.
+
+        Without restrictions this costs O(1): the latest record is taken from stores
+        which track it, such as JsonFileStore, or otherwise from the end of the store.
+
+        Raises:
+            ValueError: If there is no such event.
+        """
+        if for_aggregate_ids is not None or upto_timestamp is not None:
+            return super().latest(for_aggregate_ids, upto_timestamp)
+        record = self._store.latest() if hasattr(self._store, 'latest') else next(reversed(self._store), None)
+        if record is None:
+            raise ValueError("Cannot return latest event from empty store {!r}".format(self._store))
+        if record is not self._latest_record:
+            self._latest_record = record
+            self._latest_event = self._dict_to_event(record)
+        return self._latest_event
+
     def _event_to_dict(self, event):
         topic = class_to_qualname(type(event))
         attributes = {key: value for key, value in vars(event).items() if not key.startswith('_')}
@@ -4,6 +4,8 @@ from itertools import chain
 from weakref import WeakValueDictionary
 
 from library.infrastructure_architecture.event_sourced_architecture.event_player import replay_events
+from library.infrastructure_architecture.event_sourced_architecture.projections import with_extant_changes
+from library.infrastructure_architecture.event_sourced_architecture.snapshots import replay_from_snapshot
 from utilities.itertools import deferred_chain, exactly_one
 
 
@@ -85,8 +87,8 @@ class EventTrackingRepository(metaclass=ABCMeta):
     def save_changes(self):
         """Save all pending changes from tracked aggregates into the persistent event-store."""
         change_events = self._transient_event_queue.separate_out(self.is_from_tracked_aggregate)
-        for event in change_events:
-            self._persistent_event_store.append(event)
+        if change_events:
+            self._persistent_event_store.extend(change_events)
 
     def __len__(self):
         return len(self._extant_aggregate_ids())
@@ -145,62 +147,42 @@ class EventTrackingRepository(metaclass=ABCMeta):
         assert aggregate_ids.isdisjoint(self._instantiated_ids()), \
                "Cannot load: {} with ids {} which are already instantiated".format(
                     self._aggregate_root_entity_class().__name__, aggregate_ids.intersection(self._instantiated_ids()))
+        snapshots = self._persistent_event_store.latest_snapshots(aggregate_ids)
         events = chain(
-            self._persistent_event_store,
+            self._persistent_event_store.events(for_aggregate_ids=aggregate_ids),
             filter(self.is_from_tracked_aggregate, self._transient_event_queue))
-        aggregate_root_entities = replay_events(events=events, mutator=self._mutator, aggregate_ids=aggregate_ids)
-        return aggregate_root_entities
+        if not snapshots:
+            return replay_events(events=events, mutator=self._mutator, aggregate_ids=aggregate_ids)
+        return self._replay_from_snapshots(events, aggregate_ids, snapshots)
+
+    def _replay_from_snapshots(self, events, aggregate_ids, snapshots):
+        """Lazily reconstitute aggregates from a single pass over their events.
+
+        Those aggregates which have a snapshot are replayed from it.
+        """
+        snapshotted_events = defaultdict(list)  # {aggregate_id: [event, ...]} of the snapshotted aggregates
+        replayed_events = []
+        for event in events:
+            if event.aggregate_id in snapshots:
+                snapshotted_events[event.aggregate_id].append(event)
+            else:
+                replayed_events.append(event)
+        yield from replay_events(events=replayed_events, mutator=self._mutator,
+                                 aggregate_ids=aggregate_ids.difference(snapshots))
+        for aggregate_id, snapshot in snapshots.items():
+            yield replay_from_snapshot(snapshot, snapshotted_events[aggregate_id], self._mutator)
 
     def _extant_aggregate_ids(self):
-        """A set of IDs for aggregates managed by this repository which have not been discarded."""
-        events = chain(
-            self._persistent_event_store,
-            filter(self.is_from_tracked_aggregate, self._transient_event_queue))
-        return extant_persisted_aggregate_ids(events, self._aggregate_root_entity_class)
+        """A set of IDs for aggregates managed by this repository which have not been discarded.
+
+        If the persistent event store maintains an ExtantAggregateIds projection, this costs
+        no more than applying the unsaved events of the tracked aggregates.
+        """
+        entity_class = self._aggregate_root_entity_class()
+        return with_extant_changes(self._persistent_event_store.extant_aggregate_ids(entity_class),
+                                   filter(self.is_from_tracked_aggregate, self._transient_event_queue),
+                                   entity_class)
 
     @abstractmethod
     def _aggregate_root_entity_class(self):
         raise NotImplementedError
-
-
-# TODO: Refactor this to be a projection
-def extant_persisted_aggregate_ids(events, entity_class):
-    """Scan all events in an event store to find extant aggregates of a specified type.
-
-    Use this function to find those aggregates which have been created, but not yet
-    discarded by the end of the event stream. Such entities are still 'extant'.
-
-    Args:
-        events: The event store to search.
-
-        entity_class: The name of an aggregate root entity class (as as string) within
-            which <EntityName>.Created and <EntityName>.Discarded event can be
-            found.
-
-    Return:
-        A set of extant aggregate root entity ids.
-    """
-    created_event_class = getattr(entity_class(), 'Created', None)
-    discarded_event_class = getattr(entity_class(), 'Discarded', None)
-
-    aggregate_ids = set()
-    for event in events:
-        if isinstance(event, created_event_class):
-            aggregate_id = event.aggregate_id
-            if aggregate_id in aggregate_ids:
-                raise InconsistentEventStreamError("Inconsistent event stream: Duplicate {} creation "
-                                                   "for id {}".format(entity_class.__name__, aggregate_id))
-            aggregate_ids.add(aggregate_id)
-
-        elif isinstance(event, discarded_event_class):
-            aggregate_id = event.aggregate_id
-            if aggregate_id not in aggregate_ids:
-                raise InconsistentEventStreamError("Inconsistent event stream: Discarding non-existent {} "
-                                                   "for id {}".format(entity_class.__name__, aggregate_id))
-            aggregate_ids.discard(aggregate_id)
-    return aggregate_ids
-
-
-class InconsistentEventStreamError(Exception):
-    pass
-
@@ -0,0 +1,127 @@
+import threading
+import time
+from concurrent.futures import Future
+from enum import Enum
+
+
+class FsyncPolicy(Enum):
+    always = 'always'      # sync as soon as appends are waiting, grouping those which arrive meanwhile
+    interval = 'interval'  # sync at most once per interval
+    never = 'never'        # leave writing back to the operating system
+
+
+class GroupCommitter:
+    """Make appends to a store durable in groups.
+
+    Appending to a JsonFileStore hands the records to the operating system, which
+    is enough for every reader of the store to see them, but they may still be lost
+    on a crash. Calling durable() after an append returns a future which resolves
+    once that append is on disk. A single background thread syncs the store on
+    behalf of all the appends made since its previous sync, so the appends of
+    concurrent units of work share one fsync rather than paying for one each.
+
+    Example:
+
+        committer = GroupCommitter(jfs, FsyncPolicy.interval, interval=0.05)
+        with UnitOfWork(eq, es) as u:
+            ...
+        await asyncio.wrap_future(committer.durable())
+    """
+
+    def __init__(self, store, policy=FsyncPolicy.always, interval=0.0):
+        """Create a GroupCommitter and start its sync thread.
+
+        Args:
+            store: An object with a sync() method which forces previous appends to disk.
+
+            policy: A FsyncPolicy or its value. With FsyncPolicy.never the futures from
+                durable() resolve immediately and the store is never synced.
+
+            interval: The minimum time in seconds between two syncs, used with
+                FsyncPolicy.interval.
+        """
+        self._store = store
+        self._policy = FsyncPolicy(policy)
+        self._interval = interval
+        self._condition = threading.Condition()
+        self._waiting = []  # [future, ...] of appends made since the current sync began
+        self._closed = False
+        self._syncs = 0
+        self._synced_appends = 0
+        self._thread = None
+        if self._policy is not FsyncPolicy.never:
+            self._thread = threading.Thread(target=self._run, name='group-committer', daemon=True)
+            self._thread.start()
+
+    @property
+    def policy(self):
+        return self._policy
+
+    def durable(self):
+        """A future which resolves once everything appended to the store so far is on disk.
+
+        Returns:
+            A concurrent.futures.Future. Its result is None, or it is set to the exception
+            raised by the store's sync().
+
+        Raises:
+            RuntimeError: If close() has been previously called.
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot wait for durability. {!r} has been closed.".format(self))
+            if self._policy is FsyncPolicy.never:
+                future.set_result(None)
+                return future
+            self._waiting.append(future)
+            self._condition.notify()
+        return future
+
+    def metrics(self):
+        """A dictionary of counters describing the syncs made so far."""
+        with self._condition:
+            return {
+                'policy': self._policy.value,
+                'interval_ms': self._interval * 1000.0,
+                'syncs': self._syncs,
+                'synced_appends': self._synced_appends,
+                'average_group_size': self._synced_appends / self._syncs if self._syncs else 0.0,
+                'waiting_appends': len(self._waiting)
+            }
+
+    def close(self):
+        """Sync the appends which are still waiting and stop the sync thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        last_sync = float('-inf')
+        while True:
+            with self._condition:
+                while not self._waiting and not self._closed:
+                    self._condition.wait()
+                if not self._waiting:
+                    return
+                if self._policy is FsyncPolicy.interval and not self._closed:
+                    # Let the appends of the rest of the interval join this group
+                    self._condition.wait_for(lambda: self._closed,
+                                             timeout=last_sync + self._interval - time.monotonic())
+                group, self._waiting = self._waiting, []
+
+            last_sync = time.monotonic()
+            try:
+                self._store.sync()
+            except Exception as exc:
+                for future in group:
+                    future.set_exception(exc)
+                continue
+
+            with self._condition:
+                self._syncs += 1
+                self._synced_appends += len(group)
+            for future in group:
+                future.set_result(None)
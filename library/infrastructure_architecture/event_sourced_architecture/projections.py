@@ -0,0 +1,346 @@
+import json
+import os
+import threading
+import warnings
+from abc import ABCMeta, abstractmethod
+from array import array
+from bisect import bisect_left
+from itertools import islice
+
+from library.infrastructure_architecture.event_sourced_architecture.transcoders import ObjectJSONEncoder, \
+    ObjectJSONDecoder
+
+
+# Errors of checkpoints which are malformed or were written by another version of a projection
+_CHECKPOINT_ERRORS = (ValueError, KeyError, TypeError, AttributeError, ImportError)
+
+# The number of events between two marks of the running maximum timestamp of ExtantAggregateIds
+_TIMESTAMP_MARK_EVERY = 1024
+
+
+class Projection(metaclass=ABCMeta):
+    """State derived from the events of an EventStore, kept up to date incrementally.
+
+    A projection applies each stored event once, in store order, and remembers how
+    many it has applied. catch_up() applies the events stored since. The projection
+    subscribes to the EventStore, so the events stored by this process are applied
+    as soon as they are stored, and the ones stored by other processes sharing the
+    store are applied the next time the projection is read. Reading a projection
+    which is up to date costs no more than checking that the store has not grown.
+
+    If a checkpoint_path is given, the state is saved there, together with the
+    position in the store, every checkpoint_every events and on close(). Periodic
+    checkpoints are saved on a background thread, which only holds the lock while
+    the state is copied, so storing an event never waits for one to be written. A
+    new projection starts from the checkpoint, so only the events stored after it
+    are replayed. A checkpoint which no longer matches the store, such as after the
+    store has been compacted, is ignored and the state is rebuilt from the start.
+
+    Subclasses set up their empty state before calling Projection.__init__, apply
+    events in _apply(), call catch_up() before reading the state, and hold _lock
+    while reading or writing it.
+    """
+
+    def __init__(self, event_store, checkpoint_path=None, checkpoint_every=1000):
+        """Create a projection and bring it up to date.
+
+        Args:
+            event_store: An EventStore.
+            checkpoint_path: An optional path of a file to which the state is saved.
+            checkpoint_every: The number of events applied between two checkpoints, or None
+                to only save one on close(), e.g. for a large state.
+        """
+        self._event_store = event_store
+        self._checkpoint_path = checkpoint_path
+        self._checkpoint_every = checkpoint_every
+        self._lock = threading.RLock()
+        self._position = 0  # the number of events applied
+        self._last_event = None  # [aggregate id string, timestamp] of the last event applied
+        self._checkpoint_position = 0
+        self._checkpoint_requested = 0  # the position at which the latest periodic checkpoint was started
+        self._checkpoint_lock = threading.Lock()  # held while a checkpoint file is written
+        self._checkpointer = None  # the thread saving a periodic checkpoint, if any
+        with self._lock:
+            self._load_checkpoint()
+            self.catch_up()
+        event_store.subscribe(self._on_stored)
+
+    @property
+    def position(self):
+        """The number of events of the store applied so far."""
+        return self._position
+
+    def catch_up(self):
+        """Apply the events stored since the last one applied."""
+        with self._lock:
+            for event in self._event_store.events_from(self._position):
+                self._apply(event)
+                self._position += 1
+                self._last_event = _event_mark(event)
+            if (self._checkpoint_path is not None and self._checkpoint_every is not None
+                    and self._checkpointer is None
+                    and self._position - self._checkpoint_requested >= self._checkpoint_every):
+                self._checkpoint_requested = self._position
+                self._checkpointer = threading.Thread(target=self._save_periodic_checkpoint,
+                                                      name='projection-checkpointer', daemon=True)
+                self._checkpointer.start()
+
+    def save_checkpoint(self):
+        """Write the state and position to the checkpoint file, replacing it in one step.
+
+        The state is copied with the projection locked, then encoded and written while
+        further events are applied. Must not be called with _lock held.
+        """
+        with self._checkpoint_lock:
+            with self._lock:
+                position = self._position
+                checkpoint = {'position': position, 'last_event': self._last_event,
+                              'state': self._state_to_jsonable()}
+            temporary_path = '{}.{}.tmp'.format(self._checkpoint_path, os.getpid())
+            with open(temporary_path, 'w') as checkpoint_file:
+                json.dump(checkpoint, checkpoint_file, separators=(',', ':'), cls=ObjectJSONEncoder)
+            os.replace(temporary_path, self._checkpoint_path)
+            self._checkpoint_position = position
+
+    def close(self):
+        """Stop following the event store, saving a final checkpoint if there is a checkpoint_path."""
+        self._event_store.unsubscribe(self._on_stored)
+        if self._checkpoint_path is not None:
+            self.catch_up()
+            with self._lock:
+                checkpointer = self._checkpointer
+            if checkpointer is not None:
+                checkpointer.join()
+            if self._position != self._checkpoint_position:
+                self.save_checkpoint()
+
+    def _save_periodic_checkpoint(self):
+        try:
+            self.save_checkpoint()
+        except Exception as exc:
+            # The next one is attempted checkpoint_every events later, or on close
+            warnings.warn("Could not save checkpoint {!r}: {}".format(self._checkpoint_path, exc), RuntimeWarning)
+        finally:
+            with self._lock:
+                self._checkpointer = None
+
+    def _on_stored(self, event):
+        self.catch_up()
+
+    def _load_checkpoint(self):
+        if self._checkpoint_path is None:
+            return
+        try:
+            with open(self._checkpoint_path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file, cls=ObjectJSONDecoder)
+            position = checkpoint['position']
+            last_event = checkpoint['last_event']
+            state = checkpoint['state']
+        except FileNotFoundError:
+            return
+        except _CHECKPOINT_ERRORS as exc:
+            warnings.warn("Ignoring unreadable checkpoint {!r}: {!r}".format(self._checkpoint_path, exc),
+                          RuntimeWarning)
+            return
+        if position > 0:
+            event = next(iter(self._event_store.events_from(position - 1)), None)
+            if event is None or _event_mark(event) != last_event:
+                # The store has been rewritten since the checkpoint
+                return
+        try:
+            self._state_from_jsonable(state)
+        except _CHECKPOINT_ERRORS as exc:
+            warnings.warn("Ignoring checkpoint {!r}: {!r}".format(self._checkpoint_path, exc), RuntimeWarning)
+            return
+        self._position = self._checkpoint_position = self._checkpoint_requested = position
+        self._last_event = last_event
+
+    @abstractmethod
+    def _apply(self, event):
+        """Update the state with an event."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def _state_to_jsonable(self):
+        """A JSON serializable copy of the state.
+
+        It must not share mutable containers with the state, since it is encoded
+        after the lock has been released.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def _state_from_jsonable(self, state):
+        """Restore the state saved by _state_to_jsonable().
+
+        The state is replaced only once all of it has been decoded, so that a checkpoint
+        which fails to load leaves the empty state to be rebuilt from the start.
+
+        Raises:
+            ValueError: If the saved state does not fit this projection.
+        """
+        raise NotImplementedError
+
+
+def _event_mark(event):
+    """A value identifying an event in a checkpoint."""
+    return [str(event.aggregate_id), event.timestamp]
+
+
+class ExtantAggregateIds(Projection):
+    """The ids of the aggregates of an entity class which have been created and not yet discarded.
+
+    The ids as of an earlier time are found by undoing the changes of the events at
+    or after it. Since processes sharing a store may append events out of timestamp
+    order, the running maximum of the timestamps is marked every 1024 events, and
+    every event after the last mark below that time is checked.
+
+    Example:
+
+        extant_predictions = ExtantAggregateIds(es, Prediction,
+                                                checkpoint_path='database/projections/extant_predictions.json')
+        len(extant_predictions)
+    """
+
+    def __init__(self, event_store, entity_class, **kwargs):
+        """Create the projection. See Projection for the keyword arguments."""
+        self._entity_class = entity_class
+        self._ids = set()
+        self._frozen_ids = frozenset()
+        self._max_timestamp = None  # of the events applied
+        self._timestamp_marks = array('d')  # [k - 1]: the maximum timestamp of the first k * 1024 events
+        super().__init__(event_store, **kwargs)
+
+    @property
+    def entity_class(self):
+        return self._entity_class
+
+    def ids(self, upto_timestamp=None):
+        """A frozenset of the extant aggregate ids, as of upto_timestamp if given.
+
+        The set is only copied when aggregates have been created or discarded since the
+        last call, or when changes at or after upto_timestamp are undone.
+        """
+        self.catch_up()
+        with self._lock:
+            if self._frozen_ids is None:
+                self._frozen_ids = frozenset(self._ids)
+            if upto_timestamp is None:
+                return self._frozen_ids
+            aggregate_ids, end = self._frozen_ids, self._position
+            start = bisect_left(self._timestamp_marks, upto_timestamp) * _TIMESTAMP_MARK_EVERY
+        # Every event before start is older than upto_timestamp, those after end are not applied yet
+        later_events = [event for event in islice(self._event_store.events_from(start), end - start)
+                        if event.timestamp >= upto_timestamp]
+        return without_extant_changes(aggregate_ids, reversed(later_events), self._entity_class)
+
+    def __len__(self):
+        self.catch_up()
+        return len(self._ids)
+
+    def __contains__(self, aggregate_id):
+        self.catch_up()
+        return aggregate_id in self._ids
+
+    def _apply(self, event):
+        if self._position > 0 and self._position % _TIMESTAMP_MARK_EVERY == 0:
+            self._timestamp_marks.append(self._max_timestamp)
+        if self._max_timestamp is None or event.timestamp > self._max_timestamp:
+            self._max_timestamp = event.timestamp
+        if isinstance(event, (self._entity_class.Created, self._entity_class.Discarded)):
+            _apply_extant_event(self._ids, event, self._entity_class)
+            self._frozen_ids = None
+
+    def _state_to_jsonable(self):
+        return {'ids': list(self._ids), 'max_timestamp': self._max_timestamp,
+                'timestamp_marks': self._timestamp_marks.tolist()}
+
+    def _state_from_jsonable(self, state):
+        ids = set(state['ids'])
+        timestamp_marks = array('d', state['timestamp_marks'])
+        self._ids = ids
+        self._frozen_ids = None
+        self._max_timestamp = state['max_timestamp']
+        self._timestamp_marks = timestamp_marks
+
+
+def extant_persisted_aggregate_ids(events, entity_class):
+    """Scan all events in an event store to find extant aggregates of a specified type.
+
+    Use this function to find those aggregates which have been created, but not yet
+    discarded by the end of the event stream. Such entities are still 'extant'.
+    Prefer an ExtantAggregateIds projection, which does not scan the whole store.
+
+    Args:
+        events: The event store to search.
+
+        entity_class: An aggregate root entity class within which <EntityName>.Created
+            and <EntityName>.Discarded event classes can be found.
+
+    Return:
+        A set of extant aggregate root entity ids.
+    """
+    aggregate_ids = set()
+    for event in events:
+        _apply_extant_event(aggregate_ids, event, entity_class)
+    return aggregate_ids
+
+
+def with_extant_changes(aggregate_ids, events, entity_class):
+    """Apply the creations and discards among some further events to a set of extant aggregate ids.
+
+    Returns:
+        The aggregate_ids themselves if none of the events creates or discards an aggregate
+        of entity_class, otherwise a new set.
+    """
+    changed_ids = None
+    for event in events:
+        if isinstance(event, (entity_class.Created, entity_class.Discarded)):
+            if changed_ids is None:
+                changed_ids = set(aggregate_ids)
+            _apply_extant_event(changed_ids, event, entity_class)
+    return aggregate_ids if changed_ids is None else changed_ids
+
+
+def without_extant_changes(aggregate_ids, later_events, entity_class):
+    """Undo the creations and discards among the latest events on a set of extant aggregate ids.
+
+    Args:
+        aggregate_ids: The extant aggregate ids after later_events.
+        later_events: The events to undo, newest first.
+        entity_class: An aggregate root entity class.
+
+    Returns:
+        The aggregate_ids themselves if none of the events creates or discards an aggregate
+        of entity_class, otherwise a new set.
+    """
+    changed_ids = None
+    for event in later_events:
+        if isinstance(event, (entity_class.Created, entity_class.Discarded)):
+            if changed_ids is None:
+                changed_ids = set(aggregate_ids)
+            if isinstance(event, entity_class.Created):
+                changed_ids.discard(event.aggregate_id)
+            else:
+                changed_ids.add(event.aggregate_id)
+    return aggregate_ids if changed_ids is None else changed_ids
+
+
+def _apply_extant_event(aggregate_ids, event, entity_class):
+    if isinstance(event, entity_class.Created):
+        aggregate_id = event.aggregate_id
+        if aggregate_id in aggregate_ids:
+            raise InconsistentEventStreamError("Inconsistent event stream: Duplicate {} creation "
+                                               "for id {}".format(entity_class.__name__, aggregate_id))
+        aggregate_ids.add(aggregate_id)
+
+    elif isinstance(event, entity_class.Discarded):
+        aggregate_id = event.aggregate_id
+        if aggregate_id not in aggregate_ids:
+            raise InconsistentEventStreamError("Inconsistent event stream: Discarding non-existent {} "
+                                               "for id {}".format(entity_class.__name__, aggregate_id))
+        aggregate_ids.discard(aggregate_id)
+
+
+class InconsistentEventStreamError(Exception):
+    pass
@@ -0,0 +1,633 @@
+import gzip
+import io
+import json
+import lzma
+import os
+import re
+import shutil
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from itertools import chain
+
+from library.infrastructure_architecture.event_sourced_architecture.event_store import _exclusive_lock, \
+    aggregate_id_key, event_timestamp_stamp, records_from
+
+
+_MANIFEST_NAME = 'manifest.json'
+_LOCK_NAME = 'manifest.lock'
+_CODECS = {  # {compression: (file name suffix, open function)}
+    'gzip': ('.gz', gzip.open),
+    'lzma': ('.xz', lzma.open)
+}
+_KEYS_SUFFIX = '.keys'
+
+
+class SegmentedStore:
+    """A store which rolls its records over into a series of segment files.
+
+    Records are appended to the active segment, the last one, until it reaches
+    max_segment_bytes or becomes older than max_segment_age seconds. It is then
+    sealed - synced and never appended to again - and a new active segment is
+    started. The segments are listed, in order, in a manifest.json file in the
+    store directory, together with the timestamp range of each sealed segment, so
+    records_before() skips the sealed segments holding only later records. Sealed
+    segments can be archived, or rewritten by compact().
+
+    Each segment is itself a store, such as a JsonFileStore or BinaryFileStore,
+    opened by a factory, so a SegmentedStore can be used wherever one of those is:
+
+        store = SegmentedStore('database/store.segments',
+                               open_segment=partial(JsonFileStore, json_encoder_class=ObjectJSONEncoder,
+                                                    json_decoder_class=ObjectJSONDecoder),
+                               max_segment_bytes=64 * 1024 * 1024)
+        es = EventStore(store)
+
+    Appends and rotations by several processes are serialized by a lock on the
+    manifest.lock file, and every process reloads the manifest once it has changed.
+    If the manifest is missing, it is rebuilt from the segment files in the
+    directory, so an existing single-file store can be adopted by moving it into an
+    empty directory as the first segment, e.g. store.segments/00000001.events.
+
+    Sealed segments can be compressed, with the codec recorded per segment in the
+    manifest so that changing it later leaves older segments readable. Compression
+    runs on a background thread after each rotation, so appends never wait for it,
+    and the uncompressed segment is only removed once the manifest lists the
+    compressed one. A compressed segment is decompressed while it is iterated, and
+    a summary of the latest timestamp of each key in it, written beside it, answers
+    latest_stamps_with_keys() and lets records_with_keys() skip it unless it holds
+    one of the keys. The segments decompressed for records_with_keys() and latest()
+    are kept in memory, up to decompressed_cache_bytes, so that looking up several
+    aggregates in the same segment decompresses it once. The active segment is never
+    compressed.
+    """
+
+    def __init__(self, directory, open_segment, segment_suffix='.events', max_segment_bytes=64 * 1024 * 1024,
+                 max_segment_age=None, compression=None, read_records=None, read_records_reversed=None,
+                 record_key=aggregate_id_key, record_timestamp=event_timestamp_stamp, clock=time.time,
+                 decompressed_cache_bytes=None):
+        """Open a segmented store, creating the directory and its first segment if needed.
+
+        Args:
+            directory: The path to the directory holding the manifest and the segments.
+            open_segment: A callable which opens the store for a segment, given its path, and
+                read_only=True for sealed segments, which must not be created or appended to,
+                e.g. a partial of JsonFileStore.
+            segment_suffix: The file name suffix of the segments, e.g. '.events.bin'.
+            max_segment_bytes: The size at which the active segment is sealed.
+            max_segment_age: An optional age in seconds at which the active segment is sealed.
+            compression: None, 'gzip' or 'lzma', the codec with which segments are compressed
+                once sealed.
+            read_records: A function returning an iterator over the records read from a binary
+                stream of a segment, e.g. read_json_records. Required to read compressed segments.
+            read_records_reversed: An optional function returning an iterator over the records of
+                the bytes of a segment, newest first, e.g. read_json_records_reversed. Without it a
+                compressed segment is read whole to be iterated over in reverse.
+            record_key: A function returning the aggregate key of a record.
+            record_timestamp: A function returning the timestamp of a record.
+            clock: A zero-argument callable returning the current time in seconds since the epoch.
+            decompressed_cache_bytes: The total size of the decompressed segments kept in memory.
+                Defaults to max_segment_bytes, about one segment.
+        """
+        if compression is not None and compression not in _CODECS:
+            raise ValueError("Unknown compression {!r}, expected one of {}".format(compression, sorted(_CODECS)))
+        self._directory = directory
+        self._open_segment = open_segment
+        self._compression = compression
+        self._read_records = read_records
+        self._read_records_reversed = read_records_reversed
+        self._record_key = record_key
+        self._segment_suffix = segment_suffix
+        self._max_segment_bytes = max_segment_bytes
+        self._max_segment_age = max_segment_age
+        self._record_timestamp = record_timestamp
+        self._clock = clock
+        self._segments = []  # manifest entries, in order
+        self._stores = {}  # {segment name: open segment store}
+        self._manifest_stamp = None
+        self._compressor = None
+        self._compressor_lock = threading.Lock()
+        self._compression_requested = False
+        self._compress_lock = threading.Lock()
+        self._decompressed = _DecompressedSegments(
+            max_segment_bytes if decompressed_cache_bytes is None else decompressed_cache_bytes)
+        self._active_range = None  # the range of the records of the active segment, see _track_active_range()
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, _LOCK_NAME), 'ab')
+        with _exclusive_lock(self._lock_file):
+            if not os.path.exists(self._manifest_path):
+                self._recover_manifest()
+            self._refresh()
+            self._track_active_range()
+
+    @property
+    def indexed(self):
+        return getattr(self._active_store(), 'indexed', False)
+
+    @property
+    def stamped(self):
+        return getattr(self._active_store(), 'stamped', False)
+
+    def segments(self):
+        """A list of the manifest entries of the segments, oldest first."""
+        self._refresh()
+        return [dict(segment) for segment in self._segments]
+
+    def append(self, obj):
+        self.extend((obj,))
+
+    def extend(self, objs):
+        objs = list(objs)
+        with _exclusive_lock(self._lock_file):
+            self._refresh()
+            if self._rotation_due():
+                self._rotate()
+            self._track_active_range()
+            self._active_store().extend(objs)
+            self._active_range.update(objs, os.path.getsize(self._segment_path(self._segments[-1])))
+
+    def __iter__(self):
+        self._refresh()
+        return chain.from_iterable(self._segment_store(segment) for segment in list(self._segments))
+
+    def __reversed__(self):
+        self._refresh()
+        return chain.from_iterable(reversed(self._segment_store(segment)) for segment in reversed(self._segments))
+
+    def records_before(self, timestamp):
+        """Iterate over the records, skipping the sealed segments whose records are all at or after timestamp."""
+        self._refresh()
+        for segment in list(self._segments):
+            if segment['sealed'] and (segment['records'] == 0 or segment['min_timestamp'] >= timestamp):
+                continue
+            yield from self._segment_store(segment)
+
+    def records_from(self, position):
+        """Iterate over the records from the one numbered position, skipping the sealed segments before it."""
+        self._refresh()
+        for segment in list(self._segments):
+            if segment['sealed'] and segment['records'] <= position:
+                position -= segment['records']
+                continue
+            yield from records_from(self._segment_store(segment), position)
+            position = 0
+
+    def records_with_keys(self, keys):
+        keys = set(keys)
+        self._refresh()
+        for segment in list(self._segments):
+            yield from self._segment_store(segment).records_with_keys(keys)
+
+    def latest_stamps_with_keys(self, keys):
+        remaining = set(keys)
+        stamps = {}
+        self._refresh()
+        for segment in reversed(self._segments):
+            if not remaining:
+                break
+            segment_stamps = self._segment_store(segment).latest_stamps_with_keys(remaining)
+            stamps.update(segment_stamps)
+            remaining.difference_update(segment_stamps)
+        return stamps
+
+    def latest(self):
+        """The most recently appended record.
+
+        Raises:
+            ValueError: If the store is empty.
+        """
+        self._refresh()
+        for segment in reversed(self._segments):
+            try:
+                return self._segment_store(segment).latest()
+            except ValueError:
+                continue
+        raise ValueError("Cannot return latest record from empty store {!r}".format(self._directory))
+
+    def sync(self):
+        """Force the records appended to the active segment so far onto disk. Sealed segments are already synced."""
+        self._active_store().sync()
+
+    def close(self):
+        with self._compressor_lock:
+            compressor = self._compressor
+        if compressor is not None:
+            compressor.join()
+        for store in self._stores.values():
+            store.close()
+        self._stores.clear()
+        self._lock_file.close()
+
+    def compress_sealed_segments(self):
+        """Compress the sealed segments which are not compressed yet, if compression is configured.
+
+        Returns:
+            The number of segments compressed.
+        """
+        if self._compression is None:
+            return 0
+        compressed = 0
+        # The lock file is opened again so that its lock also excludes the other threads of this process
+        with self._compress_lock, open(os.path.join(self._directory, _LOCK_NAME), 'ab') as lock_file:
+            with _exclusive_lock(lock_file):
+                segments = self._read_manifest()
+            for segment in segments:
+                if not segment['sealed'] or segment.get('compression') is not None:
+                    continue
+                temporary_path = self._compress(segment)
+                with _exclusive_lock(lock_file):
+                    # Another process may have compressed or compacted the segment meanwhile
+                    current = {s['name']: s for s in self._read_manifest()}
+                    if segment['name'] in current and current[segment['name']].get('compression') is None:
+                        compressed_path = self._segment_path(segment, self._compression)
+                        os.replace(temporary_path + _KEYS_SUFFIX, compressed_path + _KEYS_SUFFIX)
+                        os.replace(temporary_path, compressed_path)
+                        current[segment['name']]['compression'] = self._compression
+                        self._write_manifest(list(current.values()))
+                        _remove_segment_files(self._directory, segment['name'], uncompressed_only=True)
+                        compressed += 1
+                    else:
+                        os.remove(temporary_path)
+                        os.remove(temporary_path + _KEYS_SUFFIX)
+        return compressed
+
+    def compact(self, drop_aggregate):
+        """Rewrite the segments without the records of some aggregates.
+
+        This must only be run while no other process uses the store. Every record of an
+        aggregate for which drop_aggregate returns True for any of its records, such as
+        its Discarded event, is dropped. The remaining records are copied, in order, to
+        new segment files, the manifest is replaced in one step to list them, and the old
+        segment files - together with the files named after them, such as indexes - are
+        removed. Sealed segments left empty are omitted.
+
+        Args:
+            drop_aggregate: A predicate of a record.
+
+        Returns:
+            A pair of the numbers of records kept and dropped.
+        """
+        with _exclusive_lock(self._lock_file):
+            self._refresh()
+            old_segments = self._segments
+            dropped_keys = {self._record_key(record) for record in self if drop_aggregate(record)}
+
+            new_segments = []
+            kept = dropped = 0
+            for segment in old_segments:
+                new_segment = self._new_segment(old_segments + new_segments)
+                new_segment.update(sealed=segment['sealed'], created_at=segment['created_at'])
+                records = []
+                for record in self._segment_store(segment):
+                    if self._record_key(record) in dropped_keys:
+                        dropped += 1
+                    else:
+                        records.append(record)
+                kept += len(records)
+                if segment['sealed'] and not records:
+                    continue
+                new_store = self._open_segment(self._segment_path(new_segment))
+                new_store.extend(records)
+                new_store.sync()
+                if segment['sealed']:
+                    new_segment.update(_segment_range(new_store, self._record_timestamp))
+                new_store.close()
+                new_segments.append(new_segment)
+
+            self._write_manifest(new_segments)
+            self._refresh()
+            for segment in old_segments:
+                _remove_segment_files(self._directory, segment['name'])
+        self.compress_sealed_segments()
+        return kept, dropped
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self._directory, _MANIFEST_NAME)
+
+    def _segment_path(self, segment, compression=None):
+        suffix = '' if compression is None else _CODECS[compression][0]
+        return os.path.join(self._directory, segment['name'] + suffix)
+
+    def _segment_store(self, segment):
+        compression = segment.get('compression')
+        path = self._segment_path(segment, compression)
+        store = self._stores.get(path)
+        if store is None:
+            if compression is not None:
+                store = _CompressedSegment(path, _CODECS[compression][1], self._read_records,
+                                           self._read_records_reversed, self._record_key, self._decompressed)
+            elif segment['sealed']:
+                try:
+                    store = self._open_segment(path, read_only=True)
+                except FileNotFoundError:
+                    # The entry is stale: the segment has been compressed since the manifest was read
+                    current = self._current_segment(segment['name'])
+                    if current is None or current.get('compression') is None:
+                        raise
+                    return self._segment_store(current)
+            else:
+                store = self._open_segment(path)
+            self._stores[path] = store
+        return store
+
+    def _current_segment(self, name):
+        """The entry of a segment in the manifest as it is now, or None if it is no longer listed."""
+        self._refresh()
+        return next((segment for segment in self._segments if segment['name'] == name), None)
+
+    def _compress(self, segment):
+        """Write a compressed copy of a sealed segment and the summary of its keys to temporary files.
+
+        Returns:
+            The path of the compressed copy. The summary is beside it, with the '.keys' suffix.
+        """
+        suffix, open_compressed = _CODECS[self._compression]
+        temporary_path = '{}.{}.tmp'.format(self._segment_path(segment, self._compression), os.getpid())
+        with open(self._segment_path(segment), 'rb') as segment_file, open_compressed(temporary_path, 'wb') as compressed:
+            shutil.copyfileobj(segment_file, compressed)
+        stamps = {}
+        with open_compressed(temporary_path, 'rb') as compressed:
+            for record in self._read_records(compressed):
+                stamps[self._record_key(record)] = self._record_timestamp(record)
+        with open(temporary_path + _KEYS_SUFFIX, 'w') as keys_file:
+            json.dump(stamps, keys_file, separators=(',', ':'))
+        for path in (temporary_path, temporary_path + _KEYS_SUFFIX):
+            with open(path, 'rb') as written_file:
+                os.fsync(written_file.fileno())
+        return temporary_path
+
+    def _start_compressor(self):
+        if self._compression is None:
+            return
+        with self._compressor_lock:
+            self._compression_requested = True
+            if self._compressor is None:
+                self._compressor = threading.Thread(target=self._compress_until_done, name='segment-compressor',
+                                                    daemon=True)
+                self._compressor.start()
+
+    def _compress_until_done(self):
+        while True:
+            with self._compressor_lock:
+                if not self._compression_requested:
+                    self._compressor = None
+                    return
+                self._compression_requested = False
+            try:
+                self.compress_sealed_segments()
+            except Exception as exc:
+                # Leave the segments uncompressed until the next rotation tries again
+                warnings.warn("Could not compress sealed segments in {!r}: {}".format(self._directory, exc),
+                              RuntimeWarning)
+
+    def _active_store(self):
+        return self._segment_store(self._segments[-1])
+
+    def _rotation_due(self):
+        active = self._segments[-1]
+        self._segment_store(active)  # creates the segment file
+        size = os.path.getsize(self._segment_path(active))
+        if size == 0:
+            return False
+        if size >= self._max_segment_bytes:
+            return True
+        return self._max_segment_age is not None and self._clock() - active['created_at'] >= self._max_segment_age
+
+    def _rotate(self):
+        """Seal the active segment and start a new one. Must be called with the store locked."""
+        active = self._segments[-1]
+        self._active_store().sync()
+        self._track_active_range()
+        active.update(self._active_range.manifest_fields(), sealed=True)
+        self._segments.append(self._new_segment(self._segments))
+        self._write_manifest(self._segments)
+        self._start_compressor()
+
+    def _track_active_range(self):
+        """Bring the range of the records of the active segment up to date. Must be called with the store locked.
+
+        The range is updated with the records as they are appended, so only the records
+        appended by other processes since are read, and sealing the segment never reads
+        the whole of it.
+        """
+        active = self._segments[-1]
+        store = self._active_store()
+        if self._active_range is None or self._active_range.name != active['name']:
+            self._active_range = _SegmentRange(active['name'], self._record_timestamp)
+        size = os.path.getsize(self._segment_path(active))
+        if size != self._active_range.size:
+            self._active_range.update(records_from(store, self._active_range.records), size)
+
+    def _new_segment(self, segments):
+        number = max((_segment_number(segment['name']) for segment in segments), default=0) + 1
+        return {'name': '{:08d}{}'.format(number, self._segment_suffix), 'sealed': False,
+                'created_at': self._clock()}
+
+    def _write_manifest(self, segments):
+        temporary_path = self._manifest_path + '.tmp'
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump({'segments': segments}, manifest_file, indent=2)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(temporary_path, self._manifest_path)
+
+    def _read_manifest(self):
+        with open(self._manifest_path) as manifest_file:
+            return json.load(manifest_file)['segments']
+
+    def _refresh(self):
+        """Reload the manifest if another process, compression or compaction has replaced it."""
+        stat = os.stat(self._manifest_path)
+        manifest_stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if manifest_stamp == self._manifest_stamp:
+            return
+        self._segments = self._read_manifest()
+        self._manifest_stamp = manifest_stamp
+        paths = {self._segment_path(segment, segment.get('compression')) for segment in self._segments}
+        for path in list(self._stores):
+            if path not in paths:
+                self._stores.pop(path).close()
+
+    def _recover_manifest(self):
+        """Write a manifest listing the segment files in the directory, all but the last sealed."""
+        compressions = {}  # {segment name: compression}
+        for file_name in os.listdir(self._directory):
+            for compression, (suffix, _) in chain([(None, ('', None))], _CODECS.items()):
+                name = file_name[:len(file_name) - len(suffix)]
+                if file_name.endswith(suffix) and _is_segment_name(name, self._segment_suffix):
+                    # Prefer an uncompressed segment left by compression being interrupted
+                    if compressions.get(name, 'unknown') is not None:
+                        compressions[name] = compression
+        segments = [{'name': name, 'sealed': False, 'created_at': self._clock(), 'compression': compressions[name]}
+                    for name in sorted(compressions, key=_segment_number)]
+        for segment in segments[:-1]:
+            segment['sealed'] = True
+            store = self._segment_store(segment)
+            segment.update(_segment_range(store, self._record_timestamp))
+            self._stores.pop(self._segment_path(segment, segment['compression'])).close()
+        if not segments:
+            segments.append(self._new_segment(segments))
+        self._write_manifest(segments)
+
+
+class _SegmentRange:
+    """The number of records of a segment and their timestamp range, updated as records are appended."""
+
+    def __init__(self, name, record_timestamp):
+        self.name = name
+        self.size = 0  # the size of the segment file once the records counted had been appended
+        self.records = 0
+        self._record_timestamp = record_timestamp
+        self._min_timestamp = None
+        self._max_timestamp = None
+
+    def update(self, records, size):
+        for record in records:
+            timestamp = self._record_timestamp(record)
+            if self.records == 0:
+                self._min_timestamp = self._max_timestamp = timestamp
+            else:
+                self._min_timestamp = min(self._min_timestamp, timestamp)
+                self._max_timestamp = max(self._max_timestamp, timestamp)
+            self.records += 1
+        self.size = size
+
+    def manifest_fields(self):
+        return {'min_timestamp': self._min_timestamp, 'max_timestamp': self._max_timestamp, 'records': self.records}
+
+
+def _segment_range(store, record_timestamp):
+    timestamps = [record_timestamp(record) for record in store]
+    if not timestamps:
+        return {'min_timestamp': None, 'max_timestamp': None, 'records': 0}
+    return {'min_timestamp': min(timestamps), 'max_timestamp': max(timestamps), 'records': len(timestamps)}
+
+
+def _segment_number(name):
+    return int(re.match(r'\d+', name).group())
+
+
+def _is_segment_name(name, suffix):
+    return re.fullmatch(r'\d+' + re.escape(suffix), name) is not None
+
+
+def _remove_segment_files(directory, name, uncompressed_only=False):
+    """Remove a segment file and the files named after it, such as its index."""
+    compressed_names = tuple(name + suffix for suffix, _ in _CODECS.values())
+    for file_name in os.listdir(directory):
+        if file_name == name or file_name.startswith(name + '.'):
+            if uncompressed_only and file_name.startswith(compressed_names):
+                continue
+            os.remove(os.path.join(directory, file_name))
+
+
+class _DecompressedSegments:
+    """The decompressed contents of the most recently used compressed segments, up to a total size."""
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._contents = OrderedDict()  # {path: bytes}, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def peek(self, path):
+        """The contents of a segment if they are in memory, otherwise None."""
+        with self._lock:
+            return self._contents.get(path)
+
+    def get(self, path, open_compressed):
+        """The contents of a segment, decompressed unless they are in memory already."""
+        with self._lock:
+            contents = self._contents.get(path)
+            if contents is not None:
+                self._contents.move_to_end(path)
+                return contents
+        with open_compressed(path, 'rb') as compressed:
+            contents = compressed.read()
+        with self._lock:
+            if path not in self._contents and len(contents) <= self._max_bytes:
+                self._contents[path] = contents
+                self._size += len(contents)
+                while self._size > self._max_bytes:
+                    self._size -= len(self._contents.popitem(last=False)[1])
+        return contents
+
+    def discard(self, path):
+        with self._lock:
+            contents = self._contents.pop(path, None)
+            if contents is not None:
+                self._size -= len(contents)
+
+
+class _CompressedSegment:
+    """A read-only sealed segment, decompressed while it is read."""
+
+    def __init__(self, path, open_compressed, read_records, read_records_reversed, record_key, decompressed):
+        if read_records is None:
+            raise ValueError("Cannot read compressed segment {!r} without read_records".format(path))
+        self._path = path
+        self._open_compressed = open_compressed
+        self._read_records = read_records
+        self._read_records_reversed = read_records_reversed
+        self._record_key = record_key
+        self._decompressed = decompressed
+        self._stamps = None  # {key: timestamp of the latest record}, loaded on first use
+        self._latest = None
+
+    @property
+    def indexed(self):
+        return True
+
+    @property
+    def stamped(self):
+        return True
+
+    def __iter__(self):
+        contents = self._decompressed.peek(self._path)
+        if contents is not None:
+            yield from self._read_records(io.BytesIO(contents))
+            return
+        # A full scan streams the segment rather than evicting the segments kept for lookups
+        with self._open_compressed(self._path, 'rb') as compressed:
+            yield from self._read_records(compressed)
+
+    def __reversed__(self):
+        if self._read_records_reversed is None:
+            return reversed(list(self))
+        # The decompressed contents are kept for lookups, such as of the latest records, as well
+        return self._read_records_reversed(self._decompressed.get(self._path, self._open_compressed))
+
+    def records_with_keys(self, keys):
+        keys = set(keys).intersection(self._key_stamps())
+        if keys:
+            yield from (record for record in self._records() if self._record_key(record) in keys)
+
+    def latest_stamps_with_keys(self, keys):
+        stamps = self._key_stamps()
+        return {key: stamps[key] for key in keys if key in stamps}
+
+    def latest(self):
+        if self._latest is None:
+            # The segment is sealed, so its latest record never changes
+            for self._latest in self._records():
+                pass
+        if self._latest is None:
+            raise ValueError("Cannot return latest record from empty segment {!r}".format(self._path))
+        return self._latest
+
+    def sync(self):
+        pass
+
+    def close(self):
+        self._decompressed.discard(self._path)
+
+    def _records(self):
+        return self._read_records(io.BytesIO(self._decompressed.get(self._path, self._open_compressed)))
+
+    def _key_stamps(self):
+        if self._stamps is None:
+            with open(self._path + _KEYS_SUFFIX) as keys_file:
+                self._stamps = json.load(keys_file)
+        return self._stamps
@@ -0,0 +1,178 @@
+from collections import defaultdict
+
+from library.infrastructure_architecture.event_sourced_architecture.event_player import replay_events
+from utilities.identifiers import class_to_qualname, qualname_to_class
+from utilities.time import _MAX_TIMESTAMP
+
+
+class Snapshot:
+    """The state of an aggregate root entity as of one of its events.
+
+    Attributes:
+        aggregate_id: The id of the aggregate.
+        version: The version of the aggregate root entity in the snapshot.
+        timestamp: The timestamp of the last event reflected in the snapshot.
+    """
+
+    def __init__(self, aggregate_id, version, timestamp, topic, state):
+        self.aggregate_id = aggregate_id
+        self.version = version
+        self.timestamp = timestamp
+        self._topic = topic
+        self._state = state
+
+    @classmethod
+    def of(cls, entity, timestamp):
+        """Take a snapshot of an entity whose last event has the given timestamp."""
+        return cls(entity.id, entity.version, timestamp, class_to_qualname(type(entity)), entity.__getstate__())
+
+    def entity(self):
+        """A new entity instance with the state in the snapshot."""
+        entity_class = qualname_to_class(self._topic)
+        entity = entity_class.__new__(entity_class)
+        entity.__setstate__(dict(self._state))
+        return entity
+
+    def to_dict(self):
+        return dict(aggregate_id=self.aggregate_id, version=self.version, timestamp=self.timestamp,
+                    topic=self._topic, state=self._state)
+
+    @classmethod
+    def from_dict(cls, obj):
+        return cls(**obj)
+
+    def __repr__(self):
+        return "{}(aggregate_id={!r}, version={!r}, timestamp={!r})".format(
+            self.__class__.__name__, self.aggregate_id, self.version, self.timestamp)
+
+
+def events_after(snapshot, events):
+    """Those events which happened after the snapshot was taken."""
+    return (event for event in events if event.timestamp > snapshot.timestamp)
+
+
+def replay_from_snapshot(snapshot, events, mutator):
+    """Reconstitute an aggregate from a snapshot and those of its events which came later.
+
+    Args:
+        snapshot: The Snapshot of the aggregate.
+        events: An iterable series of events, which may include events of other aggregates
+            and events from before the snapshot.
+        mutator: The two-argument reducing function passed to replay_events().
+
+    Returns:
+        The aggregate root entity.
+    """
+    entity = snapshot.entity()
+    replayed = replay_events(events=events_after(snapshot, events), mutator=mutator,
+                             aggregate_ids={snapshot.aggregate_id}, stream_primer=entity)
+    return next(iter(replayed), entity)
+
+
+class SnapshotStore:
+    """Snapshots of aggregates, by aggregate id and version.
+
+    Snapshots are appended to an underlying record store, such as a JsonFileStore
+    with the ObjectJSONEncoder, and are also held in memory, so the latest of an
+    aggregate is found without reading the store. Snapshots saved by other
+    processes are seen after the SnapshotStore is created again.
+
+    Example:
+
+        snapshot_store = SnapshotStore(JsonFileStore('database/store.snapshots',
+                                                     json_encoder_class=ObjectJSONEncoder,
+                                                     json_decoder_class=ObjectJSONDecoder))
+        es = EventStore(jfs, snapshot_store=snapshot_store)
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._snapshots = defaultdict(list)  # {aggregate_id: [snapshot, ...]} in order of timestamp
+        for obj in store:
+            self._add(Snapshot.from_dict(obj))
+
+    def save(self, snapshot):
+        self._store.append(snapshot.to_dict())
+        self._add(snapshot)
+
+    def latest(self, aggregate_id, upto_timestamp=None):
+        """The most recent snapshot of an aggregate taken before upto_timestamp, or None."""
+        if upto_timestamp is None:
+            upto_timestamp = _MAX_TIMESTAMP
+        for snapshot in reversed(self._snapshots.get(aggregate_id, ())):
+            if snapshot.timestamp < upto_timestamp:
+                return snapshot
+        return None
+
+    def latest_with_ids(self, aggregate_ids, upto_timestamp=None):
+        """A dictionary mapping those of the aggregate_ids which have a snapshot taken before
+        upto_timestamp to the most recent one."""
+        snapshots = {}
+        for aggregate_id in aggregate_ids:
+            if aggregate_id in self._snapshots:
+                snapshot = self.latest(aggregate_id, upto_timestamp)
+                if snapshot is not None:
+                    snapshots[aggregate_id] = snapshot
+        return snapshots
+
+    def close(self):
+        if hasattr(self._store, 'close'):
+            self._store.close()
+
+    def _add(self, snapshot):
+        snapshots = self._snapshots[snapshot.aggregate_id]
+        snapshots.append(snapshot)
+        if len(snapshots) > 1 and snapshots[-2].timestamp > snapshot.timestamp:
+            snapshots.sort(key=lambda s: s.timestamp)
+
+
+class Snapshotter:
+    """Take a snapshot of each aggregate every so many stored events.
+
+    A Snapshotter subscribes to an EventStore, so it only sees events once they have
+    been committed. When every events of an aggregate of entity_class have been
+    stored since its last snapshot, the aggregate is reconstituted from that snapshot
+    and the later events, and a new snapshot is saved.
+
+    The events since the last snapshot are counted from versions rather than kept
+    per aggregate: an event carries the version of the entity it is applied to,
+    which every event but the creation increments. So the Snapshotter holds no state
+    per aggregate, and counts the events stored before it was created too.
+
+    Example:
+
+        es.subscribe(Snapshotter(es, snapshot_store, prediction.mutate, Prediction, every=100))
+    """
+
+    def __init__(self, event_store, snapshot_store, mutator, entity_class, every):
+        self._event_store = event_store
+        self._snapshot_store = snapshot_store
+        self._mutator = mutator
+        self._entity_class = entity_class
+        self._every = every
+
+    def __call__(self, event):
+        if not self._is_entity_event(event):
+            return
+        if isinstance(event, self._entity_class.Created):
+            version = event.entity_version
+        else:
+            version = event.entity_version + 1
+        snapshot = self._snapshot_store.latest(event.aggregate_id)
+        snapshot_version = -1 if snapshot is None else snapshot.version  # -1 counts the creation
+        if version - snapshot_version >= self._every:
+            self._snapshot_store.save(self._take_snapshot(event.aggregate_id, event.timestamp))
+
+    def _is_entity_event(self, event):
+        event_class = type(event)
+        return (event_class.__module__ == self._entity_class.__module__
+                and event_class.__qualname__.startswith(self._entity_class.__qualname__ + '.'))
+
+    def _take_snapshot(self, aggregate_id, timestamp):
+        snapshot = self._snapshot_store.latest(aggregate_id)
+        events = self._event_store.events(for_aggregate_ids=[aggregate_id])
+        if snapshot is None:
+            entity, = replay_events(events=events, mutator=self._mutator, aggregate_ids={aggregate_id})
+        else:
+            entity = replay_from_snapshot(snapshot, events, self._mutator)
+        return Snapshot.of(entity, timestamp)
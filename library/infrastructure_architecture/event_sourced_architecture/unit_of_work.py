@@ -3,7 +3,8 @@ from enum import Enum
 from itertools import chain
 
 from library.infrastructure_architecture.event_sourced_architecture.abstract_event_store import AbstractEventStore
-from utilities.time import monotonic_utc_now
+from library.infrastructure_architecture.event_sourced_architecture.projections import with_extant_changes
+from utilities.time import monotonic_utc_now, _next_up
 
 
 class UnitOfWorkError(Exception):
@@ -104,11 +105,7 @@ class UnitOfWork:
         modified_aggregate_ids = set(event.aggregate_id for event in self._event_store_interceptor.pending_events())
 
         # Get the timestamp of the most recent *persisted* event pertaining to each of these aggregates.
-        modification_timestamps = {}
-        for event in self._persistent_event_store:
-            if event.aggregate_id in modified_aggregate_ids:
-                modification_timestamps[event.aggregate_id] = max(modification_timestamps.get(event.aggregate_id, 0.0),
-                                                                  event.timestamp)
+        modification_timestamps = self._persistent_event_store.latest_timestamps(modified_aggregate_ids)
 
         # Check that none of the modified aggregates have been modified more recently than the beginning
         # of this unit-of work
@@ -214,10 +211,41 @@ class _ReadThroughEventStoreWriteInterceptor(AbstractEventStore):
         return iter(self._events)
 
     def __iter__(self):
-        return chain((event for event in self._persistent_event_store
-                      if event.timestamp <= self._unit_of_work._latest_timestamp),
+        return chain(self._persistent_event_store.events(upto_timestamp=self._persisted_upto(None)),
                      self.pending_events())
 
+    def events(self, for_aggregate_ids=None, upto_timestamp=None):
+        # Delegate to the persistent store, so that it can use an index to select the aggregates
+        pending = (event for event in self.pending_events()
+                   if (for_aggregate_ids is None or event.aggregate_id in for_aggregate_ids)
+                   and (upto_timestamp is None or event.timestamp < upto_timestamp))
+        persisted = self._persistent_event_store.events(for_aggregate_ids, self._persisted_upto(upto_timestamp))
+        return chain(persisted, pending)
+
+    def extant_aggregate_ids(self, entity_class, upto_timestamp=None):
+        # As with events, aggregates created or discarded since the unit-of-work began are not visible to it
+        pending = (event for event in self.pending_events()
+                   if upto_timestamp is None or event.timestamp < upto_timestamp)
+        persisted = self._persistent_event_store.extant_aggregate_ids(entity_class, self._persisted_upto(upto_timestamp))
+        return with_extant_changes(persisted, pending, entity_class)
+
+    def projection(self, projection_class):
+        return self._persistent_event_store.projection(projection_class)
+
+    def latest_snapshot(self, aggregate_id, upto_timestamp=None):
+        # Snapshots of changes made after the unit-of-work began are not visible to it
+        return self._persistent_event_store.latest_snapshot(aggregate_id, self._persisted_upto(upto_timestamp))
+
+    def latest_snapshots(self, aggregate_ids, upto_timestamp=None):
+        return self._persistent_event_store.latest_snapshots(aggregate_ids, self._persisted_upto(upto_timestamp))
+
+    def _persisted_upto(self, upto_timestamp):
+        """The bound of the persisted events visible to the unit-of-work, those stored before it began."""
+        persisted_upto = _next_up(self._unit_of_work._latest_timestamp)
+        if upto_timestamp is not None:
+            persisted_upto = min(persisted_upto, upto_timestamp)
+        return persisted_upto
+
     def _ensure_sorted_by_timestamp(self):
         if self._require_sort:
             self._events.sort(key=lambda event: event.timestamp)
@@ -0,0 +1,60 @@
+"""Compare the CPU cost and the size of compressed prediction history responses.
+
+Usage, from the repository root:
+
+    python -m scripts.benchmark_compression --predictions 100000 --link-mbps 10
+
+Renders a history body as GET /api/v1/predictions does, then compresses it with
+gzip and deflate at several zlib levels. For each it prints the compressed size,
+the compression time and throughput, and the time to send the body over a link
+of the given bandwidth, compressing included, next to sending it uncompressed.
+"""
+import argparse
+import json
+import random
+import time
+
+from utilities.time import utc_now
+from utilities.unique_id import make_unique_id
+from webapi.compression import compress
+from webapi.views import _render_json_history_row
+
+_LANGUAGES = ['ar', 'bg', 'ca', 'cs', 'da', 'de', 'el', 'en', 'es', 'et', 'fa', 'fi', 'fr', 'he', 'hi', 'hr',
+              'hu', 'id', 'it', 'ja', 'ko', 'lt', 'lv', 'nl', 'no', 'pl', 'pt', 'ro', 'ru', 'sk', 'sl', 'sr',
+              'sv', 'th', 'tl', 'tr', 'uk', 'ur', 'vi', 'zh']
+_WORDS = ['the', 'weather', 'today', 'is', 'lovely', 'match', 'tonight', 'great', 'news', 'from', 'our', 'team',
+          'coffee', 'morning', 'train', 'late', 'again', 'new', 'album', 'out', 'now', 'happy', 'birthday']
+
+
+def make_body(count):
+    started = utc_now()
+    rows = [(str(make_unique_id()), ' '.join(random.choice(_WORDS) for _ in range(random.randint(3, 12))),
+             random.choice(_LANGUAGES), started + i * 0.01) for i in range(count)]
+    return json.dumps([_render_json_history_row(row) for row in rows], separators=(',', ':')).encode('utf-8')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare compressed prediction history responses.")
+    parser.add_argument('--predictions', type=int, default=100000, help="number of predictions in the body")
+    parser.add_argument('--link-mbps', type=float, default=10.0, help="bandwidth of the client link in Mbit/s")
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 6, 9], help="zlib levels to compare")
+    args = parser.parse_args(argv)
+
+    body = make_body(args.predictions)
+    bytes_per_second = args.link_mbps * 1000 * 1000 / 8
+    print("{:>8} {:>5} {:>12} {:>7} {:>10} {:>9} {:>11}".format(
+        'coding', 'level', 'bytes', 'ratio', 'cpu ms', 'MB/s', 'total ms'))
+    print("{:>8} {:>5} {:>12} {:>7.1f} {:>10.1f} {:>9} {:>11.1f}".format(
+        'identity', '-', len(body), 1.0, 0.0, '-', 1000 * len(body) / bytes_per_second))
+    for coding in ('gzip', 'deflate'):
+        for level in args.levels:
+            started = time.perf_counter()
+            compressed = compress(body, coding, level)
+            elapsed = time.perf_counter() - started
+            print("{:>8} {:>5} {:>12} {:>7.1f} {:>10.1f} {:>9.1f} {:>11.1f}".format(
+                coding, level, len(compressed), len(body) / len(compressed), 1000 * elapsed,
+                len(body) / elapsed / 1e6, 1000 * (elapsed + len(compressed) / bytes_per_second)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Compare the JSON lines and binary event stores.
+
+Usage, from the repository root:
+
+    python -m scripts.benchmark_event_stores --events 100000
+
+Writes the same Prediction.Created events to a fresh store of each format, in
+chunks as units of work would, then times a full replay, a cold open and the
+loading of single aggregates through EventStore, and prints the file sizes.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from contexts.prediction.domain.model.prediction import Prediction
+from library.infrastructure_architecture.event_sourced_architecture.event_store import EventStore
+from scripts.convert_event_store import open_store
+from utilities.time import monotonic_utc_now
+from utilities.unique_id import make_unique_id
+
+_LANGUAGES = ['en-US', 'de-DE', 'pl-PL', 'fr-FR', 'es-ES', 'it-IT', 'ja-JP', 'pt-BR']
+
+
+def make_events(count):
+    events = []
+    for i in range(count):
+        prediction_id = make_unique_id()
+        events.append(Prediction.Created(timestamp=monotonic_utc_now(),
+                                         aggregate_id=prediction_id,
+                                         entity_id=prediction_id,
+                                         entity_version=0,
+                                         phrase="Sample tweet number {} about the weather".format(i),
+                                         language=random.choice(_LANGUAGES)))
+    return events
+
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return time.perf_counter() - started, result
+
+
+def benchmark(store_format, directory, events, chunk_size, lookups):
+    store_path = os.path.join(directory, 'store.' + store_format)
+    store = open_store(store_format, store_path)
+    es = EventStore(store)
+
+    def write():
+        for start in range(0, len(events), chunk_size):
+            es.extend(events[start:start + chunk_size])
+
+    write_time, _ = timed(write)
+    store.close()
+    open_time, store = timed(lambda: open_store(store_format, store_path))
+    es = EventStore(store)
+    replay_time, replayed = timed(lambda: sum(1 for _ in es))
+    assert replayed == len(events)
+    ids = [event.aggregate_id for event in random.sample(events, lookups)]
+    lookup_time, _ = timed(lambda: [list(es.events(for_aggregate_ids=[i])) for i in ids])
+    store.close()
+    return {
+        'format': store_format,
+        'bytes': os.path.getsize(store_path),
+        'write_s': write_time,
+        'open_s': open_time,
+        'replay_s': replay_time,
+        'replay_events_per_s': len(events) / replay_time,
+        'lookup_us': lookup_time / lookups * 1e6
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the JSON lines and binary event stores.")
+    parser.add_argument('--events', type=int, default=100000, help="number of events to write")
+    parser.add_argument('--chunk-size', type=int, default=100, help="events per extend, as in one unit of work")
+    parser.add_argument('--lookups', type=int, default=1000, help="single aggregates loaded by id")
+    args = parser.parse_args(argv)
+
+    events = make_events(args.events)
+    columns = ['format', 'bytes', 'write_s', 'open_s', 'replay_s', 'replay_events_per_s', 'lookup_us']
+    print(' '.join('{:>20}'.format(column) for column in columns))
+    with tempfile.TemporaryDirectory() as directory:
+        for store_format in ('json', 'binary'):
+            result = benchmark(store_format, directory, events, args.chunk_size, min(args.lookups, args.events))
+            print(' '.join('{:>20}'.format(result[column] if isinstance(result[column], (str, int))
+                                           else '{:.3f}'.format(result[column])) for column in columns))
+
+
+if __name__ == '__main__':
+    main()
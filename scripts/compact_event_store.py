@@ -0,0 +1,57 @@
+"""Drop the events of discarded aggregates from a segmented event store.
+
+Usage, from the repository root, with the API stopped:
+
+    python -m scripts.compact_event_store database/store.segments
+    python -m scripts.compact_event_store --format binary --compression lzma database/store.segments
+
+Every event of an aggregate which has been ended by a Discarded event is removed
+and the segments are rewritten, the sealed ones compressed with the given codec.
+See SegmentedStore.compact().
+"""
+import argparse
+import os
+import sys
+import time
+from functools import partial
+
+from library.domain.entity import Entity
+from library.infrastructure_architecture.event_sourced_architecture.binary_file_store import read_binary_records
+from library.infrastructure_architecture.event_sourced_architecture.event_store import read_json_records
+from library.infrastructure_architecture.event_sourced_architecture.segmented_store import SegmentedStore
+from library.infrastructure_architecture.event_sourced_architecture.transcoders import ObjectJSONDecoder
+from scripts.convert_event_store import open_store
+from utilities.identifiers import qualname_to_class
+
+_SEGMENT_SUFFIXES = {'json': '.events', 'binary': '.events.bin'}
+_RECORD_READERS = {'json': read_json_records, 'binary': read_binary_records}
+
+
+def is_discarded(record):
+    """True if the record is a Discarded event of any entity."""
+    return issubclass(qualname_to_class(record['topic']), Entity.Discarded)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drop the events of discarded aggregates from a segmented store.")
+    parser.add_argument('directory', help="path of the segmented event store, e.g. database/store.segments")
+    parser.add_argument('--format', choices=('json', 'binary'), default='json', help="format of the segments")
+    parser.add_argument('--compression', choices=('gzip', 'lzma'), default=None,
+                        help="codec for the sealed segments, as event_store_segment_compression")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.directory):
+        sys.exit("{} is not a segmented event store".format(args.directory))
+
+    started = time.monotonic()
+    store = SegmentedStore(args.directory, open_segment=partial(open_store, args.format),
+                           segment_suffix=_SEGMENT_SUFFIXES[args.format], compression=args.compression,
+                           read_records=partial(_RECORD_READERS[args.format], json_decoder_class=ObjectJSONDecoder))
+    kept, dropped = store.compact(is_discarded)
+    segments = len(store.segments())
+    store.close()
+    print("Kept {} and dropped {} events in {} segments in {:.2f}s".format(
+        kept, dropped, segments, time.monotonic() - started))
+
+
+if __name__ == '__main__':
+    main()
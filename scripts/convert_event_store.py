@@ -0,0 +1,81 @@
+"""Convert a JSON lines event store into a binary event store, or back.
+
+Usage, from the repository root, with the API stopped:
+
+    python -m scripts.convert_event_store database/store.events database/store.events.bin
+    python -m scripts.convert_event_store --to json database/store.events.bin database/store.events
+
+The destination must not exist yet. Events are copied in store order and read
+back afterwards to check that both stores hold the same records.
+"""
+import argparse
+import os
+import sys
+import time
+from itertools import islice
+
+from library.infrastructure_architecture.event_sourced_architecture.binary_file_store import BinaryFileStore
+from library.infrastructure_architecture.event_sourced_architecture.event_store import JsonFileStore, \
+    aggregate_id_key, event_timestamp_stamp
+from library.infrastructure_architecture.event_sourced_architecture.transcoders import ObjectJSONEncoder, \
+    ObjectJSONDecoder
+
+_CHUNK_SIZE = 10000
+
+
+def open_store(store_format, store_path, read_only=False):
+    if store_format == 'binary':
+        return BinaryFileStore(store_path, json_encoder_class=ObjectJSONEncoder, json_decoder_class=ObjectJSONDecoder,
+                               read_only=read_only)
+    return JsonFileStore(store_path, json_encoder_class=ObjectJSONEncoder, json_decoder_class=ObjectJSONDecoder,
+                         index_key=aggregate_id_key, index_stamp=event_timestamp_stamp, read_only=read_only)
+
+
+def convert(source, destination):
+    """Append every record of source to destination, in chunks.
+
+    Returns:
+        The number of records copied.
+    """
+    count = 0
+    records = iter(source)
+    while True:
+        chunk = list(islice(records, _CHUNK_SIZE))
+        if not chunk:
+            return count
+        destination.extend(chunk)
+        count += len(chunk)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Convert an event store between the JSON and binary formats.")
+    parser.add_argument('source', help="path of the existing event store")
+    parser.add_argument('destination', help="path of the event store to create")
+    parser.add_argument('--to', choices=('binary', 'json'), default='binary', help="format of the destination")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    if os.path.exists(args.destination):
+        sys.exit("{} already exists".format(args.destination))
+    source_format = 'json' if args.to == 'binary' else 'binary'
+
+    started = time.monotonic()
+    source = open_store(source_format, args.source)
+    destination = open_store(args.to, args.destination)
+    count = convert(source, destination)
+    destination.sync()
+
+    mismatches = sum(1 for a, b in zip(iter(source), iter(destination)) if a != b)
+    source.close()
+    destination.close()
+    if mismatches:
+        sys.exit("{} of {} records differ after conversion".format(mismatches, count))
+    print("Converted {} records from {} ({} bytes) to {} ({} bytes) in {:.2f}s".format(
+        count, args.source, os.path.getsize(args.source), args.destination, os.path.getsize(args.destination),
+        time.monotonic() - started))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import pytest
+
+from library.infrastructure_architecture.event_sourced_architecture.binary_file_store import BinaryFileStore
+from library.infrastructure_architecture.event_sourced_architecture.event_queue import EventQueue
+from library.infrastructure_architecture.event_sourced_architecture.event_queue_subscriber import EventQueueSubscriber
+from library.infrastructure_architecture.event_sourced_architecture.event_store import EventStore, JsonFileStore
+from library.infrastructure_architecture.event_sourced_architecture.transcoders import ObjectJSONEncoder, \
+    ObjectJSONDecoder
+from library.infrastructure_architecture.event_sourced_architecture.unit_of_work import UnitOfWork
+from contexts.prediction.domain.model.prediction import create_prediction, Prediction
+from infrastructure.event_sourced_repos.prediction_repository import PredictionRepository
+from scripts.convert_event_store import convert
+
+
+def binary_file_store(store_path):
+    return BinaryFileStore(store_path, json_encoder_class=ObjectJSONEncoder, json_decoder_class=ObjectJSONDecoder)
+
+
+def save_predictions(es, phrases):
+    eq = EventQueue()
+    eqs = EventQueueSubscriber(eq)
+    with UnitOfWork(eq, es) as u:
+        repo = u.using(PredictionRepository)
+        predictions = [create_prediction(phrase, "en-US") for phrase in phrases]
+        for p in predictions:
+            repo.put(p)
+    eqs.close()
+    eq.close()
+    return predictions
+
+
+def test_events_round_trip_through_a_reopened_store(tmp_path):
+    store_path = str(tmp_path / 'store.events.bin')
+    es = EventStore(binary_file_store(store_path))
+    predictions = save_predictions(es, ["Foo bar baz {}".format(i) for i in range(10)])
+    written = list(es)
+
+    reopened = EventStore(binary_file_store(store_path))
+
+    assert list(reopened) == written
+    assert list(reversed(reopened)) == written[::-1]
+    assert reopened.latest() == written[-1]
+    assert list(reopened.events_from(7)) == written[7:]
+    assert [e.phrase for e in reopened.events(for_aggregate_ids=[predictions[3].id])] == ["Foo bar baz 3"]
+    assert reopened.latest_timestamps([predictions[3].id]) == {predictions[3].id: written[3].timestamp}
+
+
+def test_records_appended_by_another_store_are_seen(tmp_path):
+    store_path = str(tmp_path / 'store.events.bin')
+    reader = EventStore(binary_file_store(store_path))
+    writer = EventStore(binary_file_store(store_path))
+
+    save_predictions(writer, ["Foo"])
+    save_predictions(reader, ["Bar"])
+    writer.append(Prediction.Discarded(aggregate_id=reader.latest().aggregate_id,
+                                       entity_id=reader.latest().aggregate_id, entity_version=1))
+
+    assert [type(e) for e in reader] == [Prediction.Created, Prediction.Created, Prediction.Discarded]
+
+
+def test_partial_and_corrupt_records(tmp_path):
+    store_path = str(tmp_path / 'store.events.bin')
+    es = EventStore(binary_file_store(store_path))
+    save_predictions(es, ["Foo", "Bar"])
+    size = len(open(store_path, 'rb').read())
+
+    with open(store_path, 'ab') as store_file:
+        store_file.write(b'\xff\x00\x00\x00\x00')
+    assert [e.phrase for e in EventStore(binary_file_store(store_path))] == ["Foo", "Bar"]
+
+    with open(store_path, 'r+b') as store_file:
+        store_file.seek(size - 3)
+        store_file.write(b'Baz')
+    with pytest.raises(ValueError):
+        list(EventStore(binary_file_store(store_path)))
+
+
+def test_a_batch_which_cannot_be_encoded_is_not_observed(tmp_path):
+    store_path = str(tmp_path / 'store.events.bin')
+    es = EventStore(binary_file_store(store_path))
+    foo = create_prediction("Foo", "en-US")
+    events = [Prediction.Created(aggregate_id=foo.id, entity_id=foo.id, entity_version=0, phrase="Foo",
+                                 language="en-US"),
+              Prediction.Discarded(aggregate_id="not a UniqueId", entity_id="not a UniqueId", entity_version=0)]
+
+    with pytest.raises(TypeError):
+        es.extend(events)
+    bar, = save_predictions(es, ["Bar"])
+
+    assert [e.aggregate_id for e in es] == [bar.id]
+    assert [e.phrase for e in EventStore(binary_file_store(store_path))] == ["Bar"]
+
+
+def test_json_store_converts_to_binary_store(tmp_path):
+    json_store = JsonFileStore(str(tmp_path / 'store.events'), json_encoder_class=ObjectJSONEncoder,
+                               json_decoder_class=ObjectJSONDecoder)
+    save_predictions(EventStore(json_store), ["Foo bar baz {}".format(i) for i in range(25)])
+    binary_store = binary_file_store(str(tmp_path / 'store.events.bin'))
+
+    assert convert(json_store, binary_store) == 25
+    assert list(binary_store) == list(json_store)
+
+
+def test_other_files_are_rejected(tmp_path):
+    store_path = tmp_path / 'store.events'
+    store_path.write_text('{"topic": "foo"}\n')
+
+    with pytest.raises(ValueError):
+        binary_file_store(str(store_path))
@@ -1,11 +1,16 @@
+import os
+
 import pytest
 
 
 from library.infrastructure_architecture.event_sourced_architecture.event_queue import EventQueue
 from library.infrastructure_architecture.event_sourced_architecture.event_queue_subscriber import EventQueueSubscriber
-from library.infrastructure_architecture.event_sourced_architecture.event_store import EventStore
+from library.infrastructure_architecture.event_sourced_architecture.event_store import EventStore, JsonFileStore, \
+    aggregate_id_key, event_timestamp_stamp
+from library.infrastructure_architecture.event_sourced_architecture.transcoders import ObjectJSONEncoder, \
+    ObjectJSONDecoder
 from library.infrastructure_architecture.event_sourced_architecture.unit_of_work import UnitOfWork, ConflictError
-from contexts.prediction.domain.model.prediction import create_prediction
+from contexts.prediction.domain.model.prediction import create_prediction, Prediction
 from infrastructure.event_sourced_repos.prediction_repository import PredictionRepository
 
 
@@ -61,3 +66,126 @@ def test_prediction_in_event_store_saving_and_retrieving_multiple():
     eq.close()
 
 
+class CountingStore(list):
+
+    def __init__(self):
+        super().__init__()
+        self.extend_calls = 0
+
+    def extend(self, objs):
+        self.extend_calls += 1
+        super().extend(objs)
+
+
+def test_predictions_in_one_unit_of_work_are_stored_in_one_append():
+    store = CountingStore()
+
+    es = EventStore(store)
+    eq = EventQueue()
+    eqs = EventQueueSubscriber(eq)
+
+    with UnitOfWork(eq, es) as u:
+        repo = u.using(PredictionRepository)
+        for x in range(10):
+            repo.put(create_prediction("Foo bar baz {index}".format(index=x), "en-US"))
+        repo.save_changes()
+
+    assert store.extend_calls == 1
+    assert len(store) == 10
+
+    eqs.close()
+    eq.close()
+
+
+def json_file_store(store_path):
+    return JsonFileStore(store_path=store_path,
+                         json_encoder_class=ObjectJSONEncoder,
+                         json_decoder_class=ObjectJSONDecoder,
+                         index_key=aggregate_id_key,
+                         index_stamp=event_timestamp_stamp)
+
+
+def test_prediction_with_id_reads_only_its_own_events(tmp_path, monkeypatch):
+    store_path = str(tmp_path / 'store.events')
+    eq = EventQueue()
+    eqs = EventQueueSubscriber(eq)
+
+    with UnitOfWork(eq, EventStore(json_file_store(store_path))) as u:
+        repo = u.using(PredictionRepository)
+        predictions = [create_prediction("Foo bar baz {index}".format(index=x), "en-US") for x in range(10)]
+        for p in predictions:
+            repo.put(p)
+
+    decoded = []
+    es = EventStore(json_file_store(store_path))
+    monkeypatch.setattr(JsonFileStore, '__iter__', None)
+    monkeypatch.setattr(es, '_dict_to_event', lambda obj, decode=es._dict_to_event: decoded.append(obj) or decode(obj))
+
+    u = UnitOfWork(eq, es)
+    u.begin()
+    p = u.using(PredictionRepository).prediction_with_id(predictions[3].id)
+
+    assert p.phrase == "Foo bar baz 3"
+    assert [obj['attributes']['phrase'] for obj in decoded] == ["Foo bar baz 9", "Foo bar baz 3"]
+
+    u.abort()
+    eqs.close()
+    eq.close()
+
+
+def test_index_is_rebuilt_when_missing_or_corrupt(tmp_path):
+    store_path = str(tmp_path / 'store.events')
+    eq = EventQueue()
+    eqs = EventQueueSubscriber(eq)
+
+    with UnitOfWork(eq, EventStore(json_file_store(store_path))) as u:
+        p = create_prediction("Foo bar baz", "en-US")
+        u.using(PredictionRepository).put(p)
+
+    for index_content in (None, 'garbage\n'):
+        os.remove(store_path + '.index')
+        if index_content is not None:
+            with open(store_path + '.index', 'w') as index_file:
+                index_file.write(index_content)
+
+        with UnitOfWork(eq, EventStore(json_file_store(store_path))) as u:
+            assert u.using(PredictionRepository).prediction_with_id(p.id).phrase == "Foo bar baz"
+
+    eqs.close()
+    eq.close()
+
+
+class EventWriter:
+    """A minimal repository which writes raw events through its unit of work."""
+
+    def __init__(self, transient_event_queue, persistent_event_store):
+        self.append = persistent_event_store.append
+
+    def save_changes(self):
+        pass
+
+
+def test_commit_detects_conflicts_from_the_index(tmp_path, monkeypatch):
+    store_path = str(tmp_path / 'store.events')
+    eq = EventQueue()
+    eqs = EventQueueSubscriber(eq)
+
+    with UnitOfWork(eq, EventStore(json_file_store(store_path))) as u:
+        p = create_prediction("Foo bar baz", "en-US")
+        u.using(PredictionRepository).put(p)
+
+    monkeypatch.setattr(JsonFileStore, '__iter__', None)
+    u = UnitOfWork(eq, EventStore(json_file_store(store_path)))
+    u.begin()
+    u.using(EventWriter).append(Prediction.Discarded(aggregate_id=p.id, entity_id=p.id, entity_version=1))
+
+    # Another process discards the prediction first
+    EventStore(json_file_store(store_path)).append(
+        Prediction.Discarded(aggregate_id=p.id, entity_id=p.id, entity_version=1))
+
+    with pytest.raises(ConflictError) as conflict:
+        u.commit()
+    assert len(conflict.value.events) == 1
+
+    eqs.close()
+    eq.close()
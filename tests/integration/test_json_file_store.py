@@ -0,0 +1,129 @@
+import multiprocessing
+
+import pytest
+
+from library.infrastructure_architecture.event_sourced_architecture import event_store
+from library.infrastructure_architecture.event_sourced_architecture.event_store import JsonFileStore
+
+
+def _append_records(store_path, worker, count):
+    store = JsonFileStore(store_path)
+    for index in range(count):
+        store.extend([{'worker': worker, 'index': index, 'padding': 'x' * 4096}] * 3)
+
+
+def test_concurrent_processes_append_whole_records(tmp_path):
+    store_path = str(tmp_path / 'store.events')
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_append_records, args=(store_path, worker, 50)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    records = list(JsonFileStore(store_path))
+
+    assert len(records) == 4 * 50 * 3
+    for worker in range(4):
+        assert [r['index'] for r in records if r['worker'] == worker] == [i for i in range(50) for _ in range(3)]
+
+
+def test_reversed_iteration_yields_newest_records_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_store, '_REVERSE_READ_BLOCK_SIZE', 7)
+    store_path = str(tmp_path / 'store.events')
+    store = JsonFileStore(store_path)
+    store.extend({'index': index, 'text': 'x' * index} for index in range(20))
+    with open(store_path, 'a') as store_file:
+        store_file.write('{"index": 20, "te')
+
+    assert [r['index'] for r in reversed(store)] == list(reversed(range(20)))
+    assert [r['index'] for r in store] == list(range(20))
+
+
+def test_reversed_iteration_of_empty_store(tmp_path):
+    store = JsonFileStore(str(tmp_path / 'store.events'))
+
+    assert list(reversed(store)) == []
+
+
+def test_latest_is_recovered_from_the_tail_on_open(tmp_path, monkeypatch):
+    store_path = str(tmp_path / 'store.events')
+    JsonFileStore(store_path).extend({'index': index} for index in range(100))
+    with open(store_path, 'a') as store_file:
+        store_file.write('{"index": 1')
+
+    monkeypatch.setattr(JsonFileStore, '__iter__', None)
+    store = JsonFileStore(store_path)
+
+    assert store.latest() == {'index': 99}
+
+
+def test_latest_follows_appends_from_other_store_instances(tmp_path):
+    store_path = str(tmp_path / 'store.events')
+    store = JsonFileStore(store_path)
+    other = JsonFileStore(store_path)
+
+    with pytest.raises(ValueError):
+        store.latest()
+
+    store.append({'index': 0})
+    other.extend([{'index': 1}, {'index': 2}])
+    assert store.latest() == {'index': 2}
+
+    store.append({'index': 3})
+    assert store.latest() == {'index': 3}
+    assert other.latest() == {'index': 3}
+    assert [r['index'] for r in store] == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize('index_key', [None, lambda r: str(r['index'] % 2)])
+def test_records_from_a_position(tmp_path, index_key):
+    store_path = str(tmp_path / 'store.events')
+    JsonFileStore(store_path).extend({'index': index} for index in range(5))
+    store = JsonFileStore(store_path, index_key=index_key)
+    JsonFileStore(store_path).extend({'index': index} for index in range(5, 8))
+
+    assert [r['index'] for r in store.records_from(3)] == [3, 4, 5, 6, 7]
+    assert list(store.records_from(8)) == []
+
+
+@pytest.mark.parametrize('index_key', [None, lambda r: str(r['index'] % 2)])
+def test_a_torn_append_is_cut_off_by_the_next_one(tmp_path, index_key):
+    store_path = str(tmp_path / 'store.events')
+    store = JsonFileStore(store_path, index_key=index_key)
+    store.extend([{'index': 0}, {'index': 1}])
+    with open(store_path, 'a') as store_file:
+        store_file.write('{"index": 2, "te')
+
+    store.extend([{'index': 3}])
+    reopened = JsonFileStore(store_path, index_key=index_key)
+    reopened.extend([{'index': 4}])
+
+    assert [r['index'] for r in JsonFileStore(store_path, index_key=index_key)] == [0, 1, 3, 4]
+    assert store.latest() == {'index': 4}
+
+
+def test_a_batch_which_cannot_be_encoded_is_not_observed(tmp_path):
+    store_path = str(tmp_path / 'store.events')
+    store = JsonFileStore(store_path, index_key=lambda r: str(r['index']))
+    store.extend([{'index': 0}])
+
+    with pytest.raises(TypeError):
+        store.extend([{'index': 1}, {'index': 2, 'value': object()}])
+    store.extend([{'index': 3}])
+
+    assert store.latest() == {'index': 3}
+    assert list(store.records_with_keys(['1', '3'])) == [{'index': 3}]
+    assert [r['index'] for r in JsonFileStore(store_path, index_key=lambda r: str(r['index']))] == [0, 3]
+
+
+def test_an_undecodable_trailing_record_is_skipped_on_open(tmp_path):
+    store_path = str(tmp_path / 'store.events')
+    JsonFileStore(store_path).extend([{'index': 0}])
+    with open(store_path, 'a') as store_file:
+        store_file.write('{"index": 1, "te{"index": 2}\n')
+
+    store = JsonFileStore(store_path)
+    assert store.latest() == {'index': 0}
+    store.extend([{'index': 3}])
+    assert [r['index'] for r in store] == [0, 3]
@@ -0,0 +1,56 @@
+import pytest
+
+from library.infrastructure_architecture.event_sourced_architecture.event_store import EventStore
+from contexts.prediction.domain.model.prediction import Prediction
+from infrastructure.read_models.language_rollups import LanguageRollups
+from utilities.unique_id import make_unique_id
+
+
+def store_prediction(es, language, timestamp):
+    prediction_id = make_unique_id()
+    es.append(Prediction.Created(aggregate_id=prediction_id, entity_id=prediction_id, entity_version=0,
+                                 phrase="Foo", language=language, timestamp=timestamp))
+
+
+def test_rollups_count_predictions_per_language_and_bucket():
+    es = EventStore([])
+    rollups = LanguageRollups(es, ['de', 'en'], resolutions={'minute': (60, 3)})
+    for language, timestamp in [('en', 600.0), ('en', 659.0), ('de', 660.0), ('xx', 720.0)]:
+        store_prediction(es, language, timestamp)
+
+    assert rollups.languages == ['de', 'en', 'other']
+    assert rollups.totals().tolist() == [1, 2, 1]
+    start, counts = rollups.window('minute')
+    assert start == 600.0
+    assert counts.tolist() == [[0, 2, 0], [1, 0, 0], [0, 0, 1]]
+    start, counts = rollups.window('minute', 2, now=780.0)
+    assert (start, counts.tolist()) == (720.0, [[0, 0, 1], [0, 0, 0]])
+
+    # The bucket of 600.0 is overwritten, later events of it are only counted in the totals
+    store_prediction(es, 'de', 780.0)
+    store_prediction(es, 'en', 601.0)
+    assert rollups.totals().tolist() == [2, 3, 1]
+    assert rollups.window('minute')[1].tolist() == [[1, 0, 0], [0, 0, 1], [1, 0, 0]]
+
+    with pytest.raises(ValueError):
+        rollups.window('minute', 4)
+    with pytest.raises(ValueError):
+        rollups.window('day')
+
+
+def test_rollups_are_restored_from_their_checkpoint(tmp_path):
+    checkpoint_path = str(tmp_path / 'language_rollups.json')
+    es = EventStore([])
+    store_prediction(es, 'en', 600.0)
+    LanguageRollups(es, ['de', 'en'], checkpoint_path=checkpoint_path).close()
+    store_prediction(es, 'de', 3600.0)
+
+    rollups = LanguageRollups(es, ['de', 'en'], checkpoint_path=checkpoint_path)
+    assert rollups.position == 2
+    assert rollups.totals().tolist() == [1, 1, 0]
+    assert rollups.window('hour', 2)[1].tolist() == [[0, 1, 0], [1, 0, 0]]
+    rollups.close()
+
+    with pytest.warns(RuntimeWarning):
+        rollups = LanguageRollups(es, ['en', 'fr'], checkpoint_path=checkpoint_path)
+    assert rollups.totals().tolist() == [1, 0, 1]
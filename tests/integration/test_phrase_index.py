@@ -0,0 +1,105 @@
+import warnings
+
+from library.infrastructure_architecture.event_sourced_architecture.event_queue import EventQueue
+from library.infrastructure_architecture.event_sourced_architecture.event_queue_subscriber import EventQueueSubscriber
+from library.infrastructure_architecture.event_sourced_architecture.event_store import EventStore
+from library.infrastructure_architecture.event_sourced_architecture.unit_of_work import UnitOfWork
+from contexts.prediction.domain.model.prediction import create_prediction, Prediction
+from infrastructure.event_sourced_repos.prediction_repository import PredictionRepository
+from infrastructure.read_models.phrase_index import PhraseIndex
+
+
+def save_predictions(eq, es, phrases):
+    u = UnitOfWork(eq, es)
+    u.begin()
+    predictions = [create_prediction(phrase, "en-US") for phrase in phrases]
+    for prediction in predictions:
+        u.using(PredictionRepository).put(prediction)
+    u.commit()
+    return predictions
+
+
+def test_predictions_with_phrase_uses_the_phrase_index():
+    es = EventStore([])
+    eq = EventQueue()
+    eqs = EventQueueSubscriber(eq)
+    index = PhraseIndex(es)
+    es.add_projection(index)
+    foo, _, foo_variant, discarded = save_predictions(
+        eq, es, ["Foo bar baz", "Qux", "foo  BAR baz", "Foo bar baz"])
+    es.append(Prediction.Discarded(aggregate_id=discarded.id, entity_id=discarded.id, entity_version=0))
+
+    assert set(index.ids_with_phrase("FOO bar baz")) == {foo.id, foo_variant.id, discarded.id}
+
+    u = UnitOfWork(eq, es)
+    u.begin()
+    unsaved = create_prediction("Foo bar baz", "en-US")
+    repository = u.using(PredictionRepository)
+    repository.put(unsaved)
+    assert {p.id for p in repository.predictions_with_phrase("Foo bar baz")} == {foo.id, unsaved.id}
+    assert [p.id for p in repository.predictions_with_phrase("Foo bar baz", [foo_variant.id, foo.id])] == [foo.id]
+    assert list(repository.predictions_with_phrase("Missing")) == []
+    u.abort()
+
+    eqs.close()
+    eq.close()
+
+
+def test_phrase_index_is_restored_from_its_checkpoint(tmp_path):
+    checkpoint_path = str(tmp_path / 'phrase_index.json')
+    es = EventStore([])
+    eq = EventQueue()
+    eqs = EventQueueSubscriber(eq)
+    foo, = save_predictions(eq, es, ["Foo"])
+    PhraseIndex(es, checkpoint_path=checkpoint_path, checkpoint_every=None).close()
+    bar, = save_predictions(eq, es, ["foo"])
+
+    index = PhraseIndex(es, checkpoint_path=checkpoint_path)
+
+    assert index.ids_with_phrase("FOO") == [foo.id, bar.id]
+
+    eqs.close()
+    eq.close()
+
+
+def test_phrases_are_not_decoded_as_type_tags(tmp_path):
+    checkpoint_path = str(tmp_path / 'phrase_index.json')
+    es = EventStore([])
+    eq = EventQueue()
+    eqs = EventQueueSubscriber(eq)
+    class_tag, module_tag = save_predictions(eq, es, ["__class__", "__module__"])
+    PhraseIndex(es, checkpoint_path=checkpoint_path, checkpoint_every=None).close()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)  # the checkpoint is used, not rebuilt
+        index = PhraseIndex(es, checkpoint_path=checkpoint_path)
+
+    assert index.position == 2
+    assert index.ids_with_phrase("__class__") == [class_tag.id]
+    assert index.ids_with_phrase("__module__") == [module_tag.id]
+
+    eqs.close()
+    eq.close()
+
+
+def test_phrase_index_keeps_the_most_recent_ids(tmp_path):
+    checkpoint_path = str(tmp_path / 'phrase_index.json')
+    es = EventStore([])
+    eq = EventQueue()
+    eqs = EventQueueSubscriber(eq)
+    index = PhraseIndex(es, max_ids=3, checkpoint_path=checkpoint_path, checkpoint_every=None)
+    es.add_projection(index)
+    foo, bar, foo_again, qux, foo_last, baz = save_predictions(eq, es, ["Foo", "Bar", "foo", "Qux", "FOO", "Baz"])
+
+    assert index.ids_with_phrase("Foo") == [foo_last.id]
+    assert index.ids_with_phrase("Bar") == []
+    assert index.ids_with_phrase("Qux") == [qux.id]
+    index.close()
+
+    restored = PhraseIndex(es, max_ids=2, checkpoint_path=checkpoint_path)
+    assert restored.ids_with_phrase("Foo") == [foo_last.id]
+    assert restored.ids_with_phrase("Qux") == []
+    assert restored.ids_with_phrase("Baz") == [baz.id]
+
+    eqs.close()
+    eq.close()
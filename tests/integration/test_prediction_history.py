@@ -0,0 +1,62 @@
+from library.infrastructure_architecture.event_sourced_architecture.event_store import EventStore
+from contexts.prediction.domain.model.prediction import Prediction
+from infrastructure.read_models.prediction_history import PredictionHistory
+from utilities.unique_id import make_unique_id
+
+
+def store_prediction(es, phrase, timestamp):
+    prediction_id = make_unique_id()
+    es.append(Prediction.Created(aggregate_id=prediction_id, entity_id=prediction_id, entity_version=0,
+                                 phrase=phrase, language="en-US", timestamp=timestamp))
+    return prediction_id
+
+
+def test_history_pages_skip_discarded_predictions():
+    es = EventStore([])
+    ids = [store_prediction(es, "Foo {}".format(i), 1000.0 + i) for i in range(5)]
+    history = PredictionHistory(es)
+    es.append(Prediction.Discarded(aggregate_id=ids[1], entity_id=ids[1], entity_version=0))
+
+    rows, cursor = history.page(limit=2)
+    assert [row[1] for row in rows] == ["Foo 0", "Foo 2"]
+    rows, cursor = history.page(limit=2, cursor=cursor)
+    assert [row[1] for row in rows] == ["Foo 3", "Foo 4"]
+    assert cursor is None
+    assert len(history) == 4
+    assert [row[1] for row in history.page(since=1003.0)[0]] == ["Foo 3", "Foo 4"]
+
+
+def test_history_is_restored_from_its_checkpoint(tmp_path):
+    checkpoint_path = str(tmp_path / 'prediction_history.json')
+    es = EventStore([])
+    ids = [store_prediction(es, "Foo {}".format(i), 1000.0 + i) for i in range(3)]
+    es.append(Prediction.Discarded(aggregate_id=ids[0], entity_id=ids[0], entity_version=0))
+    PredictionHistory(es, checkpoint_path=checkpoint_path, checkpoint_every=None).close()
+    store_prediction(es, "Bar", 1010.0)
+
+    history = PredictionHistory(es, checkpoint_path=checkpoint_path)
+
+    rows, cursor = history.page()
+    assert [row[:2] for row in rows[:2]] == [(str(ids[1]), "Foo 1"), (str(ids[2]), "Foo 2")]
+    assert rows[2][1:] == ("Bar", "en-US", 1010.0)
+
+
+def test_history_keeps_the_most_recent_rows(tmp_path):
+    checkpoint_path = str(tmp_path / 'prediction_history.json')
+    es = EventStore([])
+    history = PredictionHistory(es, max_rows=3, checkpoint_path=checkpoint_path, checkpoint_every=None)
+    ids = [store_prediction(es, "Foo {}".format(i), 1000.0 + i) for i in range(3)]
+    rows, cursor = history.page(limit=2)
+    ids += [store_prediction(es, "Foo {}".format(i), 1000.0 + i) for i in range(3, 6)]
+    es.append(Prediction.Discarded(aggregate_id=ids[4], entity_id=ids[4], entity_version=0))
+
+    assert [row[1] for row in history.page(cursor=cursor)[0]] == ["Foo 3", "Foo 5"]
+    assert [row[1] for row in history.rows_with_ids(ids)] == ["Foo 3", "Foo 5"]
+    assert len(history) == 2
+    assert history.dropped_count == 3
+    history.close()
+
+    restored = PredictionHistory(es, max_rows=2, checkpoint_path=checkpoint_path)
+    assert [row[1] for row in restored.page()[0]] == ["Foo 5"]
+    assert restored.dropped_count == 4
+    assert restored.page(limit=1, cursor=cursor) == ([(str(ids[5]), "Foo 5", "en-US", 1005.0)], None)
@@ -0,0 +1,186 @@
+import json
+import threading
+
+import pytest
+
+from library.infrastructure_architecture.event_sourced_architecture.event_queue import EventQueue
+from library.infrastructure_architecture.event_sourced_architecture.event_queue_subscriber import EventQueueSubscriber
+from library.infrastructure_architecture.event_sourced_architecture.event_store import EventStore, JsonFileStore, \
+    aggregate_id_key, event_timestamp_stamp
+from library.infrastructure_architecture.event_sourced_architecture import projections
+from library.infrastructure_architecture.event_sourced_architecture.projections import ExtantAggregateIds
+from library.infrastructure_architecture.event_sourced_architecture.transcoders import ObjectJSONEncoder, \
+    ObjectJSONDecoder
+from library.infrastructure_architecture.event_sourced_architecture.unit_of_work import UnitOfWork
+from contexts.prediction.domain.model.prediction import create_prediction, Prediction
+from infrastructure.event_sourced_repos.prediction_repository import PredictionRepository
+from utilities.unique_id import make_unique_id
+
+
+def json_file_store(store_path):
+    return JsonFileStore(store_path, json_encoder_class=ObjectJSONEncoder, json_decoder_class=ObjectJSONDecoder,
+                         index_key=aggregate_id_key, index_stamp=event_timestamp_stamp)
+
+
+def save_predictions(es, phrases):
+    eq = EventQueue()
+    eqs = EventQueueSubscriber(eq)
+    with UnitOfWork(eq, es) as u:
+        repo = u.using(PredictionRepository)
+        predictions = [create_prediction(phrase, "en-US") for phrase in phrases]
+        for p in predictions:
+            repo.put(p)
+    eqs.close()
+    eq.close()
+    return predictions
+
+
+def discard(es, prediction):
+    es.append(Prediction.Discarded(aggregate_id=prediction.id, entity_id=prediction.id, entity_version=0))
+
+
+class CountingEventStore(EventStore):
+
+    def __init__(self, store):
+        super().__init__(store)
+        self.replayed = 0
+
+    def events_from(self, position):
+        for event in super().events_from(position):
+            self.replayed += 1
+            yield event
+
+
+def test_extant_ids_follow_this_and_other_processes(tmp_path):
+    store_path = str(tmp_path / 'store.events')
+    es = EventStore(json_file_store(store_path))
+    other = EventStore(json_file_store(store_path))
+    extant = es.track_extant_aggregates(Prediction)
+    foo, bar = save_predictions(es, ["Foo", "Bar"])
+    baz, = save_predictions(other, ["Baz"])
+    discard(other, foo)
+
+    assert extant.ids() == {bar.id, baz.id}
+    assert extant.position == 4
+
+    eq = EventQueue()
+    eqs = EventQueueSubscriber(eq)
+    with UnitOfWork(eq, es) as u:
+        repo = u.using(PredictionRepository)
+        qux = create_prediction("Qux", "en-US")
+        repo.put(qux)
+        assert set(repo.prediction_ids()) == {bar.id, baz.id, qux.id}
+        assert len(repo) == 3
+        assert {p.phrase for p in repo.predictions_with_ids()} == {"Bar", "Baz", "Qux"}
+    eqs.close()
+    eq.close()
+
+
+def test_extant_ids_in_a_unit_of_work_exclude_later_changes(tmp_path):
+    store_path = str(tmp_path / 'store.events')
+    es = EventStore(json_file_store(store_path))
+    other = EventStore(json_file_store(store_path))
+    es.track_extant_aggregates(Prediction)
+    foo, bar = save_predictions(es, ["Foo", "Bar"])
+
+    eq = EventQueue()
+    with UnitOfWork(eq, es) as u:
+        repo = u.using(PredictionRepository)
+        save_predictions(other, ["Baz"])
+        discard(other, foo)
+        # Assertions raised inside the block would only abort the unit-of-work
+        prediction_ids = set(repo.prediction_ids())
+        count = len(repo)
+        phrases = {p.phrase for p in repo.predictions_with_ids()}
+    eq.close()
+
+    assert prediction_ids == {foo.id, bar.id}
+    assert count == 2
+    assert phrases == {"Foo", "Bar"}
+
+
+def test_extant_ids_as_of_a_time_undo_every_later_event_out_of_timestamp_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(projections, '_TIMESTAMP_MARK_EVERY', 2)
+    checkpoint_path = str(tmp_path / 'extant_predictions.json')
+    es = EventStore([])
+    ids = [make_unique_id() for _ in range(5)]
+    # Another process with its clock ahead stored the third prediction
+    for prediction_id, timestamp in zip(ids, [10.0, 11.0, 30.0, 20.0, 21.0]):
+        es.append(Prediction.Created(aggregate_id=prediction_id, entity_id=prediction_id, entity_version=0,
+                                     phrase="Foo", language="en-US", timestamp=timestamp))
+    es.append(Prediction.Discarded(aggregate_id=ids[0], entity_id=ids[0], entity_version=0, timestamp=22.0))
+    extant = es.track_extant_aggregates(Prediction, checkpoint_path=checkpoint_path, checkpoint_every=None)
+
+    assert es.extant_aggregate_ids(Prediction, upto_timestamp=25.0) == {ids[1], ids[3], ids[4]}
+    assert es.extant_aggregate_ids(Prediction, upto_timestamp=21.0) == {ids[0], ids[1], ids[3]}
+    assert es.extant_aggregate_ids(Prediction, upto_timestamp=11.0) == {ids[0]}
+    extant.close()
+
+    restored = ExtantAggregateIds(es, Prediction, checkpoint_path=checkpoint_path)
+    assert restored.ids(upto_timestamp=25.0) == {ids[1], ids[3], ids[4]}
+
+
+def test_projection_resumes_from_its_checkpoint(tmp_path):
+    store_path = str(tmp_path / 'store.events')
+    checkpoint_path = str(tmp_path / 'extant_predictions.json')
+    es = EventStore(json_file_store(store_path))
+    extant = es.track_extant_aggregates(Prediction, checkpoint_path=checkpoint_path, checkpoint_every=3)
+    predictions = save_predictions(es, ["Foo {}".format(i) for i in range(4)])
+    discard(es, predictions[0])
+    extant.close()
+    save_predictions(es, ["Bar"])
+
+    reopened = CountingEventStore(json_file_store(store_path))
+    resumed = reopened.track_extant_aggregates(Prediction, checkpoint_path=checkpoint_path)
+
+    assert reopened.replayed == 2  # the last checkpointed event, to check it, and the one after it
+    assert len(resumed) == 4
+    assert predictions[0].id not in resumed
+
+
+def test_periodic_checkpoints_are_saved_off_the_storing_thread(tmp_path, monkeypatch):
+    checkpoint_path = str(tmp_path / 'extant_predictions.json')
+    es = EventStore(json_file_store(str(tmp_path / 'store.events')))
+    extant = es.track_extant_aggregates(Prediction, checkpoint_path=checkpoint_path, checkpoint_every=2)
+    saving_threads = []
+    save_checkpoint = extant.save_checkpoint
+
+    def recording_save_checkpoint():
+        saving_threads.append(threading.current_thread())
+        save_checkpoint()
+
+    monkeypatch.setattr(extant, 'save_checkpoint', recording_save_checkpoint)
+    save_predictions(es, ["Foo", "Bar"])
+    extant.close()
+
+    assert saving_threads and threading.current_thread() not in saving_threads
+    with open(checkpoint_path) as checkpoint_file:
+        assert json.load(checkpoint_file)['position'] == 2
+
+
+def test_projection_is_rebuilt_when_the_store_was_rewritten(tmp_path):
+    checkpoint_path = str(tmp_path / 'extant_predictions.json')
+    es = EventStore(json_file_store(str(tmp_path / 'store.events')))
+    es.track_extant_aggregates(Prediction, checkpoint_path=checkpoint_path).close()
+    save_predictions(es, ["Foo", "Bar"])
+    es.track_extant_aggregates(Prediction, checkpoint_path=checkpoint_path).close()
+
+    rewritten = EventStore(json_file_store(str(tmp_path / 'rewritten.events')))
+    baz, = save_predictions(rewritten, ["Baz"])
+    save_predictions(rewritten, ["Qux"])
+
+    assert baz.id in rewritten.track_extant_aggregates(Prediction, checkpoint_path=checkpoint_path)
+
+
+def test_projection_is_rebuilt_when_its_checkpoint_cannot_be_decoded(tmp_path):
+    checkpoint_path = str(tmp_path / 'extant_predictions.json')
+    es = EventStore(json_file_store(str(tmp_path / 'store.events')))
+    foo, = save_predictions(es, ["Foo"])
+    with open(checkpoint_path, 'w') as checkpoint_file:
+        checkpoint_file.write('{"position": 1, "last_event": null, '
+                              '"state": {"__class__": "Missing", "__module__": "utilities.text"}}')
+
+    with pytest.warns(RuntimeWarning):
+        extant = es.track_extant_aggregates(Prediction, checkpoint_path=checkpoint_path)
+
+    assert extant.ids() == {foo.id}
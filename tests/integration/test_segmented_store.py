@@ -0,0 +1,225 @@
+import gzip
+import os
+import shutil
+from functools import partial
+
+import pytest
+
+from library.infrastructure_architecture.event_sourced_architecture.binary_file_store import BinaryFileStore, \
+    read_binary_records, read_binary_records_reversed
+from library.infrastructure_architecture.event_sourced_architecture.event_store import EventStore, JsonFileStore, \
+    aggregate_id_key, event_timestamp_stamp, read_json_records, read_json_records_reversed
+from library.infrastructure_architecture.event_sourced_architecture import segmented_store
+from library.infrastructure_architecture.event_sourced_architecture.segmented_store import SegmentedStore
+from library.infrastructure_architecture.event_sourced_architecture.transcoders import ObjectJSONEncoder, \
+    ObjectJSONDecoder
+from contexts.prediction.domain.model.prediction import Prediction
+from scripts.compact_event_store import is_discarded
+from utilities.unique_id import make_unique_id
+
+
+def plain_segmented_store(directory, open_segment=JsonFileStore, **kwargs):
+    return SegmentedStore(str(directory), open_segment=open_segment, record_timestamp=lambda r: r['t'], **kwargs)
+
+
+def test_segments_roll_over_by_size(tmp_path):
+    store = plain_segmented_store(tmp_path, max_segment_bytes=100)
+    for t in range(20):
+        store.extend([{'t': t, 'padding': 'x' * 40}])
+
+    segments = store.segments()
+    assert len(segments) == 10
+    assert all(segment['sealed'] for segment in segments[:-1])
+    assert [(s['min_timestamp'], s['max_timestamp']) for s in segments[:2]] == [(0, 1), (2, 3)]
+    assert [r['t'] for r in plain_segmented_store(tmp_path, max_segment_bytes=100)] == list(range(20))
+    assert [r['t'] for r in reversed(store)] == list(reversed(range(20)))
+    assert store.latest()['t'] == 19
+    assert [r['t'] for r in store.records_from(5)] == list(range(5, 20))
+
+
+def test_sealing_reads_only_the_records_appended_by_other_processes(tmp_path):
+    read = []
+
+    class CountingStore(JsonFileStore):
+
+        def __iter__(self):
+            for record in super().__iter__():
+                read.append(record['t'])
+                yield record
+
+        def records_from(self, position):
+            for record in super().records_from(position):
+                read.append(record['t'])
+                yield record
+
+    store = plain_segmented_store(tmp_path, open_segment=CountingStore, max_segment_bytes=100)
+    other = plain_segmented_store(tmp_path, open_segment=CountingStore, max_segment_bytes=100)
+    for t in range(0, 20, 2):
+        store.extend([{'t': t, 'padding': 'x' * 40}])
+        other.extend([{'t': t + 1, 'padding': 'x' * 40}])
+
+    assert read == list(range(19))
+    segments = store.segments()
+    assert [(s['min_timestamp'], s['max_timestamp'], s['records']) for s in segments[:2]] == [(0, 1, 2), (2, 3, 2)]
+
+
+def test_scans_up_to_a_timestamp_skip_later_segments(tmp_path):
+    store = plain_segmented_store(tmp_path, max_segment_bytes=100)
+    for t in range(20):
+        store.extend([{'t': t, 'padding': 'x' * 40}])
+
+    assert [r['t'] for r in store.records_before(5)] == [0, 1, 2, 3, 4, 5, 18, 19]
+
+
+def test_segments_roll_over_by_age(tmp_path):
+    now = [1000.0]
+    store = plain_segmented_store(tmp_path, max_segment_age=60, clock=lambda: now[0])
+    store.extend([{'t': 1}])
+    store.extend([{'t': 2}])
+    now[0] += 60
+    store.extend([{'t': 3}])
+
+    assert [s['records'] for s in store.segments()[:-1]] == [2]
+
+
+def test_manifest_is_recovered_from_segment_files(tmp_path):
+    JsonFileStore(str(tmp_path / 'store.events')).extend([{'t': 1}, {'t': 2}])
+    os.mkdir(str(tmp_path / 'store.segments'))
+    shutil.move(str(tmp_path / 'store.events'), str(tmp_path / 'store.segments' / '00000001.events'))
+
+    store = plain_segmented_store(tmp_path / 'store.segments')
+    store.extend([{'t': 3}])
+
+    assert [r['t'] for r in store] == [1, 2, 3]
+
+
+def test_compaction_drops_discarded_aggregates(tmp_path):
+    open_segment = partial(JsonFileStore, json_encoder_class=ObjectJSONEncoder, json_decoder_class=ObjectJSONDecoder,
+                           index_key=aggregate_id_key, index_stamp=event_timestamp_stamp)
+    store = SegmentedStore(str(tmp_path), open_segment=open_segment, max_segment_bytes=500)
+    es = EventStore(store)
+    ids = [make_unique_id() for _ in range(6)]
+    for i, prediction_id in enumerate(ids):
+        es.append(Prediction.Created(aggregate_id=prediction_id, entity_id=prediction_id, entity_version=0,
+                                     phrase="Foo bar baz {}".format(i), language="en-US"))
+    for prediction_id in ids[1:4]:
+        es.append(Prediction.Discarded(aggregate_id=prediction_id, entity_id=prediction_id, entity_version=1))
+    old_names = [s['name'] for s in store.segments()]
+
+    assert store.compact(is_discarded) == (3, 6)
+
+    assert [e.aggregate_id for e in EventStore(store)] == [ids[0], ids[4], ids[5]]
+    assert [e.phrase for e in es.events(for_aggregate_ids=[ids[5]])] == ["Foo bar baz 5"]
+    assert not any(name.startswith(tuple(old_names)) for name in os.listdir(str(tmp_path)))
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'lzma'])
+def test_sealed_segments_are_compressed(tmp_path, compression):
+    def open_store():
+        key = lambda r: str(r['t'] % 3)
+        return plain_segmented_store(tmp_path, open_segment=partial(JsonFileStore, index_key=key,
+                                                                    index_stamp=lambda r: r['t']),
+                                     max_segment_bytes=100, compression=compression,
+                                     read_records=read_json_records, read_records_reversed=read_json_records_reversed,
+                                     record_key=key)
+
+    store = open_store()
+    for t in range(20):
+        store.extend([{'t': t, 'padding': 'x' * 40}])
+    store.close()
+
+    store = open_store()
+    segments = store.segments()
+    assert [s.get('compression') for s in segments] == [compression] * 9 + [None]
+    assert not any(name.endswith('.events') for name in os.listdir(str(tmp_path)) if name != segments[-1]['name'])
+    assert [r['t'] for r in store] == list(range(20))
+    assert [r['t'] for r in reversed(store)] == list(reversed(range(20)))
+    assert [r['t'] for r in store.records_with_keys(['1'])] == list(range(1, 20, 3))
+    assert [r['t'] for r in store.records_from(17)] == [17, 18, 19]
+    assert store.latest_stamps_with_keys(['0', '2']) == {'0': 18, '2': 17}
+
+
+def test_compressed_segments_are_decompressed_once_for_lookups(tmp_path, monkeypatch):
+    decompressed = []
+
+    def open_gzip(path, mode):
+        if mode == 'rb':
+            decompressed.append(os.path.basename(path))
+        return gzip.open(path, mode)
+
+    def open_store():
+        key = lambda r: str(r['t'] % 3)
+        return plain_segmented_store(tmp_path, open_segment=partial(JsonFileStore, index_key=key,
+                                                                    index_stamp=lambda r: r['t']),
+                                     max_segment_bytes=100, compression='gzip', decompressed_cache_bytes=1000,
+                                     read_records=read_json_records, record_key=key)
+
+    store = open_store()
+    for t in range(5):
+        store.extend([{'t': t, 'padding': 'x' * 40}])
+    store.close()
+    monkeypatch.setitem(segmented_store._CODECS, 'gzip', ('.gz', open_gzip))
+
+    store = open_store()
+    for _ in range(3):
+        assert [r['t'] for r in store.records_with_keys(['0'])] == [0, 3]
+    assert decompressed == ['00000001.events.gz', '00000002.events.gz']
+
+
+def test_compressed_segments_are_read_backwards_without_reading_them_forwards(tmp_path):
+    read_forwards = []
+
+    def read_records(stream):
+        for record in read_json_records(stream):
+            read_forwards.append(record['t'])
+            yield record
+
+    store = plain_segmented_store(tmp_path, max_segment_bytes=200, compression='gzip', read_records=read_records,
+                                  read_records_reversed=read_json_records_reversed, record_key=lambda r: str(r['t']))
+    for t in range(6):
+        store.extend([{'t': t, 'padding': 'x' * 40}])
+    assert store.compress_sealed_segments() == 1
+    read_forwards.clear()
+
+    assert [r['t'] for r in reversed(store)] == [5, 4, 3, 2, 1, 0]
+    assert read_forwards == []
+
+
+def test_segments_compressed_while_being_read_are_not_recreated(tmp_path):
+    writer = plain_segmented_store(tmp_path, max_segment_bytes=100)
+    for t in range(6):
+        writer.extend([{'t': t, 'padding': 'x' * 40}])
+    writer.close()
+    reader = plain_segmented_store(tmp_path, read_records=read_json_records)
+    records = iter(reader)
+
+    compressor = plain_segmented_store(tmp_path, compression='gzip', read_records=read_json_records,
+                                       record_key=lambda r: str(r['t']))
+    assert compressor.compress_sealed_segments() == 2
+
+    assert [r['t'] for r in records] == list(range(6))
+    assert sorted(name for name in os.listdir(str(tmp_path)) if name.endswith('.events')) == ['00000003.events']
+    with pytest.raises(FileNotFoundError):
+        JsonFileStore(str(tmp_path / '00000001.events'), read_only=True)
+
+
+def test_compressed_binary_segments_are_read_back(tmp_path):
+    store = SegmentedStore(str(tmp_path), open_segment=partial(BinaryFileStore, json_encoder_class=ObjectJSONEncoder,
+                                                               json_decoder_class=ObjectJSONDecoder),
+                           segment_suffix='.events.bin', max_segment_bytes=200, compression='gzip',
+                           read_records=partial(read_binary_records, json_decoder_class=ObjectJSONDecoder),
+                           read_records_reversed=partial(read_binary_records_reversed,
+                                                         json_decoder_class=ObjectJSONDecoder))
+    es = EventStore(store)
+    ids = [make_unique_id() for _ in range(5)]
+    for prediction_id in ids:
+        es.append(Prediction.Created(aggregate_id=prediction_id, entity_id=prediction_id, entity_version=0,
+                                     phrase="Foo bar baz", language="en-US"))
+    store.compress_sealed_segments()
+
+    assert store.segments()[0]['compression'] == 'gzip'
+    assert [e.aggregate_id for e in es] == ids
+    assert [e.aggregate_id for e in reversed(es)] == ids[::-1]
+    assert [e.aggregate_id for e in es.events(for_aggregate_ids=[ids[0]])] == [ids[0]]
+    assert es.latest_timestamps([ids[0]]) == {ids[0]: next(iter(es)).timestamp}
+    store.close()
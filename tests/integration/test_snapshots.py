@@ -0,0 +1,126 @@
+import sys
+
+from library.infrastructure_architecture.event_sourced_architecture.event_queue import EventQueue
+from library.infrastructure_architecture.event_sourced_architecture.event_queue_subscriber import EventQueueSubscriber
+from library.infrastructure_architecture.event_sourced_architecture.event_store import EventStore, JsonFileStore
+from library.infrastructure_architecture.event_sourced_architecture.snapshots import SnapshotStore, Snapshotter
+from library.infrastructure_architecture.event_sourced_architecture.transcoders import ObjectJSONEncoder, \
+    ObjectJSONDecoder
+from library.infrastructure_architecture.event_sourced_architecture.unit_of_work import UnitOfWork
+from contexts.prediction.domain.model.prediction import create_prediction, mutate, Prediction
+from infrastructure.event_sourced_repos.prediction_repository import PredictionRepository
+
+
+def snapshot_store(store_path):
+    return SnapshotStore(JsonFileStore(store_path, json_encoder_class=ObjectJSONEncoder,
+                                       json_decoder_class=ObjectJSONDecoder))
+
+
+def save_predictions(es, phrases):
+    eq = EventQueue()
+    eqs = EventQueueSubscriber(eq)
+    with UnitOfWork(eq, es) as u:
+        repo = u.using(PredictionRepository)
+        predictions = [create_prediction(phrase, "en-US") for phrase in phrases]
+        for p in predictions:
+            repo.put(p)
+    eqs.close()
+    eq.close()
+    return predictions
+
+
+def load_predictions(es, prediction_ids):
+    eq = EventQueue()
+    with UnitOfWork(eq, es) as u:
+        predictions = list(u.using(PredictionRepository).predictions_with_ids(prediction_ids))
+    eq.close()
+    return predictions
+
+
+def test_snapshots_are_taken_every_n_events_and_reloaded(tmp_path):
+    store_path = str(tmp_path / 'store.snapshots')
+    snapshots = snapshot_store(store_path)
+    es = EventStore([], snapshot_store=snapshots)
+    es.subscribe(Snapshotter(es, snapshots, mutate, Prediction, every=1))
+
+    foo, bar = save_predictions(es, ["Foo", "Bar"])
+
+    snapshot = snapshot_store(store_path).latest(foo.id)
+    assert (snapshot.aggregate_id, snapshot.version) == (foo.id, 0)
+    restored = snapshot.entity()
+    assert (restored.id, restored.phrase, restored.language) == (foo.id, "Foo", "en-US")
+    assert restored.instance_id != foo.instance_id
+
+
+def test_aggregates_are_replayed_from_the_latest_snapshot(tmp_path):
+    records = []
+    snapshots = snapshot_store(str(tmp_path / 'store.snapshots'))
+    es = EventStore(records, snapshot_store=snapshots)
+    snapshotter = Snapshotter(es, snapshots, mutate, Prediction, every=1)
+    es.subscribe(snapshotter)
+    foo, bar = save_predictions(es, ["Foo", "Bar"])
+    es.append(Prediction.Discarded(aggregate_id=bar.id, entity_id=bar.id, entity_version=0))
+    es.unsubscribe(snapshotter)
+    # Events which came before a snapshot are no longer needed to reconstitute the aggregate
+    del records[:2]
+    es.append(Prediction.Discarded(aggregate_id=foo.id, entity_id=foo.id, entity_version=0))
+
+    loaded = {p.id: p for p in load_predictions(es, [foo.id, bar.id])}
+
+    assert (loaded[foo.id].discarded, loaded[foo.id].version) == (True, 1)
+    assert (loaded[bar.id].discarded, loaded[bar.id].version) == (True, 1)
+
+
+def test_aggregates_are_loaded_with_one_scan_of_the_store(tmp_path):
+    scans = []
+
+    class CountingEventStore(EventStore):
+
+        def events(self, for_aggregate_ids=None, upto_timestamp=None):
+            scans.append(for_aggregate_ids)
+            return super().events(for_aggregate_ids, upto_timestamp)
+
+        def latest_snapshot(self, aggregate_id, upto_timestamp=None):
+            raise AssertionError("Snapshots are looked up together")
+
+    snapshots = snapshot_store(str(tmp_path / 'store.snapshots'))
+    es = CountingEventStore([], snapshot_store=snapshots)
+    snapshotter = Snapshotter(es, snapshots, mutate, Prediction, every=1)
+    es.subscribe(snapshotter)
+    foo, bar = save_predictions(es, ["Foo", "Bar"])
+    es.unsubscribe(snapshotter)
+    baz, = save_predictions(es, ["Baz"])
+    es.append(Prediction.Discarded(aggregate_id=foo.id, entity_id=foo.id, entity_version=0))
+    del scans[:]
+
+    loaded = {p.id: p for p in load_predictions(es, [foo.id, bar.id, baz.id])}
+
+    assert len(scans) == 1
+    assert (loaded[foo.id].discarded, loaded[foo.id].version) == (True, 1)
+    assert [(loaded[p.id].phrase, loaded[p.id].discarded) for p in (bar, baz)] == [("Bar", False), ("Baz", False)]
+
+
+def test_snapshotter_counts_events_stored_before_it_was_created(tmp_path):
+    snapshots = snapshot_store(str(tmp_path / 'store.snapshots'))
+    es = EventStore([], snapshot_store=snapshots)
+    before_restart = Snapshotter(es, snapshots, mutate, Prediction, every=2)
+    es.subscribe(before_restart)
+    foo, = save_predictions(es, ["Foo"])
+    es.unsubscribe(before_restart)
+
+    es.subscribe(Snapshotter(es, snapshots, mutate, Prediction, every=2))
+    es.append(Prediction.Discarded(aggregate_id=foo.id, entity_id=foo.id, entity_version=0))
+
+    assert snapshots.latest(foo.id).version == 1
+
+
+def test_snapshotter_keeps_no_state_per_aggregate(tmp_path):
+    snapshots = snapshot_store(str(tmp_path / 'store.snapshots'))
+    es = EventStore([], snapshot_store=snapshots)
+    snapshotter = Snapshotter(es, snapshots, mutate, Prediction, every=100)
+    state_size = sum(map(sys.getsizeof, vars(snapshotter).values()))
+    es.subscribe(snapshotter)
+
+    save_predictions(es, ["Foo {}".format(i) for i in range(50)])
+
+    assert sum(map(sys.getsizeof, vars(snapshotter).values())) == state_size
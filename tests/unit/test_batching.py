@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utilities.async_helpers import run_coroutine
+from webapi.batching import MicroBatcher
+
+
+def _score(calls):
+    def predict(sentences):
+        calls.append(list(sentences))
+        return np.array([[len(sentence)] for sentence in sentences])
+    return predict
+
+
+def test_concurrent_requests_are_scored_in_one_batch():
+    calls = []
+    batcher = MicroBatcher(_score(calls), max_batch_size=64, max_wait=0.01)
+
+    async def scenario():
+        return await asyncio.gather(batcher.predict(['a', 'bb']),
+                                    batcher.predict(['ccc']),
+                                    batcher.predict(['dddd', 'eeeee']))
+
+    results = run_coroutine(scenario)
+
+    assert calls == [['a', 'bb', 'ccc', 'dddd', 'eeeee']]
+    assert [r[:, 0].tolist() for r in results] == [[1, 2], [3], [4, 5]]
+    assert batcher.metrics()['deadline_flushes'] == 1
+
+
+def test_full_batch_is_flushed_without_waiting():
+    calls = []
+    batcher = MicroBatcher(_score(calls), max_batch_size=3, max_wait=60)
+
+    async def scenario():
+        return await asyncio.wait_for(asyncio.gather(batcher.predict(['a', 'bb']),
+                                                     batcher.predict(['ccc'])), timeout=1)
+
+    results = run_coroutine(scenario)
+
+    assert calls == [['a', 'bb', 'ccc']]
+    assert [r[:, 0].tolist() for r in results] == [[1, 2], [3]]
+    assert batcher.metrics()['full_flushes'] == 1
+
+
+def test_model_error_is_sent_to_every_caller():
+    def predict(sentences):
+        raise ValueError("boom")
+    batcher = MicroBatcher(predict, max_batch_size=64, max_wait=0.001)
+
+    async def scenario():
+        return await asyncio.gather(batcher.predict(['a']), batcher.predict(['b']), return_exceptions=True)
+
+    results = run_coroutine(scenario)
+
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_model_is_called_off_the_event_loop_thread():
+    threads = []
+
+    def predict(sentences):
+        threads.append(threading.get_ident())
+        return np.zeros((len(sentences), 1))
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    batcher = MicroBatcher(predict, max_batch_size=1, max_wait=60, executor=executor)
+
+    async def scenario():
+        await batcher.predict(['a'])
+        await batcher.close()
+
+    run_coroutine(scenario)
+    executor.shutdown()
+
+    assert threads and threads[0] != threading.get_ident()
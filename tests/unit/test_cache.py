@@ -0,0 +1,61 @@
+from webapi.cache import PredictionCache, normalize_sentence
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_sentences_are_normalized():
+    assert normalize_sentence("  The brown\tFOX ") == normalize_sentence("the brown fox")
+
+
+def test_hits_and_misses_are_counted():
+    cache = PredictionCache(max_size=10, ttl=60)
+    cache.bind('model:1')
+
+    assert cache.get("Foo bar baz") is None
+    cache.put("Foo bar baz", 6)
+
+    assert cache.get("foo  bar baz") == 6
+    assert cache.metrics()['hits'] == 1
+    assert cache.metrics()['misses'] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PredictionCache(max_size=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.metrics()['evictions'] == 1
+
+
+def test_entries_expire_after_ttl():
+    clock = _Clock()
+    cache = PredictionCache(max_size=10, ttl=5, clock=clock)
+    cache.put("a", 1)
+
+    clock.now = 4.9
+    assert cache.get("a") == 1
+    clock.now = 5.0
+    assert cache.get("a") is None
+    assert cache.metrics()['expirations'] == 1
+
+
+def test_binding_another_model_version_invalidates_entries():
+    cache = PredictionCache(max_size=10, ttl=60)
+    cache.bind('model:1')
+    cache.put("a", 1)
+
+    cache.bind('model:2')
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
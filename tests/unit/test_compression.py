@@ -0,0 +1,81 @@
+import pytest
+from aiohttp import web
+
+from webapi.compression import middleware_compress, negotiate_encoding
+from webapi.streaming import JsonStreamWriter
+
+_CONFIG = {'compression_min_bytes': 1024, 'compression_executor_min_bytes': 16 * 1024, 'compression_level': 6}
+_ROWS = [{'sentence': 'Sentence number {}'.format(i), 'language': 'en-US'} for i in range(2000)]
+
+
+@pytest.mark.parametrize('accept_encoding, coding', [
+    ('gzip, deflate', 'gzip'),
+    ('deflate', 'deflate'),
+    ('gzip;q=0.5, deflate', 'deflate'),
+    ('gzip;q=0, deflate;q=0', None),
+    ('*', 'gzip'),
+    ('br', None),
+    ('', None),
+])
+def test_negotiate_encoding(accept_encoding, coding):
+    assert negotiate_encoding(accept_encoding) == coding
+
+
+async def _rows(request):
+    return web.json_response(_ROWS[:int(request.query['count'])])
+
+
+async def _streamed_rows(request):
+    writer = JsonStreamWriter(chunk_size=8 * 1024)
+    response = await writer.prepare(request)
+    for row in _ROWS:
+        await writer.write(row)
+    await writer.close()
+    return response
+
+
+async def _client(aiohttp_client):
+    app = web.Application(middlewares=[middleware_compress])
+    app['config'] = _CONFIG
+    app.router.add_get('/rows', _rows)
+    app.router.add_get('/streamed', _streamed_rows)
+    return await aiohttp_client(app)
+
+
+@pytest.mark.parametrize('count', [100, 2000])
+async def test_bodies_above_the_threshold_are_compressed(aiohttp_client, count):
+    client = await _client(aiohttp_client)
+
+    resp = await client.get('/rows', params={'count': count}, headers={'Accept-Encoding': 'gzip'})
+
+    assert await resp.json() == _ROWS[:count]
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert int(resp.headers['Content-Length']) < len(str(_ROWS[:count])) / 5
+
+
+async def test_small_bodies_are_not_compressed(aiohttp_client):
+    client = await _client(aiohttp_client)
+
+    resp = await client.get('/rows', params={'count': 1}, headers={'Accept-Encoding': 'gzip'})
+
+    assert await resp.json() == _ROWS[:1]
+    assert 'Content-Encoding' not in resp.headers
+
+
+async def test_bodies_are_not_compressed_unless_accepted(aiohttp_client):
+    client = await _client(aiohttp_client)
+
+    resp = await client.get('/rows', params={'count': 2000}, headers={'Accept-Encoding': 'identity'})
+
+    assert await resp.json() == _ROWS
+    assert 'Content-Encoding' not in resp.headers
+
+
+async def test_streamed_bodies_are_compressed(aiohttp_client):
+    client = await _client(aiohttp_client)
+
+    resp = await client.get('/streamed', headers={'Accept-Encoding': 'deflate'})
+
+    assert resp.headers['Content-Encoding'] == 'deflate'
+    assert await resp.json() == _ROWS
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+from library.infrastructure_architecture.event_sourced_architecture.group_commit import GroupCommitter, FsyncPolicy
+
+
+class BlockingStore:
+
+    def __init__(self):
+        self.syncs = 0
+        self.syncing = threading.Event()
+        self.release = threading.Event()
+
+    def sync(self):
+        self.syncs += 1
+        self.syncing.set()
+        assert self.release.wait(timeout=5)
+
+
+def test_appends_made_during_a_sync_share_the_next_sync():
+    store = BlockingStore()
+    committer = GroupCommitter(store, FsyncPolicy.always)
+
+    first = committer.durable()
+    assert store.syncing.wait(timeout=5)
+    waiting = [committer.durable() for _ in range(5)]
+    assert not first.done()
+
+    store.release.set()
+    first.result(timeout=5)
+    for future in waiting:
+        future.result(timeout=5)
+    committer.close()
+
+    assert store.syncs == 2
+    assert committer.metrics()['synced_appends'] == 6
+
+
+def test_never_policy_does_not_sync():
+    store = BlockingStore()
+    committer = GroupCommitter(store, 'never')
+
+    assert committer.durable().result(timeout=0) is None
+    committer.close()
+
+    assert store.syncs == 0
+
+
+def test_sync_error_is_sent_to_every_waiting_append():
+    class FailingStore:
+        def sync(self):
+            raise OSError("disk full")
+
+    committer = GroupCommitter(FailingStore(), FsyncPolicy.interval, interval=0.01)
+    futures = [committer.durable() for _ in range(3)]
+
+    for future in futures:
+        with pytest.raises(OSError):
+            future.result(timeout=5)
+    committer.close()
+    with pytest.raises(RuntimeError):
+        committer.durable()
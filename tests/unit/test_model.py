@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+from config.paths import Paths
+from contexts.prediction.domain.model.prediction import Prediction
+from library.infrastructure_architecture.event_sourced_architecture.event_store import EventStore
+from webapi.cache import PredictionCache
+from webapi.model import ModelBundle, load_language_labels, softmax, top_k, warm_prediction_cache
+
+
+class _Layer:
+    def __init__(self, units):
+        self.units = units
+
+
+class _Model:
+    def __init__(self, units):
+        self._layer = _Layer(units)
+
+    def get_layer(self, name):
+        assert name == 'predictions'
+        return self._layer
+
+
+def test_language_labels_are_parsed_from_mapper():
+    labels = load_language_labels(os.path.join(Paths.directories['models_dir'], 'twitter_to_lang',
+                                               'language mapper.txt'))
+    assert len(labels) == 40
+    assert labels[:3] == ['ar', 'ca', 'cs']
+    assert labels[-1] == 'zh'
+
+
+def test_model_bundle_maps_output_indices_to_labels():
+    bundle = ModelBundle('test', _Model(3), ['de', 'en', 'pl'])
+    assert bundle.languages(np.array([2, 0, 1, 1])).tolist() == ['pl', 'de', 'en', 'en']
+
+
+def test_model_bundle_rejects_label_count_mismatch():
+    with pytest.raises(ValueError):
+        ModelBundle('test', _Model(40), ['de', 'en', 'pl'])
+
+
+def test_prediction_cache_is_warmed_with_most_recent_predictions():
+    events = [Prediction.Created(aggregate_id=index, entity_id=index, entity_version=0,
+                                 phrase=phrase, language=language)
+              for index, (phrase, language) in enumerate([("old", "de"), ("Foo", "en"), ("Bar", "xx"),
+                                                          ("foo", "pl"), ("baz", "de")])]
+    es = EventStore([])
+    es.extend(events)
+    app = {'model': ModelBundle('test', _Model(3), ['de', 'en', 'pl']),
+           'prediction_cache': PredictionCache(max_size=10, ttl=60),
+           'es': es}
+
+    assert warm_prediction_cache(app, limit=2) == 2
+
+    assert app['prediction_cache'].get("FOO") == 2
+    assert app['prediction_cache'].get("baz") == 0
+    assert app['prediction_cache'].get("old") is None
+
+
+def test_top_k_orders_best_first():
+    scores = np.array([[0.1, 0.5, 0.2, 0.2],
+                       [0.7, 0.05, 0.05, 0.2]])
+
+    keys, key_scores = top_k(scores, 2)
+
+    assert keys.tolist() == [[1, 2], [0, 3]]
+    assert np.allclose(key_scores, [[0.5, 0.2], [0.7, 0.2]])
+    assert top_k(scores, 4)[0].tolist() == [[1, 2, 3, 0], [0, 3, 1, 2]]
+
+
+def test_softmax_rows_sum_to_one():
+    probabilities = softmax(np.array([[1.0, 2.0, 3.0], [1000.0, 1000.0, 0.0]]))
+
+    assert np.allclose(probabilities.sum(axis=1), 1.0)
+    assert np.allclose(probabilities[1], [0.5, 0.5, 0.0])
@@ -0,0 +1,53 @@
+import json
+
+from aiohttp import web
+
+from webapi.streaming import JsonStreamWriter, accepts_ndjson
+
+
+async def _numbers(request):
+    writer = JsonStreamWriter(ndjson=accepts_ndjson(request), chunk_size=10)
+    response = await writer.prepare(request, headers={'X-Count': '25'})
+    for number in range(25):
+        await writer.write({'n': number})
+    await writer.close()
+    return response
+
+
+async def _client(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/numbers', _numbers)
+    return await aiohttp_client(app)
+
+
+async def test_values_are_streamed_as_a_json_array(aiohttp_client):
+    client = await _client(aiohttp_client)
+
+    resp = await client.get('/numbers')
+
+    assert resp.status == 200
+    assert resp.headers['Content-Type'] == 'application/json; charset=utf-8'
+    assert resp.headers['X-Count'] == '25'
+    assert await resp.json() == [{'n': number} for number in range(25)]
+
+
+async def test_values_are_streamed_as_ndjson_when_accepted(aiohttp_client):
+    client = await _client(aiohttp_client)
+
+    resp = await client.get('/numbers', headers={'Accept': 'application/x-ndjson'})
+
+    assert resp.headers['Content-Type'].startswith('application/x-ndjson')
+    assert [json.loads(line) for line in (await resp.text()).splitlines()] == [{'n': number} for number in range(25)]
+
+
+async def test_empty_series_is_an_empty_array(aiohttp_client):
+    async def nothing(request):
+        writer = JsonStreamWriter()
+        response = await writer.prepare(request)
+        await writer.close()
+        return response
+    app = web.Application()
+    app.router.add_get('/nothing', nothing)
+    client = await aiohttp_client(app)
+
+    assert await (await client.get('/nothing')).json() == []
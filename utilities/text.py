@@ -0,0 +1,7 @@
+def normalize_sentence(sentence):
+    """Reduce a sentence to a canonical form for caching and indexing.
+
+    Case and runs of whitespace are folded, matching the lower-casing and
+    whitespace splitting done by the model's text vectorization layer.
+    """
+    return ' '.join(sentence.split()).lower()
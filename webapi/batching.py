@@ -0,0 +1,126 @@
+import asyncio
+
+
+class MicroBatcher:
+    """Coalesce sentences from concurrent requests into shared model calls.
+
+    Sentences submitted with predict() are queued until either max_batch_size
+    sentences are pending or max_wait seconds have passed since the first of
+    them was queued. The whole queue is then scored in one call on the executor,
+    so the event loop keeps serving other requests, and every caller receives
+    the rows of the output matrix which belong to its own sentences.
+
+    Example:
+
+        batcher = MicroBatcher(score_sentences, max_batch_size=64, max_wait=0.003)
+        output = await batcher.predict(['Foo bar baz', 'the brown fox'])
+    """
+
+    def __init__(self, predict, max_batch_size, max_wait, executor=None):
+        """Create a new MicroBatcher.
+
+        Args:
+            predict: A single-argument callable which accepts a list of sentences and
+                returns an array with one row of model output per sentence.
+
+            max_batch_size: The number of pending sentences which triggers an immediate flush.
+
+            max_wait: The maximum time in seconds a queued sentence waits for a flush.
+
+            executor: An optional concurrent.futures.Executor on which predict is called.
+                If None, the event loop's default executor is used.
+        """
+        self._predict = predict
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._executor = executor
+        self._in_flight = set()
+        self._pending = []  # [(sentences, future), ...]
+        self._pending_count = 0
+        self._deadline = None
+        self._requests = 0
+        self._sentences = 0
+        self._batches = 0
+        self._full_flushes = 0
+        self._deadline_flushes = 0
+
+    async def predict(self, sentences):
+        """Score sentences together with those of other concurrent callers.
+
+        Args:
+            sentences: A list of sentences to score.
+
+        Returns:
+            An array with one row of model output per sentence, in order.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((sentences, future))
+        self._pending_count += len(sentences)
+        self._requests += 1
+
+        if self._pending_count >= self._max_batch_size:
+            self._full_flushes += 1
+            self._flush()
+        elif self._deadline is None:
+            self._deadline = loop.call_later(self._max_wait, self._flush_on_deadline)
+        return await future
+
+    def metrics(self):
+        """A dictionary of counters describing the batches scored so far."""
+        return {
+            'max_batch_size': self._max_batch_size,
+            'max_wait_ms': self._max_wait * 1000.0,
+            'requests': self._requests,
+            'sentences': self._sentences,
+            'batches': self._batches,
+            'full_flushes': self._full_flushes,
+            'deadline_flushes': self._deadline_flushes,
+            'average_batch_size': self._sentences / self._batches if self._batches else 0.0,
+            'pending_sentences': self._pending_count,
+            'batches_in_flight': len(self._in_flight)
+        }
+
+    async def close(self):
+        """Score everything which is still queued and wait for all batches to finish."""
+        if self._pending:
+            self._flush()
+        if self._in_flight:
+            await asyncio.wait(self._in_flight)
+
+    def _flush_on_deadline(self):
+        self._deadline = None
+        self._deadline_flushes += 1
+        self._flush()
+
+    def _flush(self):
+        if self._deadline is not None:
+            self._deadline.cancel()
+            self._deadline = None
+
+        batch, self._pending = self._pending, []
+        self._pending_count = 0
+        sentences = [sentence for request_sentences, _ in batch for sentence in request_sentences]
+        self._batches += 1
+        self._sentences += len(sentences)
+
+        task = asyncio.ensure_future(self._score(batch, sentences))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _score(self, batch, sentences):
+        loop = asyncio.get_event_loop()
+        try:
+            output = await loop.run_in_executor(self._executor, self._predict, sentences)
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        start = 0
+        for request_sentences, future in batch:
+            end = start + len(request_sentences)
+            if not future.done():
+                future.set_result(output[start:end])
+            start = end
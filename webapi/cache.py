@@ -0,0 +1,103 @@
+import time
+from collections import OrderedDict
+
+from utilities.text import normalize_sentence
+
+
+class PredictionCache:
+    """A bounded in-process cache of predicted label indices.
+
+    Entries are keyed by the model version and the normalized sentence. The
+    least recently used entry is evicted once max_size entries are held, and
+    entries older than ttl seconds are treated as missing. Binding the cache
+    to a different model version drops every entry.
+
+    Example:
+
+        cache = PredictionCache(max_size=100000, ttl=3600)
+        cache.bind('twitter_to_lang:1618398000')
+        key = cache.get(sentence)
+        if key is None:
+            cache.put(sentence, score(sentence))
+    """
+
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        """Create an empty cache.
+
+        Args:
+            max_size: The maximum number of entries. Zero disables the cache.
+            ttl: The number of seconds after which an entry expires.
+            clock: A zero-argument callable returning the current time in seconds.
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # {(model_version, sentence): (key, expires_at)}
+        self._model_version = None
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    @property
+    def model_version(self):
+        return self._model_version
+
+    def bind(self, model_version):
+        """Associate the cache with a model version, dropping entries of any other version."""
+        if model_version != self._model_version:
+            if self._entries:
+                self._invalidations += 1
+            self._entries.clear()
+            self._model_version = model_version
+
+    def get(self, sentence):
+        """The cached label index for the sentence, or None."""
+        cache_key = (self._model_version, normalize_sentence(sentence))
+        try:
+            key, expires_at = self._entries[cache_key]
+        except KeyError:
+            self._misses += 1
+            return None
+        if expires_at <= self._clock():
+            del self._entries[cache_key]
+            self._expirations += 1
+            self._misses += 1
+            return None
+        self._entries.move_to_end(cache_key)
+        self._hits += 1
+        return key
+
+    def put(self, sentence, key):
+        """Cache the label index predicted for the sentence."""
+        if self._max_size <= 0:
+            return
+        cache_key = (self._model_version, normalize_sentence(sentence))
+        self._entries[cache_key] = (key, self._clock() + self._ttl)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def metrics(self):
+        """A dictionary of cache counters."""
+        lookups = self._hits + self._misses
+        return {
+            'model_version': self._model_version,
+            'max_size': self._max_size,
+            'ttl_seconds': self._ttl,
+            'size': len(self._entries),
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_ratio': self._hits / lookups if lookups else 0.0,
+            'evictions': self._evictions,
+            'expirations': self._expirations,
+            'invalidations': self._invalidations
+        }
@@ -0,0 +1,93 @@
+import asyncio
+import zlib
+
+from aiohttp import hdrs, web
+from aiohttp.web import ContentCoding
+
+_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}  # {coding: zlib container}
+
+
+def negotiate_encoding(accept_encoding):
+    """Choose the content coding of a response from the Accept-Encoding header of its request.
+
+    Returns:
+        'gzip' or 'deflate', whichever has the higher quality value, gzip on a tie, or None
+        if neither is acceptable.
+    """
+    qualities = {}
+    for item in accept_encoding.lower().split(','):
+        coding, *parameters = item.split(';')
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip()] = quality
+    wildcard = qualities.get('*', 0.0)
+    coding = max(('gzip', 'deflate'), key=lambda c: qualities.get(c, wildcard))
+    return coding if qualities.get(coding, wildcard) > 0.0 else None
+
+
+def compress(body, coding, level):
+    """Compress a response body with the gzip or deflate content coding."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _WBITS[coding])
+    return compressor.compress(body) + compressor.flush()
+
+
+def _add_vary(response):
+    vary = response.headers.get(hdrs.VARY)
+    if vary is None:
+        response.headers[hdrs.VARY] = hdrs.ACCEPT_ENCODING
+    elif hdrs.ACCEPT_ENCODING.lower() not in vary.lower():
+        response.headers[hdrs.VARY] = vary + ', ' + hdrs.ACCEPT_ENCODING
+
+
+def enable_stream_compression(request, response):
+    """Compress a StreamResponse if the client accepts it. Must be called before the response is prepared.
+
+    Streamed responses are bulk ones of unknown length, so compression_min_bytes only
+    decides whether they are compressed at all. aiohttp compresses each written chunk
+    larger than a few kilobytes in its executor.
+    """
+    conf = request.config_dict.get('config')
+    if conf is None or conf['compression_min_bytes'] is None:
+        return
+    _add_vary(response)
+    coding = negotiate_encoding(request.headers.get(hdrs.ACCEPT_ENCODING, ''))
+    if coding is not None:
+        response.enable_compression(ContentCoding(coding))
+
+
+@web.middleware
+async def middleware_compress(request, handler):
+    """Compress the bodies of responses at least compression_min_bytes long as negotiated.
+
+    Bodies of at least compression_executor_min_bytes are compressed in the default
+    executor, so that the event loop keeps serving other requests meanwhile. Streamed
+    responses have been sent by the time the handler returns, so they are compressed
+    by the view, with enable_stream_compression().
+    """
+    response = await handler(request)
+    conf = request.app['config']
+    min_bytes = conf['compression_min_bytes']
+    if (min_bytes is None or response.prepared or not isinstance(response, web.Response)
+            or not isinstance(response.body, (bytes, bytearray)) or len(response.body) < min_bytes
+            or hdrs.CONTENT_ENCODING in response.headers):
+        return response
+
+    _add_vary(response)
+    coding = negotiate_encoding(request.headers.get(hdrs.ACCEPT_ENCODING, ''))
+    if coding is None:
+        return response
+    body = response.body
+    if len(body) >= conf['compression_executor_min_bytes']:
+        body = await asyncio.get_running_loop().run_in_executor(None, compress, body, coding,
+                                                                conf['compression_level'])
+    else:
+        body = compress(body, coding, conf['compression_level'])
+    response.body = body
+    response.headers[hdrs.CONTENT_ENCODING] = coding
+    return response
@@ -1,8 +1,10 @@
 ##########################################################
 # Init logic for local development, testing and production
 #
+import argparse
 import asyncio
 import os
+import sys
 from aiohttp import web
 from aiohttp_route_middleware import UrlDispatcherEx
 from aiohttp_swagger3 import SwaggerDocs, SwaggerUiSettings
@@ -11,13 +13,16 @@ import aiohttp_cors
 from config.config import Config
 from config.paths import Paths
 from webapi.routes import *
+from webapi.compression import middleware_compress
+from webapi.views import NDJSON_CONTENT_TYPE
 from webapi.model import init_model, close_model
+from webapi.workers import run_workers
 
 
 def create_application():
     loop = asyncio.get_event_loop()
     app = web.Application(loop=loop)
-    subapp = web.Application(router=UrlDispatcherEx())
+    subapp = web.Application(router=UrlDispatcherEx(), middlewares=[middleware_compress])
     subapp = setup_routes(subapp)
     subapp['config'] = Config
     subapp.on_startup.append(init_model)
@@ -41,6 +46,10 @@ def setup_cors(app):
         cors.add(route)
     return app
 
+async def _ndjson_stream(request):
+    # The view consumes NDJSON bodies incrementally, so they are not read up front for validation
+    return '', True
+
 def setup_swagger(app):
     swagger = SwaggerDocs(
         app,
@@ -49,19 +58,41 @@ def setup_swagger(app):
         version="1.0.0",
         components= os.path.join(Paths.directories['webapi_dir'], "components.yaml")
     )
+    swagger.register_media_type_handler(NDJSON_CONTENT_TYPE, _ndjson_stream)
     swagger.add_routes( #TODO: Automagically add all routes
         [
             web.get("/api/v1/", get_api_status),
+            web.get("/api/v1/metrics", get_metrics),
             web.post("/api/v1/predict", predict),
-            web.get("/api/v1/predictions", get_predictions)
+            web.get("/api/v1/predictions", get_predictions),
+            web.get("/api/v1/stats", get_stats)
         ]
     )
     return app
 
-def main():
+def build_application():
     app = create_application()
     app = setup_cors(app)
     app = setup_swagger(app)
+    return app
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m webapi', description='Serve the keras-api-python web API.')
+    parser.add_argument('--workers', type=int, default=Config['webapi_workers'],
+                        help='number of pre-forked worker processes sharing the port (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    return args
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    if args.workers > 1:
+        sys.exit(run_workers(build_application,
+                             workers=args.workers,
+                             host=Config['webapi_host'],
+                             port=Config['webapi_port']))
+    app = build_application()
     web.run_app(app,
                 host=Config['webapi_host'],
                 port=Config['webapi_port'])
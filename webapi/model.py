@@ -1,37 +1,357 @@
+import ast
+import asyncio
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
 import tensorflow as tf
 from config.paths import Paths
+from contexts.prediction.domain.model.prediction import Prediction, mutate
+from infrastructure.read_models.language_rollups import LanguageRollups
+from infrastructure.read_models.phrase_index import PhraseIndex
+from infrastructure.read_models.prediction_history import PredictionHistory
+from utilities.log import Log
+from webapi.batching import MicroBatcher
+from webapi.cache import PredictionCache, normalize_sentence
 
+from library.infrastructure_architecture.event_sourced_architecture.binary_file_store import BinaryFileStore, \
+    read_binary_records, read_binary_records_reversed
 from library.infrastructure_architecture.event_sourced_architecture.event_queue import EventQueue
 from library.infrastructure_architecture.event_sourced_architecture.event_queue_subscriber import EventQueueSubscriber
-from library.infrastructure_architecture.event_sourced_architecture.event_store import JsonFileStore, EventStore
+from library.infrastructure_architecture.event_sourced_architecture.event_store import JsonFileStore, EventStore, \
+    aggregate_id_key, event_timestamp_stamp, read_json_records, read_json_records_reversed
+from library.infrastructure_architecture.event_sourced_architecture.group_commit import GroupCommitter
+from library.infrastructure_architecture.event_sourced_architecture.segmented_store import SegmentedStore
+from library.infrastructure_architecture.event_sourced_architecture.snapshots import SnapshotStore, Snapshotter
 from library.infrastructure_architecture.event_sourced_architecture.transcoders import ObjectJSONEncoder, \
     ObjectJSONDecoder
 
 
+class ModelBundle:
+    """A loaded keras model together with the labels of its output units.
+
+    Args:
+        name: The name of the model directory in resources/models.
+        model: A loaded keras model taking a batch of strings of shape (None, 1).
+        labels: A sequence of language labels, one per unit of the 'predictions' layer.
+        version: An optional string identifying the loaded revision of the model,
+            defaults to the name.
+
+    Raises:
+        ValueError: If the number of labels does not match the width of the 'predictions' layer.
+    """
+
+    def __init__(self, name, model, labels, version=None):
+        width = model.get_layer('predictions').units
+        if len(labels) != width:
+            raise ValueError("Model {} has {} output units but {} labels".format(name, width, len(labels)))
+        self._name = name
+        self._version = version if version is not None else name
+        self._model = model
+        self._labels = np.asarray(labels)
+        activation = getattr(model.get_layer('predictions'), 'activation', None)
+        self._outputs_probabilities = getattr(activation, '__name__', None) == 'softmax'
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def model(self):
+        return self._model
+
+    @property
+    def labels(self):
+        """A numpy array of labels indexable by output unit."""
+        return self._labels
+
+    def predict(self, sentences, batch_size):
+        """Score sentences, see predict_outputs()."""
+        return predict_outputs(self._model, sentences, batch_size)
+
+    def languages(self, keys):
+        """Map an array of output unit indices to an array of labels."""
+        return self._labels[keys]
+
+    def scores(self, output):
+        """Turn a matrix of model output into per-row probabilities.
+
+        The output is returned unchanged if the 'predictions' layer already applies
+        a softmax, otherwise a softmax is applied to each row.
+        """
+        if self._outputs_probabilities:
+            return output
+        return softmax(output)
+
+
+def softmax(logits):
+    """Row-wise softmax of a 2-D array."""
+    exponentials = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exponentials / exponentials.sum(axis=1, keepdims=True)
+
+
+def top_k(scores, k):
+    """Find the k highest scores in each row of a matrix.
+
+    Args:
+        scores: A 2-D array with one row per sentence.
+        k: The number of columns to select per row, at most scores.shape[1].
+
+    Returns:
+        A pair of (rows, k) arrays: the column indices and their scores, best first.
+    """
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(candidate_scores, order, axis=1)
+
+
+def load_language_labels(language_mapper_path):
+    """Read the list of labels from a model's language mapper file.
+
+    The file holds a single python assignment of a list literal to 'langs'. It is
+    parsed rather than executed.
+
+    Raises:
+        ValueError: If the file does not assign a list of labels to 'langs'.
+    """
+    with open(language_mapper_path) as mapper_file:
+        tree = ast.parse(mapper_file.read(), filename=language_mapper_path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == 'langs'
+                                                for target in node.targets):
+            return list(ast.literal_eval(node.value))
+    raise ValueError("No labels assigned to 'langs' in {}".format(language_mapper_path))
+
+
 def load_keras_model(app):
     conf = app['config']
     model_path = os.path.join(conf['root_dir'], 'resources/models/', conf['keras_model_name'])
     model = tf.keras.models.load_model(model_path)
-    app['model'] = model
+    labels = load_language_labels(os.path.join(model_path, 'language mapper.txt'))
+    version = "{}:{}".format(conf['keras_model_name'],
+                             int(os.path.getmtime(os.path.join(model_path, 'saved_model.pb'))))
+    bundle = ModelBundle(conf['keras_model_name'], model, labels, version=version)
+    app['model'] = bundle
+    if 'prediction_cache' not in app:
+        app['prediction_cache'] = PredictionCache(max_size=conf['prediction_cache_size'],
+                                                  ttl=conf['prediction_cache_ttl_seconds'])
+    app['prediction_cache'].bind(bundle.version)
+    app['inference_executor'] = ThreadPoolExecutor(max_workers=conf['inference_threads'],
+                                                   thread_name_prefix='inference')
+    app['batcher'] = MicroBatcher(partial(bundle.predict, batch_size=conf['predict_batch_size']),
+                                  max_batch_size=conf['micro_batch_max_size'],
+                                  max_wait=conf['micro_batch_max_wait_ms'] / 1000.0,
+                                  executor=app['inference_executor'])
+
+def predict_outputs(model, sentences, batch_size):
+    """Score sentences through the model with one call per chunk.
+
+    Args:
+        model: A loaded keras model taking a batch of strings of shape (None, 1).
+        sentences: A sequence of sentences to score.
+        batch_size: The maximum number of sentences passed to the model in a single call.
+
+    Returns:
+        A numpy array of shape (len(sentences), number of labels) with the model output,
+        in the same order as sentences.
+    """
+    outputs = []
+    for start in range(0, len(sentences), batch_size):
+        chunk = tf.constant(sentences[start:start + batch_size], dtype=tf.string)
+        outputs.append(np.asarray(model.predict_on_batch(chunk[:, tf.newaxis])))
+    return np.concatenate(outputs)
+
+async def predict_languages(app, sentences):
+    """Predict a language for each sentence, scoring only those missing from the cache.
+
+    Args:
+        app: The application holding the model, batcher and prediction cache.
+        sentences: A list of sentences.
+
+    Returns:
+        A list of language labels, in the same order as sentences.
+    """
+    cache = app['prediction_cache']
+    keys = np.empty(len(sentences), dtype=np.intp)
+    missing = {}  # {sentence: [position, ...]}
+    for position, sentence in enumerate(sentences):
+        key = cache.get(sentence)
+        if key is None:
+            missing.setdefault(sentence, []).append(position)
+        else:
+            keys[position] = key
+
+    if missing:
+        unique_sentences = list(missing)
+        output = await app['batcher'].predict(unique_sentences)
+        for sentence, key in zip(unique_sentences, output.argmax(axis=1).tolist()):
+            keys[missing[sentence]] = key
+            cache.put(sentence, key)
+    return app['model'].languages(keys).tolist()
+
+async def predict_top_k(app, sentences, k):
+    """Predict the k most probable languages of each sentence with their probabilities.
+
+    Scores are always computed by the model, since the prediction cache only
+    holds the most probable language.
+
+    Returns:
+        A pair of (len(sentences), k) arrays: language labels and probabilities, best first.
+    """
+    bundle = app['model']
+    if not sentences:
+        return np.empty((0, k), dtype=bundle.labels.dtype), np.empty((0, k))
+    output = await app['batcher'].predict(sentences)
+    keys, scores = top_k(bundle.scores(output), k)
+    return bundle.languages(keys), scores
+
+async def warm_up_model(app, batch_sizes):
+    """Run batches of the given sizes through the model before it serves traffic.
+
+    TensorFlow traces and allocates lazily on the first calls for each input shape,
+    which makes the first requests after a start several times slower. Running the
+    inference path once per batch size on the inference executor moves that cost to
+    startup.
+    """
+    conf = app['config']
+    bundle = app['model']
+    loop = asyncio.get_event_loop()
+    started = time.monotonic()
+    for batch_size in batch_sizes:
+        await loop.run_in_executor(app['inference_executor'], partial(bundle.predict, batch_size=conf['predict_batch_size']),
+                                   ['warm up'] * batch_size)
+    Log.info("[init_model] Warmed up model {} with batch sizes {} in {:.3f}s".format(
+        bundle.version, list(batch_sizes), time.monotonic() - started))
 
 async def init_model(app):
+    app['ready'] = False
     load_keras_model(app)
+    await warm_up_model(app, app['config']['model_warmup_batch_sizes'])
     init_event_store(app)
+    app['ready'] = True
 
 def init_event_store(app):
     conf = app['config']
-    jfs = JsonFileStore(store_path=os.path.join(Paths.directories['database_dir'], 'store.events'),
-                        json_encoder_class=ObjectJSONEncoder,
-                        json_decoder_class=ObjectJSONDecoder)
-    es = EventStore(jfs)
+    jfs = open_event_file_store(conf, Paths.directories['database_dir'])
+    snapshot_store = None
+    if conf['event_store_snapshot_every'] > 0:
+        snapshot_store = SnapshotStore(JsonFileStore(os.path.join(Paths.directories['database_dir'], 'store.snapshots'),
+                                                     json_encoder_class=ObjectJSONEncoder,
+                                                     json_decoder_class=ObjectJSONDecoder))
+    es = EventStore(jfs, snapshot_store=snapshot_store)
+    if snapshot_store is not None:
+        es.subscribe(Snapshotter(es, snapshot_store, mutate, Prediction, every=conf['event_store_snapshot_every']))
+    projections_dir = os.path.join(Paths.directories['database_dir'], 'projections')
+    os.makedirs(projections_dir, exist_ok=True)
+    app['extant_predictions'] = es.track_extant_aggregates(
+        Prediction, checkpoint_path=os.path.join(projections_dir, 'extant_predictions.json'),
+        checkpoint_every=conf['event_store_checkpoint_every'])
+    # Checkpoints of the history and the phrase index hold every prediction, so they are saved less often
+    app['prediction_history'] = PredictionHistory(
+        es, max_rows=conf['prediction_history_max_rows'],
+        checkpoint_path=os.path.join(projections_dir, 'prediction_history.json'),
+        checkpoint_every=conf['event_store_history_checkpoint_every'])
+    app['phrase_index'] = PhraseIndex(
+        es, max_ids=conf['prediction_history_max_rows'],
+        checkpoint_path=os.path.join(projections_dir, 'phrase_index.json'),
+        checkpoint_every=conf['event_store_history_checkpoint_every'])
+    es.add_projection(app['phrase_index'])
+    app['language_rollups'] = LanguageRollups(
+        es, app['model'].labels.tolist(),
+        resolutions={'minute': (60, conf['stats_minute_buckets']), 'hour': (3600, conf['stats_hour_buckets'])},
+        checkpoint_path=os.path.join(projections_dir, 'language_rollups.json'),
+        checkpoint_every=conf['event_store_checkpoint_every'])
+    app['group_committer'] = GroupCommitter(jfs, conf['event_store_fsync'],
+                                            interval=conf['event_store_fsync_interval_ms'] / 1000.0)
     eq = EventQueue()
     eqs = EventQueueSubscriber(eq)
     app['jfs'] = jfs
+    app['snapshot_store'] = snapshot_store
     app['es'] = es
     app['eq'] = eq
     app['eqs'] = eqs
+    if conf['prediction_cache_warmup_limit'] > 0:
+        warm_prediction_cache(app, conf['prediction_cache_warmup_limit'])
+
+def open_event_file_store(conf, database_dir):
+    """Open the event file store configured by event_store_format and event_store_segment_max_mb."""
+    store_format = conf['event_store_format']
+    if store_format == 'binary':
+        file_name = 'store.events.bin'
+        open_store = partial(BinaryFileStore,
+                             json_encoder_class=ObjectJSONEncoder,
+                             json_decoder_class=ObjectJSONDecoder)
+        read_records = partial(read_binary_records, json_decoder_class=ObjectJSONDecoder)
+        read_records_reversed = partial(read_binary_records_reversed, json_decoder_class=ObjectJSONDecoder)
+    elif store_format == 'json':
+        file_name = 'store.events'
+        open_store = partial(JsonFileStore,
+                             json_encoder_class=ObjectJSONEncoder,
+                             json_decoder_class=ObjectJSONDecoder,
+                             index_key=aggregate_id_key,
+                             index_stamp=event_timestamp_stamp)
+        read_records = partial(read_json_records, json_decoder_class=ObjectJSONDecoder)
+        read_records_reversed = partial(read_json_records_reversed, json_decoder_class=ObjectJSONDecoder)
+    else:
+        raise ValueError("Unknown event store format {!r}, expected 'json' or 'binary'".format(store_format))
+
+    if conf['event_store_segment_max_mb'] <= 0:
+        return open_store(os.path.join(database_dir, file_name))
+    return SegmentedStore(os.path.join(database_dir, 'store.segments'),
+                          open_segment=open_store,
+                          segment_suffix=file_name[len('store'):],
+                          max_segment_bytes=conf['event_store_segment_max_mb'] * 1024 * 1024,
+                          max_segment_age=conf['event_store_segment_max_age_hours'] * 3600,
+                          compression=conf['event_store_segment_compression'],
+                          read_records=read_records,
+                          read_records_reversed=read_records_reversed)
+
+def warm_prediction_cache(app, limit):
+    """Fill the prediction cache with the most recent predictions from the event store.
+
+    The store is read from its newest event backwards until limit distinct phrases
+    have been found, which are then cached oldest first so that the most recent are
+    the last to be evicted. Predictions whose language is not a label of the current
+    model are skipped.
+
+    Returns:
+        The number of cached phrases.
+    """
+    cache = app['prediction_cache']
+    label_keys = {label: key for key, label in enumerate(app['model'].labels.tolist())}
+    recent = {}  # {normalized phrase: key}, newest first
+    for event in reversed(app['es']):
+        if len(recent) >= limit:
+            break
+        if isinstance(event, Prediction.Created) and event.language in label_keys:
+            recent.setdefault(normalize_sentence(event.phrase), label_keys[event.language])
+
+    for phrase, key in reversed(list(recent.items())):
+        cache.put(phrase, key)
+    Log.info("[init_event_store] Warmed prediction cache with {} phrases".format(len(recent)))
+    return len(recent)
 
 async def close_model(app):
+    app['ready'] = False
+    await app['batcher'].close()
+    app['inference_executor'].shutdown(wait=True)
+    app['group_committer'].close()
+    app['extant_predictions'].close()
+    app['prediction_history'].close()
+    app['phrase_index'].close()
+    app['language_rollups'].close()
+    app['jfs'].close()
+    if app['snapshot_store'] is not None:
+        app['snapshot_store'].close()
     app['eqs'].close()
     app['eq'].close()
@@ -5,8 +5,10 @@ from aiohttp import web
 #
 from webapi.views import (
     get_api_status,
+    get_metrics,
     predict,
-    get_predictions
+    get_predictions,
+    get_stats
 )
 
 # =============================================================================
@@ -29,6 +31,8 @@ from webapi.middleware import (
 #
 def setup_routes(subapp):
     subapp.router.add_route('GET',  '/',        get_api_status)
+    subapp.router.add_route('GET',  '/metrics', get_metrics)
     subapp.router.add_route('POST', '/predict', middleware_authenticate, predict)
     subapp.router.add_route('GET',  '/predictions', middleware_authenticate, get_predictions)
+    subapp.router.add_route('GET',  '/stats',   middleware_authenticate, get_stats)
     return subapp
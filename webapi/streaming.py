@@ -0,0 +1,93 @@
+import json
+
+from aiohttp import web
+
+from webapi.compression import enable_stream_compression
+
+JSON_CONTENT_TYPE = 'application/json'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+
+def accepts_ndjson(request):
+    """True if the request asks for newline-delimited JSON in its Accept header."""
+    return NDJSON_CONTENT_TYPE in request.headers.get('Accept', '')
+
+
+class JsonStreamWriter:
+    """Stream a series of JSON values as a JSON array or as newline-delimited JSON.
+
+    Values are encoded as they are written and sent in chunks of about chunk_size
+    bytes, so neither the values nor the whole body are ever held in memory at once,
+    and the first chunk leaves before the last value has been produced. The chunks
+    are compressed if the client accepts it, see enable_stream_compression().
+
+    Once the response has started its status can no longer change, so an error while
+    values are being produced leaves a JSON array unterminated, which clients detect
+    as an invalid body.
+
+    Example:
+
+        writer = JsonStreamWriter(ndjson=accepts_ndjson(request), chunk_size=64 * 1024)
+        response = await writer.prepare(request, headers={'X-Next-Cursor': cursor})
+        for row in rows:
+            await writer.write(render(row))
+        await writer.close()
+        return response
+    """
+
+    def __init__(self, ndjson=False, chunk_size=64 * 1024):
+        self._ndjson = ndjson
+        self._chunk_size = chunk_size
+        self._response = None
+        self._buffer = []
+        self._buffered = 0
+        self._count = 0
+
+    @property
+    def content_type(self):
+        return NDJSON_CONTENT_TYPE if self._ndjson else JSON_CONTENT_TYPE
+
+    async def prepare(self, request, status=200, headers=None):
+        """Start the response, sending its status and headers.
+
+        Returns:
+            The web.StreamResponse, to be returned by the handler once close() has been awaited.
+        """
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_type = self.content_type
+        response.charset = 'utf-8'
+        enable_stream_compression(request, response)
+        await response.prepare(request)
+        self._response = response
+        if not self._ndjson:
+            self._append('[')
+        return response
+
+    async def write(self, value):
+        """Encode a value, sending the buffered chunk once it has reached chunk_size."""
+        encoded = json.dumps(value, separators=(',', ':'))
+        if self._ndjson:
+            self._append(encoded + '\n')
+        else:
+            self._append(encoded if self._count == 0 else ',' + encoded)
+        self._count += 1
+        if self._buffered >= self._chunk_size:
+            await self._flush()
+
+    async def close(self):
+        """Send the rest of the body and end the response."""
+        if not self._ndjson:
+            self._append(']')
+        await self._flush()
+        await self._response.write_eof()
+
+    def _append(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+
+    async def _flush(self):
+        if self._buffer:
+            chunk = ''.join(self._buffer).encode('utf-8')
+            self._buffer = []
+            self._buffered = 0
+            await self._response.write(chunk)
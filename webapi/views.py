@@ -1,9 +1,10 @@
+import asyncio
 import json
-import os
 from aiohttp import web
-import tensorflow as tf
-from config.paths import Paths
 from utilities.log import Log
+from utilities.time import utc_now
+from webapi.model import predict_languages, predict_top_k
+from webapi.streaming import JsonStreamWriter, NDJSON_CONTENT_TYPE, accepts_ndjson
 
 from contexts.prediction.domain.model.prediction import create_prediction
 from infrastructure.event_sourced_repos.prediction_repository import PredictionRepository
@@ -14,11 +15,64 @@ def unit_of_work(request):
     app = request.app
     return UnitOfWork(app['eq'], app['es'])
 
+_HISTORY_ROWS_PER_READ = 1000  # rows taken from the read model at a time when streaming the whole history
+
+async def _save_predictions(request, sentences, languages):
+    """Record the predictions of one request in a single unit of work and store append.
+
+    Returns once the append is durable according to the configured fsync policy. The
+    sync is shared with the appends of other requests made meanwhile. Nothing is
+    appended or synced if there are no valid predictions.
+
+    Raises:
+        web.HTTPServiceUnavailable: If the store could not be synced. The predictions
+            have been appended, and are served, but may be lost on a crash.
+    """
+    if not sentences:
+        return
+    saved_count = 0
+    with unit_of_work(request) as u:
+        prediction_repo = u.using(PredictionRepository)
+
+        for sentence, language in zip(sentences, languages):
+            try:
+                p = create_prediction(sentence, language)
+            except ValueError as value_error:
+                Log.warning("[save predictions] Not saving prediction for {!r}: {}".format(sentence, value_error))
+                continue
+            prediction_repo.put(p)
+            saved_count += 1
+        prediction_repo.save_changes()
+    if saved_count == 0:
+        return
+    try:
+        await asyncio.wrap_future(request.app['group_committer'].durable())
+    except OSError as sync_error:
+        Log.error("[save predictions] Stored predictions could not be synced to disk: {}".format(sync_error))
+        raise web.HTTPServiceUnavailable(
+            text="Predictions were stored but could not be synced to disk: {}".format(sync_error))
+
+def _scored_predictions(sentences, labels, scores, include_scores, top_k):
+    predictions = [{"sentence": sentence, "language": language}
+                   for sentence, language in zip(sentences, labels[:, 0].tolist())]
+    if include_scores:
+        for prediction, score in zip(predictions, scores[:, 0].tolist()):
+            prediction['score'] = score
+    if top_k is not None:
+        for prediction, row_labels, row_scores in zip(predictions, labels.tolist(), scores.tolist()):
+            prediction['top_k'] = [{"language": language, "score": score}
+                                   for language, score in zip(row_labels, row_scores)]
+    return predictions
+
 def _render_json_prediction(prediction):
     body = {
         "sentence": prediction['sentence'],
         "language": prediction['language']
     }
+    if 'score' in prediction:
+        body['score'] = prediction['score']
+    if 'top_k' in prediction:
+        body['top_k'] = prediction['top_k']
     return body
 
 async def get_api_status(request: web.Request) -> web.Response:
@@ -33,9 +87,40 @@ async def get_api_status(request: web.Request) -> web.Response:
             schema:
               oneOf:
                 - $ref: "#/components/schemas/ApiStatusResponse"
+      '503':
+        description: The model is not loaded and warmed up yet, or is shutting down
+        content:
+          application/json:
+            schema:
+              oneOf:
+                - $ref: "#/components/schemas/ApiStatusResponse"
     """
     Log.info("[get get_api_status] New request")
-    body = {'status': 'running'}
+    ready = request.app.get('ready', False)
+    body = {'status': 'running', 'ready': ready}
+    return web.json_response(body, status=200 if ready else 503)
+
+async def get_metrics(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get inference metrics
+    responses:
+      '200':
+        description: Counters of the inference pipeline
+        content:
+          application/json:
+            schema:
+              oneOf:
+                - $ref: "#/components/schemas/MetricsResponse"
+    """
+    Log.info("[get get_metrics] New request")
+    body = {}
+    if 'batcher' in request.app:
+        body['batching'] = request.app['batcher'].metrics()
+    if 'prediction_cache' in request.app:
+        body['prediction_cache'] = request.app['prediction_cache'].metrics()
+    if 'group_committer' in request.app:
+        body['group_commit'] = request.app['group_committer'].metrics()
     return web.json_response(body)
 
 async def predict(request: web.Request) -> web.Response:
@@ -53,6 +138,9 @@ async def predict(request: web.Request) -> web.Response:
           schema:
             oneOf:
               - $ref: "#/components/schemas/PredictionRequest"
+        application/x-ndjson:
+          schema:
+            $ref: "#/components/schemas/PredictionStreamRequest"
     responses:
       '200':
         description: Returns predicted language for phrase
@@ -61,8 +149,17 @@ async def predict(request: web.Request) -> web.Response:
             schema:
               oneOf:
                 - $ref: "#/components/schemas/PredictionResponse"
+          application/x-ndjson:
+            schema:
+              $ref: "#/components/schemas/PredictionStreamResponse"
+      '503':
+        description: The predictions were stored but could not be synced to disk, so
+          they may be lost on a crash. Retrying stores them again. A streamed response
+          which has already started ends with an error line instead
     """
     Log.info("[post predict] New request")
+    if request.content_type == NDJSON_CONTENT_TYPE:
+        return await _predict_stream(request)
     try:
         body = []
         predictions = []
@@ -71,61 +168,287 @@ async def predict(request: web.Request) -> web.Response:
         if not 'data' in payload.keys():
             raise web.HTTPBadRequest(text="Missing parameter: data")
 
-        #TODO: Move this block to a model service or into model, need more thought,
-        #TODO: as it could also save output and store model information
-        for sentence in payload['data']:
-            if not 'model' in request.app:
-                raise web.HTTPInternalServerError(reason="Missing resource: keras model")
-            output = request.app['model'].predict([sentence])
-            key = output.argmax(axis=1)[0]
-
-            language_mapper_path = os.path.join(Paths.directories['models_dir'], request.app['config']['keras_model_name'], 'language mapper.txt')
-            exec(open(language_mapper_path).read(), globals())
-            language = langs[key]
+        sentences = payload['data']
+        if not all(isinstance(sentence, str) for sentence in sentences):
+            raise web.HTTPBadRequest(text="Invalid parameter: data must be an array of strings")
+        if request.app.get('model') is None:
+            raise web.HTTPInternalServerError(reason="Missing resource: keras model")
 
-            predictions.append({"sentence": sentence,
-                                "language": language})
+        top_k = payload.get('top_k')
+        label_count = len(request.app['model'].labels)
+        if top_k is not None and (isinstance(top_k, bool) or not isinstance(top_k, int)
+                                  or not 1 <= top_k <= label_count):
+            raise web.HTTPBadRequest(
+                text="Invalid parameter: top_k must be an integer between 1 and {}".format(label_count))
+        include_scores = payload.get('include_scores', False)
+        if not isinstance(include_scores, bool):
+            raise web.HTTPBadRequest(text="Invalid parameter: include_scores must be a boolean")
 
-            with unit_of_work(request) as u:
-                prediction_repo = u.using(PredictionRepository)
+        if top_k is None and not include_scores:
+            languages = await predict_languages(request.app, sentences)
+            for sentence, language in zip(sentences, languages):
+                predictions.append({"sentence": sentence,
+                                    "language": language})
+        else:
+            labels, scores = await predict_top_k(request.app, sentences, top_k or 1)
+            languages = labels[:, 0].tolist()
+            predictions = _scored_predictions(sentences, labels, scores, include_scores, top_k)
+        await _save_predictions(request, sentences, languages)
 
-                p = create_prediction(sentence, language)
-                prediction_repo.put(p)
-                prediction_repo.save_changes()
-                
     except ValueError as value_error:
         raise web.HTTPBadRequest(text=str(value_error))
 
     [body.append(_render_json_prediction(p)) for p in predictions]
     return web.json_response(body)
 
+async def _read_sentence_chunks(request, chunk_size):
+    """Read JSON string lines from the request body, chunk_size sentences at a time.
+
+    Raises:
+        ValueError: If a line is not a JSON string.
+    """
+    chunk = []
+    while True:
+        line = await request.content.readline()
+        if not line:
+            break
+        line = line.strip()
+        if not line:
+            continue
+        sentence = json.loads(line)
+        if not isinstance(sentence, str):
+            raise ValueError("Invalid line: each line must be a JSON string")
+        chunk.append(sentence)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def _predict_stream(request):
+    """Score newline-delimited JSON sentences and stream the predictions back as NDJSON.
+
+    The body is read and scored predict_batch_size sentences at a time, so memory
+    stays bounded however large the input is. Once the response has started an
+    error can no longer change its status, so it is reported as a final
+    {"error": ...} line instead.
+    """
+    if request.app.get('model') is None:
+        raise web.HTTPInternalServerError(reason="Missing resource: keras model")
+
+    response = web.StreamResponse(headers={'Content-Type': NDJSON_CONTENT_TYPE})
+    try:
+        async for sentences in _read_sentence_chunks(request, request.app['config']['predict_batch_size']):
+            languages = await predict_languages(request.app, sentences)
+            await _save_predictions(request, sentences, languages)
+            if not response.prepared:
+                await response.prepare(request)
+            await response.write(''.join(
+                json.dumps({"sentence": sentence, "language": language}) + '\n'
+                for sentence, language in zip(sentences, languages)).encode('utf-8'))
+    except ValueError as value_error:
+        if not response.prepared:
+            raise web.HTTPBadRequest(text=str(value_error))
+        await response.write((json.dumps({"error": str(value_error)}) + '\n').encode('utf-8'))
+    except web.HTTPServiceUnavailable as unavailable:
+        if not response.prepared:
+            raise
+        await response.write((json.dumps({"error": unavailable.text}) + '\n').encode('utf-8'))
+
+    if not response.prepared:
+        await response.prepare(request)
+    await response.write_eof()
+    return response
+
+def _history_page_parameters(request):
+    """Parse the limit, cursor and since query parameters of a history request.
+
+    Raises:
+        web.HTTPBadRequest: If a parameter is invalid.
+    """
+    query = request.query
+    max_limit = request.app['config']['predictions_page_max_size']
+    limit = None
+    if 'limit' in query:
+        try:
+            limit = int(query['limit'])
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= max_limit:
+            raise web.HTTPBadRequest(
+                text="Invalid parameter: limit must be an integer between 1 and {}".format(max_limit))
+    since = None
+    if 'since' in query:
+        try:
+            since = float(query['since'])
+        except ValueError:
+            raise web.HTTPBadRequest(text="Invalid parameter: since must be a timestamp in seconds")
+    return limit, query.get('cursor'), since
+
+def _render_json_history_row(row):
+    prediction_id, phrase, language, timestamp = row
+    return {
+        "id": prediction_id,
+        "sentence": phrase,
+        "language": language,
+        "timestamp": timestamp
+    }
+
 async def get_predictions(request: web.Request) -> web.Response:
     """
     ---
     summary: Get predictions history
+    description: Predictions oldest first, streamed as a JSON array, or as one JSON
+      object per line if application/x-ndjson is accepted. With limit, one page is
+      returned and the X-Next-Cursor response header, present while more predictions
+      follow, is the cursor of the next page. With phrase, only the predictions of
+      exactly that phrase are returned, looked up in an index. If prediction_history_max_rows
+      is set, only that many most recent predictions are served and the X-Predictions-Dropped
+      response header tells how many older ones are not.
     tags:
       - predict
     security:
       - ApiKeyAuth: []
+    parameters:
+      - in: query
+        name: limit
+        schema:
+          type: integer
+          minimum: 1
+        description: The maximum number of predictions returned
+      - in: query
+        name: cursor
+        schema:
+          type: string
+        description: The X-Next-Cursor of the previous page
+      - in: query
+        name: since
+        schema:
+          type: number
+        description: Only return predictions made at or after this UTC timestamp in seconds
+      - in: query
+        name: phrase
+        schema:
+          type: string
+        description: Only return predictions of this phrase. Cannot be combined with limit or cursor
     responses:
       '200':
         description: Returns predictions history
+        headers:
+          X-Next-Cursor:
+            schema:
+              type: string
+            description: The cursor of the next page, absent on the last page
+          X-Predictions-Dropped:
+            schema:
+              type: integer
+            description: The number of the oldest predictions no longer served, absent if none
         content:
           application/json:
             schema:
               oneOf:
-                - $ref: "#/components/schemas/PredictionResponse"
+                - $ref: "#/components/schemas/PredictionHistoryResponse"
+          application/x-ndjson:
+            schema:
+              $ref: "#/components/schemas/PredictionHistoryStreamResponse"
     """
     Log.info("[get predictions] New request")
-    body = []
-    predictions_body = []
-    with unit_of_work(request) as u:
-        prediction_repo = u.using(PredictionRepository)
-        predictions = prediction_repo.predictions_with_ids()
+    limit, cursor, since = _history_page_parameters(request)
+    history = request.app['prediction_history']
+    if 'phrase' in request.query:
+        if limit is not None or cursor is not None:
+            raise web.HTTPBadRequest(text="Invalid parameter: phrase cannot be combined with limit or cursor")
+        return await _get_predictions_with_phrase(request, history, request.query['phrase'], since)
+    try:
+        # A page is bounded by predictions_page_max_size, and its next cursor must be sent before it
+        rows, next_cursor = history.page(limit=limit or _HISTORY_ROWS_PER_READ, cursor=cursor, since=since)
+    except ValueError as value_error:
+        raise web.HTTPBadRequest(text="Invalid parameter: {}".format(value_error))
 
-    for p in predictions:
-        predictions_body.append({"sentence": p.phrase,
-                                 "language": p.language})
+    headers = _dropped_predictions_headers(history)
+    if limit is not None and next_cursor is not None:
+        headers['X-Next-Cursor'] = next_cursor
+    writer = JsonStreamWriter(ndjson=accepts_ndjson(request),
+                              chunk_size=request.app['config']['stream_chunk_bytes'])
+    response = await writer.prepare(request, headers=headers)
+    while True:
+        for row in rows:
+            await writer.write(_render_json_history_row(row))
+        if limit is not None or next_cursor is None:
+            break
+        # The whole history is read from the read model a slice at a time while it is being sent
+        rows, next_cursor = history.page(limit=_HISTORY_ROWS_PER_READ, cursor=next_cursor, since=since)
+    await writer.close()
+    return response
 
-    [body.append(_render_json_prediction(p)) for p in predictions_body]
-    return web.json_response(body)
\ No newline at end of file
+async def _get_predictions_with_phrase(request, history, phrase, since):
+    # The index matches normalized phrases, the rows are filtered to the exact phrase
+    prediction_ids = request.app['phrase_index'].ids_with_phrase(phrase)
+    writer = JsonStreamWriter(ndjson=accepts_ndjson(request),
+                              chunk_size=request.app['config']['stream_chunk_bytes'])
+    response = await writer.prepare(request, headers=_dropped_predictions_headers(history))
+    for row in history.rows_with_ids(prediction_ids):
+        if row[1] == phrase and (since is None or row[3] >= since):
+            await writer.write(_render_json_history_row(row))
+    await writer.close()
+    return response
+
+def _dropped_predictions_headers(history):
+    dropped_count = history.dropped_count
+    return {'X-Predictions-Dropped': str(dropped_count)} if dropped_count else {}
+
+async def get_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get prediction counts per language
+    description: The number of predictions of each language in total and in each of the
+      most recent minutes or hours, up to now. Answered from counters kept up to date as
+      predictions are stored, so in the same time however long the history is.
+    tags:
+      - predict
+    security:
+      - ApiKeyAuth: []
+    parameters:
+      - in: query
+        name: resolution
+        schema:
+          type: string
+          enum: [minute, hour]
+          default: minute
+        description: The length of a bucket
+      - in: query
+        name: buckets
+        schema:
+          type: integer
+          minimum: 1
+        description: The number of most recent buckets returned, all those kept by default
+    responses:
+      '200':
+        description: Returns prediction counts per language
+        content:
+          application/json:
+            schema:
+              oneOf:
+                - $ref: "#/components/schemas/StatsResponse"
+    """
+    Log.info("[get stats] New request")
+    rollups = request.app['language_rollups']
+    resolution = request.query.get('resolution', 'minute')
+    count = None
+    if 'buckets' in request.query:
+        try:
+            count = int(request.query['buckets'])
+        except ValueError:
+            count = 0
+    try:
+        start, counts = rollups.window(resolution, count, now=utc_now())
+    except ValueError as value_error:
+        raise web.HTTPBadRequest(text="Invalid parameter: {}".format(value_error))
+    return web.json_response({
+        "resolution": resolution,
+        "bucket_seconds": rollups.resolutions[resolution][0],
+        "start": start,
+        "languages": rollups.languages,
+        "totals": rollups.totals().tolist(),
+        "counts": counts.tolist()
+    })
@@ -0,0 +1,112 @@
+##########################################################
+# Pre-forked serving: N worker processes, one port
+#
+import os
+import signal
+import time
+
+from aiohttp import web
+
+from utilities.log import Log
+
+
+def run_workers(create_app, workers, host, port, shutdown_timeout=30.0):
+    """Fork worker processes which all serve the same host and port.
+
+    Every worker builds its own application (and therefore loads its own model in
+    init_model) and binds its own listening socket with SO_REUSEPORT, so the kernel
+    spreads incoming connections between them. The calling process only supervises:
+    on SIGINT or SIGTERM, or as soon as any worker exits, every remaining worker is
+    sent SIGTERM, which aiohttp turns into a graceful shutdown running the cleanup
+    handlers. Workers which have not exited after shutdown_timeout seconds are killed.
+
+    Args:
+        create_app: A zero-argument callable returning the aiohttp application to serve.
+        workers: The number of worker processes.
+        host: The host to bind.
+        port: The port to bind.
+        shutdown_timeout: Seconds to wait for workers to exit before killing them.
+
+    Returns:
+        The exit status of the supervisor: 0 if every worker exited cleanly, otherwise 1.
+    """
+    pids = set()
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(create_app, host, port)
+        pids.add(pid)
+    Log.info("[workers] Started {} workers: {}".format(workers, sorted(pids)))
+
+    def request_stop(signum, frame):
+        raise _StopRequested(signum)
+
+    previous_handlers = {signum: signal.signal(signum, request_stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+    status = 0
+    try:
+        try:
+            pid, wait_status = os.wait()
+            pids.discard(pid)
+            status |= _exit_status(wait_status)
+            Log.warning("[workers] Worker {} exited, stopping the others".format(pid))
+        except _StopRequested as stop:
+            Log.info("[workers] Received signal {}, stopping workers".format(stop.args[0]))
+        for signum in previous_handlers:
+            signal.signal(signum, signal.SIG_IGN)
+        status |= _stop_workers(pids, shutdown_timeout)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+    return status
+
+
+class _StopRequested(Exception):
+    pass
+
+
+def _run_worker(create_app, host, port):
+    status = 0
+    try:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, signal.SIG_DFL)
+        web.run_app(create_app(), host=host, port=port, reuse_port=True, print=None)
+    except BaseException as exc:
+        Log.critical("[workers] Worker {} failed: {}".format(os.getpid(), exc), exc_info=True)
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def _stop_workers(pids, timeout):
+    status = 0
+    for pid in pids:
+        _signal_worker(pid, signal.SIGTERM)
+
+    deadline = time.monotonic() + timeout
+    while pids and time.monotonic() < deadline:
+        for pid in list(pids):
+            exited_pid, wait_status = os.waitpid(pid, os.WNOHANG)
+            if exited_pid == pid:
+                pids.discard(pid)
+                status |= _exit_status(wait_status)
+        time.sleep(0.1)
+
+    for pid in pids:
+        Log.warning("[workers] Worker {} did not stop in time, killing it".format(pid))
+        _signal_worker(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        status = 1
+    return status
+
+
+def _signal_worker(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def _exit_status(wait_status):
+    if os.WIFEXITED(wait_status) and os.WEXITSTATUS(wait_status) == 0:
+        return 0
+    return 1